@@ -0,0 +1,39 @@
+"""Add composite indexes for hot access paths.
+
+Revision ID: 3f1c9a7d2b10
+Revises: 1208b2732b6d
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c9a7d2b10'
+down_revision = '1208b2732b6d'
+branch_labels = None
+depends_on = None
+
+
+# (index name, table, columns)
+INDEXES = [
+    ('ix_posts_date', 'posts', ['date']),
+    ('ix_posts_author_id_date', 'posts', ['author_id', 'date']),
+    ('ix_comments_post_date', 'comments', ['post', 'date']),
+    ('ix_private_messages_pair_date', 'private_messages', ['user_from', 'user_to', 'date']),
+    ('ix_ratings_post_id_is_positive', 'ratings', ['post_id', 'is_positive']),
+    ('ix_post_tags_tag_id_post_id', 'post_tags', ['tag_id', 'post_id']),
+]
+
+
+def upgrade() -> None:
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,24 @@
+"""Add profile_photos with the avatar variants to users.
+
+Revision ID: c71b5e0d9a42
+Revises: a4e2d9c81f37
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c71b5e0d9a42'
+down_revision = 'a4e2d9c81f37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('profile_photos', sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'profile_photos')
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the data-layer functions in src/users.py.
+
+Every benchmark calls one function (writes as do/undo pairs, so the data set
+is left as it was) against the busiest rows of a seeded database and records
+the median wall time, the SQL statements issued and the rows fetched per
+call. The results are compared with a stored baseline; the command exits 1
+when a function got slower than --tolerance, issues more statements, or
+fetches noticeably more rows.
+
+The shared cache is disabled so the database path is what gets measured.
+The moderation benchmarks act as a temporary admin on temporary users
+(bench_*), created for the run and removed at the end.
+
+Usage (from the backend directory, against e.g. `seed_data.py --truncate`):
+  python bench_users.py --update-baseline      # record bench_baseline.json
+  python bench_users.py                        # compare, exit 1 on regression
+  python bench_users.py --only get_all_posts get_post_by_id
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import statistics
+import sys
+import time
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(__file__))
+
+os.environ["CACHE_URL"] = ""
+
+from sqlalchemy import event, text
+
+from src import users
+from src.db import engine, engines
+from check_query_plans import pick_ids
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+# Timing differences below this are noise whatever the relative change
+MIN_REGRESSION_MS = 1.0
+ROWS_TOLERANCE = 0.1
+BENCH_ADMIN = "bench_admin"
+BENCH_TARGETS = tuple(f"bench_target_{i}" for i in range(10))
+
+# Unique names for the rows the create_* benchmarks insert, also across runs
+_names = (f"{os.getpid() % 10000}_{n}" for n in itertools.count())
+
+
+async def drain(rows) -> int:
+    return len([row async for row in rows])
+
+
+async def execute(sql: str, **params):
+    async with engine.begin() as conn:
+        await conn.execute(text(sql), params)
+
+
+async def view_roundtrip(ids):
+    await users.record_post_view(ids["post_id"])
+    await execute("UPDATE posts SET view_count = view_count - 1 WHERE idposts = :id", id=ids["post_id"])
+
+
+async def increment_views_roundtrip(ids):
+    await users.increment_post_views(ids["post_id"])
+    await execute("UPDATE posts SET view_count = view_count - 1 WHERE idposts = :id", id=ids["post_id"])
+
+
+async def rating_roundtrip(ids):
+    await users.create_or_update_rating(ids["rater_id"], ids["post_id"], True)
+    await users.delete_rating(ids["rater_id"], ids["post_id"])
+
+
+async def comment_roundtrip(ids):
+    comment = await users.create_comment(ids["post_id"], "benchmark", ids["user_id"])
+    await users.delete_comment(comment.idcomments)
+
+
+async def post_roundtrip(ids):
+    post = await users.create_post("benchmark", "benchmark", ids["user_id"], [ids["tag_id"]])
+    await users.delete_post(post.idposts)
+
+
+async def ban_roundtrip(ids):
+    await users.ban_user(ids["rater_id"])
+    await users.unban_user(ids["rater_id"])
+
+
+async def role_roundtrip(ids):
+    await users.promote_user_to_moderator(ids["rater_id"])
+    await users.demote_user_to_user(ids["rater_id"])
+
+
+async def photo_roundtrip(ids):
+    await users.save_profile_photo(ids["rater_id"], "benchmark.jpg")
+    await users.delete_profile_photo(ids["rater_id"])
+
+
+async def user_roundtrip(ids):
+    user = await users.create_user(f"bench_user_{next(_names)}", "benchmark", "user")
+    await execute("DELETE FROM users WHERE id = :id", id=user.id)
+
+
+async def tag_roundtrip(ids):
+    tag = await users.create_tag(f"bench_{next(_names)}")
+    await execute("DELETE FROM tags WHERE idtag = :id", id=tag.idtag)
+
+
+async def message_roundtrip(ids):
+    message = await users.send_private_message(ids["user_from"], ids["user_to"], "benchmark")
+    await execute("DELETE FROM private_messages WHERE id = :id", id=message.id)
+
+
+async def bulk_ban_roundtrip(ids):
+    await users.bulk_set_banned(ids["admin_id"], ids["target_ids"], True)
+    await users.bulk_set_banned(ids["admin_id"], ids["target_ids"], False)
+
+
+async def bulk_role_roundtrip(ids):
+    await users.bulk_set_role(ids["admin_id"], ids["target_ids"], "moderator")
+    await users.bulk_set_role(ids["admin_id"], ids["target_ids"], "user")
+
+
+async def purge_roundtrip(ids):
+    # The purge is the undo; the targets get one post with a comment to delete
+    target_id = ids["target_ids"][0]
+    post = await users.create_post("benchmark", "benchmark", target_id, [ids["tag_id"]])
+    await users.create_comment(post.idposts, "benchmark", target_id)
+    await users.purge_user_content(ids["admin_id"], ids["target_ids"])
+
+
+BENCHMARKS = {
+    # Feed and post pages
+    "get_all_posts": lambda ids: users.get_all_posts(),
+    "stream_all_posts": lambda ids: drain(users.stream_all_posts()),
+    "get_post_by_id": lambda ids: users.get_post_by_id(ids["post_id"]),
+    "get_post_version": lambda ids: users.get_post_version(ids["post_id"]),
+    "get_comments_by_post": lambda ids: users.get_comments_by_post(ids["post_id"]),
+    "get_comments_version": lambda ids: users.get_comments_version(ids["post_id"]),
+    "get_comment_by_id": lambda ids: users.get_comment_by_id(ids["comment_id"]),
+    "get_post_comments_count": lambda ids: users.get_post_comments_count(ids["post_id"]),
+    "get_post_rating": lambda ids: users.get_post_rating(ids["post_id"]),
+    "user_rated_post": lambda ids: users.user_rated_post(ids["user_id"], ids["post_id"]),
+    "record_post_view": view_roundtrip,
+    "increment_post_views": increment_views_roundtrip,
+    # Tags
+    "get_all_tags": lambda ids: users.get_all_tags(),
+    "get_all_tags_with_post_counts": lambda ids: users.get_all_tags_with_post_counts(),
+    "get_tags_version": lambda ids: users.get_tags_version(),
+    "get_posts_by_tag": lambda ids: users.get_posts_by_tag(ids["tag_id"]),
+    # Users
+    "get_user_by_username": lambda ids: users.get_user_by_username(ids["username"]),
+    "get_user_by_id": lambda ids: users.get_user_by_id(ids["user_id"]),
+    "user_exists": lambda ids: users.user_exists(ids["username"]),
+    "get_all_users": lambda ids: users.get_all_users(),
+    "get_user_profile": lambda ids: users.get_user_profile(ids["user_id"]),
+    "get_user_version": lambda ids: users.get_user_version(ids["user_id"]),
+    "get_user_posts": lambda ids: users.get_user_posts(ids["user_id"]),
+    "get_user_total_rating": lambda ids: users.get_user_total_rating(ids["user_id"]),
+    # Search
+    "search_posts": lambda ids: users.search_posts("a"),
+    "stream_search_posts": lambda ids: drain(users.stream_search_posts("a")),
+    "search_users": lambda ids: users.search_users("seed"),
+    # Messages
+    "get_conversation": lambda ids: users.get_conversation(ids["user_from"], ids["user_to"]),
+    "stream_conversation": lambda ids: drain(users.stream_conversation(ids["user_from"], ids["user_to"])),
+    "get_user_conversations": lambda ids: users.get_user_conversations(ids["user_from"]),
+    # Stats
+    "get_top_posters": lambda ids: users.get_top_posters(days=7),
+    "get_top_posts": lambda ids: users.get_top_posts(days=7),
+    # Writes, each undone within the call
+    "rating_roundtrip": rating_roundtrip,
+    "comment_roundtrip": comment_roundtrip,
+    "post_roundtrip": post_roundtrip,
+    "ban_roundtrip": ban_roundtrip,
+    "role_roundtrip": role_roundtrip,
+    "photo_roundtrip": photo_roundtrip,
+    "create_user": user_roundtrip,
+    "create_tag": tag_roundtrip,
+    "send_private_message": message_roundtrip,
+    # Moderation
+    "bulk_set_banned": bulk_ban_roundtrip,
+    "bulk_set_role": bulk_role_roundtrip,
+    "purge_user_content": purge_roundtrip,
+}
+
+
+async def pick_bench_ids() -> dict:
+    async with engine.connect() as conn:
+        ids = await pick_ids(conn)
+
+        async def scalar(sql, **params):
+            return (await conn.execute(text(sql), params)).scalar()
+
+        ids["username"] = await scalar("SELECT username FROM users WHERE id = :id", id=ids["user_id"])
+        ids["comment_id"] = await scalar("SELECT max(idcomments) FROM comments WHERE post = :id", id=ids["post_id"]) or 0
+        # A plain user who has not rated the post, so the write roundtrips leave no trace
+        ids["rater_id"] = await scalar(
+            "SELECT id FROM users WHERE role = 'user' AND NOT coalesce(is_banned, false) AND profile_photo IS NULL"
+            " AND id NOT IN (SELECT user_id FROM ratings WHERE post_id = :id) ORDER BY id LIMIT 1",
+            id=ids["post_id"],
+        )
+    if not ids["post_id"] or not ids["rater_id"]:
+        raise SystemExit("✗ Database has no posts or plain users; seed it with seed_data.py first")
+
+    await remove_bench_users()
+    ids["admin_id"] = (await users.create_user(BENCH_ADMIN, "benchmark", "admin")).id
+    ids["target_ids"] = [(await users.create_user(name, "benchmark", "user")).id for name in BENCH_TARGETS]
+    return ids
+
+
+async def remove_bench_users():
+    # Their posts, comments, ratings and messages go with them (ON DELETE CASCADE)
+    await execute("DELETE FROM users WHERE username = ANY(:names)", names=[BENCH_ADMIN, *BENCH_TARGETS])
+
+
+async def measure(call, ids: dict, iterations: int, warmup: int, stats: dict) -> dict:
+    for _ in range(warmup):
+        await call(ids)
+    timings = []
+    stats.update(queries=0, rows=0)
+    for _ in range(iterations):
+        started = time.perf_counter()
+        await call(ids)
+        timings.append((time.perf_counter() - started) * 1000)
+    return {
+        "median_ms": round(statistics.median(timings), 3),
+        "min_ms": round(min(timings), 3),
+        "queries": round(stats["queries"] / iterations, 2),
+        "rows": round(stats["rows"] / iterations, 2),
+    }
+
+
+def regressions(name: str, current: dict, baseline: dict, tolerance: float) -> list:
+    found = []
+    if current["median_ms"] > baseline["median_ms"] * (1 + tolerance) and current["median_ms"] - baseline["median_ms"] > MIN_REGRESSION_MS:
+        found.append(f"median {baseline['median_ms']}ms -> {current['median_ms']}ms")
+    if current["queries"] > baseline["queries"]:
+        found.append(f"queries {baseline['queries']} -> {current['queries']}")
+    if current["rows"] > baseline["rows"] * (1 + ROWS_TOLERANCE) and current["rows"] - baseline["rows"] >= 1:
+        found.append(f"rows {baseline['rows']} -> {current['rows']}")
+    return found
+
+
+async def main(args) -> int:
+    stats = {"queries": 0, "rows": 0}
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        stats["queries"] += 1
+        # Buffered result rows of the asyncpg cursor adapter; server-side cursors report none
+        stats["rows"] += len(getattr(cursor, "_rows", ()) or ())
+
+    for eng in engines.values():
+        event.listen(eng.sync_engine, "after_cursor_execute", count)
+
+    names = args.only or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        print(f"✗ Unknown benchmarks: {', '.join(unknown)}")
+        return 2
+
+    ids = await pick_bench_ids()
+    results = {}
+    try:
+        for name in names:
+            results[name] = await measure(BENCHMARKS[name], ids, args.iterations, args.warmup, stats)
+            r = results[name]
+            print(f"  {name:32} {r['median_ms']:9.2f}ms  {r['queries']:6} queries  {r['rows']:9} rows")
+    finally:
+        for eng in engines.values():
+            event.remove(eng.sync_engine, "after_cursor_execute", count)
+        await remove_bench_users()
+        for eng in engines.values():
+            await eng.dispose()
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\n✓ Baseline for {len(results)} function(s) written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\n✗ No baseline at {args.baseline}; record one with --update-baseline")
+        return 1
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    failures = 0
+    print()
+    for name, current in results.items():
+        if name not in baseline:
+            print(f"~ {name}: no baseline")
+            continue
+        found = regressions(name, current, baseline[name], args.tolerance)
+        if found:
+            failures += 1
+            print(f"✗ {name}: {'; '.join(found)}")
+    if failures:
+        print(f"\n✗ {failures} function(s) regressed")
+        return 1
+    print(f"✓ No regressions (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown of the median")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true", help="record the results as the new baseline")
+    parser.add_argument("--only", nargs="+", metavar="NAME", help="run only these benchmarks")
+    sys.exit(asyncio.run(main(parser.parse_args())))
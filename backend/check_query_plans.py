@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Query plan regression check for the hot data-layer functions in src/users.py.
+
+Runs each hot function against a seeded database, captures the SQL it issues,
+runs EXPLAIN on every captured SELECT and fails (exit code 1) when a plan
+contains a sequential scan on a table larger than --min-rows.
+
+Usage (from the backend directory, against a database with realistic volumes):
+  python check_query_plans.py --min-rows 10000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(__file__))
+
+# Cached functions would be served from the shared cache without issuing their SELECTs
+os.environ["CACHE_URL"] = ""
+
+from sqlalchemy import event, text
+
+from src import users
+from src.db import engine, engines
+
+# Queries that are expected to read whole tables, with the reason
+ALLOWED_SEQ_SCANS = {
+    "search_posts": "ILIKE '%...%' cannot use a btree index",
+}
+
+
+def hot_calls(ids: dict) -> list:
+    """(name, coroutine factory) pairs for the hot read paths."""
+    return [
+        ("get_all_posts", lambda: users.get_all_posts()),
+        ("get_post_by_id", lambda: users.get_post_by_id(ids["post_id"])),
+        ("get_comments_by_post", lambda: users.get_comments_by_post(ids["post_id"])),
+        ("get_post_rating", lambda: users.get_post_rating(ids["post_id"])),
+        ("get_post_comments_count", lambda: users.get_post_comments_count(ids["post_id"])),
+        ("get_user_posts", lambda: users.get_user_posts(ids["user_id"])),
+        ("get_user_total_rating", lambda: users.get_user_total_rating(ids["user_id"])),
+        ("get_posts_by_tag", lambda: users.get_posts_by_tag(ids["tag_id"])),
+        ("get_all_tags_with_post_counts", lambda: users.get_all_tags_with_post_counts()),
+        ("get_conversation", lambda: users.get_conversation(ids["user_from"], ids["user_to"])),
+        ("get_user_conversations", lambda: users.get_user_conversations(ids["user_from"])),
+        ("get_top_posters", lambda: users.get_top_posters(days=7)),
+        ("get_top_posts", lambda: users.get_top_posts(days=7)),
+        ("search_posts", lambda: users.search_posts("a")),
+    ]
+
+
+async def pick_ids(conn) -> dict:
+    """Pick the busiest rows so the plans reflect the worst case."""
+    async def scalar(sql):
+        return (await conn.execute(text(sql))).scalar()
+
+    pair = (await conn.execute(text(
+        "SELECT user_from, user_to FROM private_messages GROUP BY user_from, user_to ORDER BY count(*) DESC LIMIT 1"
+    ))).first()
+    return {
+        "post_id": await scalar("SELECT post FROM comments GROUP BY post ORDER BY count(*) DESC LIMIT 1")
+        or await scalar("SELECT min(idposts) FROM posts") or 0,
+        "user_id": await scalar("SELECT author_id FROM posts GROUP BY author_id ORDER BY count(*) DESC LIMIT 1") or 0,
+        "tag_id": await scalar("SELECT tag_id FROM post_tags GROUP BY tag_id ORDER BY count(*) DESC LIMIT 1") or 0,
+        "user_from": pair.user_from if pair else 0,
+        "user_to": pair.user_to if pair else 0,
+    }
+
+
+def seq_scans(plan: dict) -> list:
+    found = []
+    if plan.get("Node Type") == "Seq Scan":
+        found.append(plan.get("Relation Name"))
+    for child in plan.get("Plans", []):
+        found.extend(seq_scans(child))
+    return found
+
+
+async def main(min_rows: int) -> int:
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            captured.append((statement, tuple(parameters or ())))
+
+    for eng in engines.values():
+        event.listen(eng.sync_engine, "before_cursor_execute", capture)
+
+    async with engine.connect() as conn:
+        ids = await pick_ids(conn)
+        table_rows = {
+            row.relname: row.reltuples
+            for row in await conn.execute(text(
+                "SELECT relname, reltuples FROM pg_class WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace"
+            ))
+        }
+
+    failures = 0
+    for name, call in hot_calls(ids):
+        captured.clear()
+        await call()
+        # One EXPLAIN per statement shape; N+1 loops repeat the same SQL with new parameters
+        statements = list({statement: params for statement, params in reversed(captured)}.items())
+        problems = []
+        async with engine.connect() as conn:
+            for statement, params in statements:
+                result = await conn.exec_driver_sql("EXPLAIN (FORMAT JSON) " + statement, params)
+                plan = result.scalar()
+                plan = json.loads(plan) if isinstance(plan, str) else plan
+                for table in seq_scans(plan[0]["Plan"]):
+                    if table_rows.get(table, 0) >= min_rows:
+                        problems.append((table, statement))
+
+        if not problems:
+            print(f"✓ {name}: {len(statements)} statement(s)")
+        elif name in ALLOWED_SEQ_SCANS:
+            print(f"~ {name}: seq scan allowed ({ALLOWED_SEQ_SCANS[name]})")
+        else:
+            failures += 1
+            for table, statement in dict.fromkeys(problems):
+                print(f"✗ {name}: Seq Scan on {table} (~{int(table_rows[table])} rows)")
+                print("    " + " ".join(statement.split()))
+
+    for eng in engines.values():
+        event.remove(eng.sync_engine, "before_cursor_execute", capture)
+        await eng.dispose()
+
+    if failures:
+        print(f"\n✗ {failures} hot function(s) fall back to sequential scans")
+        return 1
+    print("\n✓ No sequential scans on large tables")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--min-rows", type=int, default=10000, help="ignore seq scans on tables smaller than this")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.min_rows)))
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Replay a mixed traffic profile against the backend and report latency as JSON.
+
+By default the app (src.main:app) runs in-process behind httpx's ASGI
+transport, so no server is needed and every request's SQL statements are
+counted. With --url the same traffic goes to a running server instead (query
+counts are then not available).
+
+Targets are picked from the database with the same Zipf skew as real traffic:
+popular posts, active users and big tags are requested most. Seed a database
+with seed_data.py first so the numbers mean something.
+
+Usage (from the backend directory):
+  python load_test.py --duration 30 --concurrency 32 --output baseline.json
+  python load_test.py --read-only --url http://localhost:8000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from contextvars import ContextVar
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(__file__))
+
+import httpx
+from sqlalchemy import event, text
+
+from src.db import engine, engines
+from src.utils import create_session_token
+from seed_data import Zipf, WORDS
+
+# (name, weight, method, path template, needs session)
+TRAFFIC = [
+    ("feed", 10, "GET", "/posts", False),
+    ("post_detail", 20, "GET", "/posts/{post_id}", False),
+    ("post_page", 15, "GET", "/posts/{post_id}/page", True),
+    ("post_comments", 10, "GET", "/posts/{post_id}/comments", False),
+    ("post_view", 10, "POST", "/posts/{post_id}/view", False),
+    ("tags", 5, "GET", "/tags", False),
+    ("tag_posts", 5, "GET", "/tags/{tag_id}/posts", False),
+    ("user_profile", 5, "GET", "/users/{user_id}", False),
+    ("user_posts", 4, "GET", "/users/{user_id}/posts", False),
+    ("search", 4, "GET", "/posts/search?q={word}", False),
+    ("top_posts", 3, "GET", "/posts/stats/top-posts", False),
+    ("conversations", 3, "GET", "/conversations", True),
+    ("rate", 6, "POST", "/posts/{post_id}/rate", True),
+]
+WRITES = {"post_view", "rate"}
+
+_queries: ContextVar = ContextVar("load_test_queries", default=None)
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    counter = _queries.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+def percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, round(pct / 100 * len(values)) - 1))]
+
+
+async def load_targets() -> dict:
+    """Ids ordered by popularity, so Zipf rank 0 is the busiest row."""
+    async with engine.connect() as conn:
+        async def ids(sql):
+            return [row[0] for row in await conn.execute(text(sql))]
+        return {
+            "post_id": await ids("SELECT idposts FROM posts ORDER BY view_count DESC NULLS LAST LIMIT 5000"),
+            "user_id": await ids("SELECT author_id FROM posts GROUP BY author_id ORDER BY count(*) DESC LIMIT 2000"),
+            "username": await ids("SELECT username FROM users WHERE NOT coalesce(is_banned, false) ORDER BY id LIMIT 2000"),
+            "tag_id": await ids("SELECT tag_id FROM post_tags GROUP BY tag_id ORDER BY count(*) DESC"),
+        }
+
+
+class Driver:
+    def __init__(self, client: httpx.AsyncClient, targets: dict, args):
+        self.client = client
+        self.targets = targets
+        self.rng = random.Random(args.seed)
+        self.traffic = [t for t in TRAFFIC if not (args.read_only and t[0] in WRITES)]
+        if not targets["post_id"] or not targets["username"]:
+            raise SystemExit("✗ No posts or users in the database; run seed_data.py first")
+        self.samplers = {key: Zipf(self.rng, len(values), args.zipf) for key, values in targets.items() if values}
+        self.results = {name: {"latencies": [], "errors": 0, "queries": 0} for name, *_ in self.traffic}
+
+    def pick(self, key: str):
+        return self.targets[key][self.samplers[key].sample()[0]]
+
+    async def request(self, record: bool = True):
+        name, _, method, template, needs_session = self.rng.choices(self.traffic, weights=[t[1] for t in self.traffic])[0]
+        path = template.format(
+            post_id=self.pick("post_id") if "{post_id}" in template else None,
+            user_id=self.pick("user_id") if "{user_id}" in template else None,
+            tag_id=self.pick("tag_id") if "{tag_id}" in template else None,
+            word=self.rng.choice(WORDS),
+        )
+        cookies = {"session": create_session_token({"username": self.pick("username")})} if needs_session else None
+        data = {"is_positive": self.rng.choice(["true", "false"])} if name == "rate" else None
+
+        counter = [0]
+        token = _queries.set(counter)
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, path, cookies=cookies, data=data)
+            failed = response.status_code >= 500
+        except Exception:
+            failed = True
+        finally:
+            _queries.reset(token)
+        elapsed = time.perf_counter() - started
+        if record:
+            result = self.results[name]
+            result["latencies"].append(elapsed)
+            result["errors"] += failed
+            result["queries"] += counter[0]
+
+    async def worker(self, deadline: float):
+        while time.perf_counter() < deadline:
+            await self.request()
+
+
+def report(driver: Driver, wall: float, args) -> dict:
+    endpoints = {}
+    all_latencies = []
+    for name, result in driver.results.items():
+        latencies = sorted(result["latencies"])
+        all_latencies.extend(latencies)
+        if not latencies:
+            continue
+        endpoints[name] = {
+            "requests": len(latencies),
+            "errors": result["errors"],
+            "throughput_rps": round(len(latencies) / wall, 1),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+            "queries_per_request": None if args.url else round(result["queries"] / len(latencies), 2),
+        }
+    all_latencies.sort()
+    return {
+        "config": {
+            "target": args.url or "in-process",
+            "duration_s": args.duration,
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+            "zipf": args.zipf,
+            "read_only": args.read_only,
+        },
+        "total": {
+            "requests": len(all_latencies),
+            "errors": sum(r["errors"] for r in driver.results.values()),
+            "throughput_rps": round(len(all_latencies) / wall, 1),
+            "p50_ms": round(percentile(all_latencies, 50) * 1000, 2),
+            "p95_ms": round(percentile(all_latencies, 95) * 1000, 2),
+            "p99_ms": round(percentile(all_latencies, 99) * 1000, 2),
+        },
+        "endpoints": endpoints,
+    }
+
+
+async def run(client: httpx.AsyncClient, args) -> dict:
+    driver = Driver(client, await load_targets(), args)
+    for _ in range(args.warmup):
+        await driver.request(record=False)
+    started = time.perf_counter()
+    deadline = started + args.duration
+    await asyncio.gather(*(driver.worker(deadline) for _ in range(args.concurrency)))
+    return report(driver, time.perf_counter() - started, args)
+
+
+async def main(args) -> int:
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=30) as client:
+            result = await run(client, args)
+    else:
+        from src.main import app
+
+        for eng in engines.values():
+            event.listen(eng.sync_engine, "before_cursor_execute", _count_query)
+        async with app.router.lifespan_context(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://load-test", timeout=30) as client:
+                result = await run(client, args)
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"✓ {result['total']['requests']} requests, {result['total']['throughput_rps']} req/s; report written to {args.output}")
+    else:
+        print(output)
+    return 1 if result["total"]["errors"] else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--duration", type=float, default=30, help="seconds of measured traffic")
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent simulated clients")
+    parser.add_argument("--warmup", type=int, default=200, help="unmeasured requests sent first")
+    parser.add_argument("--zipf", type=float, default=1.1, help="skew of target popularity")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--read-only", action="store_true", help="leave out views and ratings")
+    parser.add_argument("--url", help="send traffic to a running server instead of the in-process app")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -1,27 +1,153 @@
+#!/usr/bin/env python3
+"""
+Remove a user, or a single post, together with everything that hangs off it.
+
+The foreign keys cascade, so one DELETE of the user would do, but for an
+account with thousands of posts, comments and messages that statement holds
+its transaction and row locks for as long as the whole cascade takes. This
+job instead deletes the dependent rows in batches of --batch-size, each batch
+in its own short transaction with a --pause between them, so it can run
+beside the live application. The final DELETE of the user (or post) then
+has next to nothing left to cascade to. An interrupted run can simply be
+started again.
+
+Order for a user: comments on their posts, their own comments elsewhere,
+ratings on and by them, private messages, their posts, the account.
+
+Usage (from the backend directory):
+  python remove_user.py alice
+  python remove_user.py alice --batch-size 500 --pause 0.2
+  python remove_user.py --post 123     # a post with a huge comment thread
+"""
+
+import argparse
 import asyncio
-import getpass
-
-try:
-    from src.users import get_user_by_username
-    from src.db import async_session
-    from src.models import User
-except ImportError:
-    from users import get_user_by_username
-    from db import async_session
-    from models import User
-
-async def main():
-    username = input("Enter username to remove: ").strip()
-    async with async_session() as session:
-        user = await get_user_by_username(username)
-        if not user:
-            print(f"User '{username}' does not exist.")
-            return
-        await session.execute(
-            User.__table__.delete().where(User.username == username)
+import os
+import sys
+from datetime import datetime
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(__file__))
+
+from sqlalchemy import delete, or_, select, update
+
+from src.cache import invalidate
+from src.db import async_session, engines
+from src.models import Comment, Post, PrivateMessage, Rating, User
+from src.users import delete_post, get_user_by_username
+
+
+async def delete_in_batches(label: str, pk, condition, batch_size: int, pause: float, returning=None, on_batch=None) -> set:
+    """DELETE the rows of ``pk``'s table matching ``condition``, ``batch_size`` rows per transaction.
+
+    Newest rows go first, so replies are usually gone before the comments they
+    answer. Returns the distinct values of ``returning`` over the deleted rows;
+    ``on_batch(session, values)`` runs inside each batch's transaction.
+    """
+    table = pk.table
+    collected = set()
+    total = 0
+    while True:
+        batch = select(pk).where(condition).order_by(pk.desc()).limit(batch_size)
+        statement = delete(table).where(pk.in_(batch)).returning(returning if returning is not None else pk)
+        async with async_session() as session:
+            values = (await session.execute(statement)).scalars().all()
+            if values and on_batch is not None:
+                await on_batch(session, set(values))
+            await session.commit()
+        total += len(values)
+        if returning is not None:
+            collected.update(values)
+        if len(values) < batch_size:
+            break
+        print(f"  {label}: {total}", end="\r", flush=True)
+        await asyncio.sleep(pause)
+    print(f"✓ {label}: {total} deleted")
+    return collected
+
+
+def touch_posts(authors: set):
+    """on_batch callback: posts that lost comments or ratings get new HTTP validators,
+    as in delete_comment and delete_rating. Their authors are added to ``authors``."""
+    async def touch(session, post_ids: set):
+        result = await session.execute(
+            update(Post)
+            .where(Post.idposts.in_(post_ids))
+            .values(updated_at=datetime.utcnow())
+            .returning(Post.author_id)
+            .execution_options(synchronize_session=False)
         )
+        authors.update(result.scalars())
+    return touch
+
+
+async def remove_post(post_id: int, batch_size: int, pause: float) -> int:
+    async with async_session() as session:
+        if await session.get(Post, post_id) is None:
+            print(f"✗ Post {post_id} does not exist")
+            return 1
+
+    await delete_in_batches("comments", Comment.idcomments, Comment.post == post_id, batch_size, pause)
+    await delete_in_batches("ratings", Rating.id, Rating.post_id == post_id, batch_size, pause)
+    # Also bumps the author's and the listings' cache namespaces
+    if not await delete_post(post_id):
+        print(f"✗ Post {post_id} was deleted by someone else meanwhile")
+        return 1
+    print(f"✓ Post {post_id} has been removed")
+    return 0
+
+
+async def remove_user(username: str, batch_size: int, pause: float) -> int:
+    user = await get_user_by_username(username)
+    if not user:
+        print(f"✗ User '{username}' does not exist")
+        return 1
+    user_id = user.id
+    own_posts = select(Post.idposts).where(Post.author_id == user_id).scalar_subquery()
+    # Authors of other posts whose comments or ratings change; their profiles' validators move too
+    authors = set()
+
+    await delete_in_batches("comments on their posts", Comment.idcomments, Comment.post.in_(own_posts), batch_size, pause)
+    commented = await delete_in_batches(
+        "their comments", Comment.idcomments, Comment.author_id == user_id, batch_size, pause,
+        returning=Comment.post, on_batch=touch_posts(authors),
+    )
+    rated = await delete_in_batches(
+        "ratings", Rating.id, or_(Rating.user_id == user_id, Rating.post_id.in_(own_posts)), batch_size, pause,
+        returning=Rating.post_id, on_batch=touch_posts(authors),
+    )
+    await delete_in_batches(
+        "private messages", PrivateMessage.id,
+        or_(PrivateMessage.user_from == user_id, PrivateMessage.user_to == user_id), batch_size, pause,
+    )
+    posts = await delete_in_batches("posts", Post.idposts, Post.author_id == user_id, batch_size, pause, returning=Post.idposts)
+
+    async with async_session() as session:
+        await session.execute(delete(User).where(User.id == user_id))
         await session.commit()
-        print(f"User '{username}' has been removed.")
+
+    namespaces = [f"user:{author_id}" for author_id in authors | {user_id}]
+    namespaces += [f"post:{post_id}" for post_id in commented | rated | posts]
+    await invalidate(*namespaces, "feed", "tags", "leaderboards")
+    print(f"✓ User '{username}' has been removed")
+    return 0
+
+
+async def main(args) -> int:
+    try:
+        if args.post is not None:
+            return await remove_post(args.post, args.batch_size, args.pause)
+        username = args.username or input("Enter username to remove: ").strip()
+        return await remove_user(username, args.batch_size, args.pause)
+    finally:
+        for eng in engines.values():
+            await eng.dispose()
+
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("username", nargs="?", help="prompted for when omitted")
+    parser.add_argument("--post", type=int, metavar="ID", help="remove this post instead of a user")
+    parser.add_argument("--batch-size", type=int, default=1000, help="rows deleted per transaction")
+    parser.add_argument("--pause", type=float, default=0.05, help="seconds to wait between batches")
+    sys.exit(asyncio.run(main(parser.parse_args())))
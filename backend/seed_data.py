@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Generate a synthetic dataset for load tests and benchmarks.
+
+Creates users, tags, posts (with tags), nested comments, ratings, view counts
+and private messages. Activity follows a Zipf distribution: a few users write
+most posts, a few posts get most comments, ratings and views, a few tags are
+on most posts. Rows are loaded with COPY; ids are reserved from the tables'
+sequences up front so the data can be appended to an existing database.
+
+The same --seed always produces the same data.
+
+Usage (from the backend directory):
+  python seed_data.py --users 2000 --posts 50000 --comments 200000
+  python seed_data.py --truncate   # wipe all application tables first
+
+All seeded accounts share the password given by --password (default "seed").
+"""
+
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(__file__))
+
+import asyncpg
+
+from src.db import DATABASE_URL
+from src.users import pwd_context
+
+TABLES = ["private_messages", "ratings", "comments", "post_tags", "posts", "tags", "users"]
+
+WORDS = (
+    "python fastapi postgres index query cache latency async await request response schema "
+    "migration deploy docker frontend backend react nextjs server client token session user "
+    "post comment rating tag search feed profile photo message worker pool replica benchmark "
+    "the a of and to in is that for it with as on was be this by are from at or an"
+).split()
+
+
+class Zipf:
+    """Sample ranks 0..n-1 with probability proportional to 1 / (rank + 1) ** s."""
+
+    def __init__(self, rng: random.Random, n: int, s: float):
+        self.rng = rng
+        self.population = range(n)
+        self.cum_weights = list(itertools.accumulate(1 / (rank + 1) ** s for rank in range(n)))
+
+    def sample(self, k: int = 1) -> list:
+        return self.rng.choices(self.population, cum_weights=self.cum_weights, k=k)
+
+
+def words(rng: random.Random, low: int, high: int) -> str:
+    return " ".join(rng.choices(WORDS, k=rng.randint(low, high)))
+
+
+async def reserve_ids(conn, table: str, column: str, count: int) -> list:
+    """Take ``count`` ids from the table's sequence so COPY can set them explicitly."""
+    rows = await conn.fetch(
+        "SELECT nextval(pg_get_serial_sequence($1, $2)) AS id FROM generate_series(1, $3)",
+        table, column, count,
+    )
+    return [row["id"] for row in rows]
+
+
+async def copy(conn, table: str, columns: list, records: list):
+    started = time.perf_counter()
+    await conn.copy_records_to_table(table, records=records, columns=columns)
+    print(f"✓ {table}: {len(records)} rows in {time.perf_counter() - started:.1f}s")
+
+
+async def main(args) -> int:
+    rng = random.Random(args.seed)
+    now = datetime.utcnow().replace(microsecond=0)
+    since = now - timedelta(days=args.days)
+
+    def moment(after: datetime = since) -> datetime:
+        return after + timedelta(seconds=rng.uniform(0, max((now - after).total_seconds(), 1)))
+
+    dsn = DATABASE_URL.replace("postgresql+asyncpg://", "postgresql://", 1)
+    conn = await asyncpg.connect(dsn)
+    try:
+        if args.truncate:
+            await conn.execute(f"TRUNCATE {', '.join(TABLES)} RESTART IDENTITY CASCADE")
+            print("✓ Truncated application tables")
+
+        async with conn.transaction():
+            # Users: registration dates spread over the period, activity ranked by Zipf
+            password_hash = pwd_context.hash(args.password)
+            user_ids = await reserve_ids(conn, "users", "id", args.users)
+            users = []
+            for user_id in user_ids:
+                registered = moment()
+                users.append((user_id, f"seed{user_id}", password_hash, "user", True, False, registered, None, registered))
+            await copy(conn, "users", ["id", "username", "hashed_password", "role", "is_active", "is_banned",
+                                       "registration_date", "profile_photo", "updated_at"], users)
+
+            tag_ids = await reserve_ids(conn, "tags", "idtag", args.tags)
+            await copy(conn, "tags", ["idtag", "name", "description"],
+                       [(tag_id, f"tag{tag_id}", words(rng, 3, 10)) for tag_id in tag_ids])
+
+            # Posts: authors and per-post popularity both Zipf distributed
+            author_rank = Zipf(rng, len(user_ids), args.zipf)
+            post_ids = await reserve_ids(conn, "posts", "idposts", args.posts)
+            post_dates = {}
+            posts = []
+            views = Zipf(rng, len(post_ids), args.zipf).sample(args.views)
+            view_counts = dict.fromkeys(post_ids, 0)
+            for rank in views:
+                view_counts[post_ids[rank]] += 1
+            for post_id, author in zip(post_ids, author_rank.sample(len(post_ids))):
+                date = moment()
+                post_dates[post_id] = date
+                posts.append((post_id, words(rng, 3, 12), user_ids[author], words(rng, 30, 400), date,
+                              view_counts[post_id], date))
+            await copy(conn, "posts", ["idposts", "title", "author_id", "text", "date", "view_count", "updated_at"], posts)
+
+            tag_rank = Zipf(rng, len(tag_ids), args.zipf)
+            post_tags = set()
+            for post_id in post_ids:
+                for rank in tag_rank.sample(rng.randint(1, 3)):
+                    post_tags.add((post_id, tag_ids[rank]))
+            await copy(conn, "post_tags", ["post_id", "tag_id"], sorted(post_tags))
+
+            # Comments: concentrated on popular posts; a share replies to an earlier comment
+            post_rank = Zipf(rng, len(post_ids), args.zipf)
+            comment_ids = await reserve_ids(conn, "comments", "idcomments", args.comments)
+            thread = {}
+            comment_dates = {}
+            comments = []
+            for comment_id, rank, author in zip(comment_ids, post_rank.sample(len(comment_ids)), author_rank.sample(len(comment_ids))):
+                post_id = post_ids[rank]
+                earlier = thread.setdefault(post_id, [])
+                parent_id = None
+                if earlier and rng.random() < args.reply_share:
+                    parent_id = rng.choice(earlier)
+                earlier.append(comment_id)
+                date = comment_dates[comment_id] = moment(comment_dates[parent_id] if parent_id else post_dates[post_id])
+                comments.append((comment_id, words(rng, 3, 60), user_ids[author], post_id, parent_id, date))
+            # Ids ascend, so every parent row precedes its replies for the self-referencing foreign key
+            await copy(conn, "comments", ["idcomments", "text", "author_id", "post", "parent_id", "date"], comments)
+
+            ratings = {}
+            for rank, user in zip(post_rank.sample(args.ratings), author_rank.sample(args.ratings)):
+                post_id = post_ids[rank]
+                ratings[(user_ids[user], post_id)] = (rng.random() < 0.8, moment(post_dates[post_id]))
+            await copy(conn, "ratings", ["user_id", "post_id", "is_positive", "created_at"],
+                       [(user_id, post_id, positive, date) for (user_id, post_id), (positive, date) in ratings.items()])
+
+            senders = author_rank.sample(args.messages)
+            recipients = author_rank.sample(args.messages)
+            messages = [
+                (user_ids[sender], user_ids[recipient], words(rng, 1, 40), moment())
+                for sender, recipient in zip(senders, recipients)
+                if sender != recipient
+            ]
+            await copy(conn, "private_messages", ["user_from", "user_to", "text", "date"], messages)
+
+        await conn.execute("ANALYZE")
+        print("\n✓ Seeded database and refreshed planner statistics")
+    finally:
+        await conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--tags", type=int, default=50)
+    parser.add_argument("--posts", type=int, default=20000)
+    parser.add_argument("--comments", type=int, default=100000)
+    parser.add_argument("--ratings", type=int, default=200000, help="rating attempts; duplicates per user/post collapse")
+    parser.add_argument("--views", type=int, default=1000000, help="post views distributed over the posts")
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--days", type=int, default=90, help="spread dates over the last N days")
+    parser.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent; higher means more skew")
+    parser.add_argument("--reply-share", type=float, default=0.3, help="share of comments that reply to another")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--password", default="seed")
+    parser.add_argument("--truncate", action="store_true", help="delete all existing application data first")
+    sys.exit(asyncio.run(main(parser.parse_args())))
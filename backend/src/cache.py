@@ -0,0 +1,338 @@
+"""Shared cache tier for the data layer.
+
+``CACHE_URL`` selects the backend. ``redis://[:password@]host[:port][/db]``
+shares entries between all workers through any server speaking the Redis
+protocol and is the production setting. ``memory://`` keeps them in the
+worker process: with several workers an invalidation only reaches the worker
+that handled the write, so it is refused when ``WEB_CONCURRENCY`` asks for
+more than one and meant for single-process development. Empty (the default)
+disables caching.
+
+Entries live in namespaces (``"post:{post_id}"``, ``"tags"``...). Every
+namespace has a version counter stored in the backend itself; it is part of
+each entry's key, so ``invalidate()`` bumps one counter and every worker stops
+seeing the old entries at once, which then simply expire.
+
+Misses are coalesced per worker and read target (``SingleFlight``; a request
+pinned to the primary never shares a replica result) and entries may be served
+stale for a while after their TTL, so an expiring hot key costs one query
+instead of one per concurrent request.
+"""
+import asyncio
+import functools
+import inspect
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import urlsplit, unquote
+
+import orjson
+
+try:
+    from .db import _env_int, read_target
+    from .metrics import Counter
+except Exception:
+    from db import _env_int, read_target
+    from metrics import Counter
+
+CACHE_URL = os.getenv("CACHE_URL", "")
+CACHE_PREFIX = os.getenv("CACHE_PREFIX", "nextdev")
+CACHE_TTL_SECONDS = _env_int("CACHE_TTL_SECONDS", 30)
+CACHE_MAX_ENTRIES = _env_int("CACHE_MAX_ENTRIES", 10000)
+CACHE_POOL_SIZE = _env_int("CACHE_POOL_SIZE", 10)
+CACHE_TIMEOUT_SECONDS = _env_int("CACHE_TIMEOUT_MS", 200) / 1000
+
+logger = logging.getLogger("uvicorn.error")
+
+CACHE_REQUESTS = Counter("cache_requests_total", "Cache lookups by namespace and result", labelnames=("namespace", "result"))
+CACHE_INVALIDATIONS = Counter("cache_invalidations_total", "Namespace version bumps", labelnames=("namespace",))
+CACHE_COALESCED = Counter("cache_coalesced_total", "Calls that awaited an identical in-flight computation", labelnames=("namespace",))
+CACHE_ERRORS = Counter("cache_errors_total", "Backend errors; the lookup falls through to the database", labelnames=("backend",))
+
+
+class CacheBackend:
+    name = ""
+
+    async def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: bytes, ttl: int):
+        raise NotImplementedError
+
+    async def incr(self, key: str) -> int:
+        raise NotImplementedError
+
+
+class MemoryBackend(CacheBackend):
+    """Per-process LRU with TTLs; coherent only within a single worker."""
+    name = "memory"
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()  # key -> (expires_at or None, value)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: int):
+        self._store(key, time.monotonic() + ttl, value)
+
+    async def incr(self, key: str) -> int:
+        value = int(await self.get(key) or 0) + 1
+        self._store(key, None, str(value).encode())
+        return value
+
+    def _store(self, key: str, expires_at: Optional[float], value: bytes):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisBackend(CacheBackend):
+    """Minimal RESP2 client over a small pool of asyncio connections."""
+    name = "redis"
+
+    def __init__(self, url: str, pool_size: int = CACHE_POOL_SIZE):
+        parts = urlsplit(url)
+        self.host = parts.hostname or "localhost"
+        self.port = parts.port or 6379
+        self.password = unquote(parts.password) if parts.password else None
+        self.db = int(parts.path.lstrip("/") or 0)
+        self.pool_size = pool_size
+        self._loop = None
+        self._idle: list = []
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.execute("GET", key)
+
+    async def set(self, key: str, value: bytes, ttl: int):
+        await self.execute("SET", key, value, "EX", ttl)
+
+    async def incr(self, key: str) -> int:
+        return await self.execute("INCR", key)
+
+    async def execute(self, *args):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Connections are bound to the event loop that opened them
+            self._loop, self._idle, self._slots = loop, [], asyncio.Semaphore(self.pool_size)
+        async with self._slots:
+            reader, writer = self._idle.pop() if self._idle else await self._connect()
+            try:
+                writer.write(_encode_command(args))
+                reply = await _read_reply(reader)
+            except BaseException:
+                writer.close()
+                raise
+            self._idle.append((reader, writer))
+        if isinstance(reply, RedisError):
+            raise reply
+        return reply
+
+    async def _connect(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        for command in ((("AUTH", self.password),) if self.password else ()) + ((("SELECT", self.db),) if self.db else ()):
+            writer.write(_encode_command(command))
+            reply = await _read_reply(reader)
+            if isinstance(reply, RedisError):
+                writer.close()
+                raise reply
+        return reader, writer
+
+
+def _encode_command(args) -> bytes:
+    out = bytearray(b"*%d\r\n" % len(args))
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        out += b"$%d\r\n%s\r\n" % (len(arg), arg)
+    return bytes(out)
+
+
+async def _read_reply(reader: asyncio.StreamReader):
+    line = await reader.readline()
+    if not line.endswith(b"\r\n"):
+        raise ConnectionError("Connection closed by cache server")
+    kind, payload = line[:1], line[1:-2]
+    if kind == b"+":
+        return payload.decode()
+    if kind == b"-":
+        return RedisError(payload.decode())
+    if kind == b":":
+        return int(payload)
+    if kind == b"$":
+        length = int(payload)
+        if length < 0:
+            return None
+        return (await reader.readexactly(length + 2))[:-2]
+    if kind == b"*":
+        length = int(payload)
+        return None if length < 0 else [await _read_reply(reader) for _ in range(length)]
+    raise ConnectionError(f"Unexpected reply from cache server: {line!r}")
+
+
+def make_backend(url: str) -> Optional[CacheBackend]:
+    if not url:
+        return None
+    scheme = urlsplit(url).scheme
+    if scheme == "memory":
+        # Other workers would keep serving entries invalidated here (see module docstring)
+        if _env_int("WEB_CONCURRENCY", 1) > 1:
+            raise ValueError("CACHE_URL=memory:// is per process; use redis:// with several workers")
+        return MemoryBackend()
+    if scheme == "redis":
+        return RedisBackend(url)
+    raise ValueError(f"Unsupported CACHE_URL scheme: {scheme}")
+
+
+backend: Optional[CacheBackend] = make_backend(CACHE_URL)
+
+
+def _version_key(namespace: str) -> str:
+    return f"{CACHE_PREFIX}:ns:{namespace}"
+
+
+async def _call(operation, *args):
+    """Run a backend operation; errors and slow responses degrade to a cache miss."""
+    try:
+        return await asyncio.wait_for(operation(*args), CACHE_TIMEOUT_SECONDS)
+    except Exception as exc:
+        CACHE_ERRORS.inc(backend=backend.name)
+        logger.warning("Cache %s failed: %r", operation.__name__, exc)
+        return None
+
+
+async def invalidate(*namespaces: str):
+    """Drop every entry of the given namespaces, for all workers sharing the backend."""
+    if backend is None:
+        return
+    for namespace in namespaces:
+        CACHE_INVALIDATIONS.inc(namespace=namespace.split(":")[0])
+        await _call(backend.incr, _version_key(namespace))
+
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into one in-flight computation."""
+
+    def __init__(self):
+        self._flights: dict = {}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._flights
+
+    async def do(self, key: str, factory):
+        future = self._flights.get(key)
+        if future is None:
+            future = self._flights[key] = asyncio.ensure_future(factory())
+            future.add_done_callback(lambda _: self._flights.pop(key, None))
+        # A cancelled caller must not cancel the computation the others wait on
+        return await asyncio.shield(future)
+
+
+_flights = SingleFlight()
+_revalidations: set = set()
+
+
+def _pack(fresh_until: float, data: bytes) -> bytes:
+    return b"%.3f\n%s" % (fresh_until, data)
+
+
+def _unpack(entry: bytes) -> tuple:
+    fresh_until, data = entry.split(b"\n", 1)
+    return float(fresh_until), data
+
+
+async def _fill(key: str, fn, args, kwargs, ttl: int, stale_ttl: int) -> bytes:
+    data = orjson.dumps(await fn(*args, **kwargs))
+    await _call(backend.set, key, _pack(time.time() + ttl, data), ttl + stale_ttl)
+    return data
+
+
+def _revalidate(key: str, fill):
+    """Refresh a stale entry in the background unless a refresh is already running."""
+    if key in _flights:
+        return
+    task = asyncio.ensure_future(_flights.do(key, fill))
+    _revalidations.add(task)
+
+    def done(task):
+        _revalidations.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Cache revalidation of %s failed: %r", key, task.exception())
+
+    task.add_done_callback(done)
+
+
+def cached(namespace: str, ttl: int = CACHE_TTL_SECONDS, stale_ttl: int = 0):
+    """Cache a coroutine's JSON-serializable result.
+
+    ``namespace`` may reference the function's arguments (``"post:{post_id}"``)
+    so that invalidation can target a single entity. Results come back as
+    decoded JSON, i.e. datetimes as ISO strings.
+
+    Concurrent misses for the same key within a worker share one call. For
+    ``stale_ttl`` seconds after ``ttl`` runs out the old value is still served
+    while a single background call refreshes it; invalidation is never stale.
+    """
+    label = namespace.split(":")[0]
+
+    def decorator(fn):
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            call_key = f"{fn.__name__}:{orjson.dumps(bound.arguments, option=orjson.OPT_SORT_KEYS).decode()}"
+            # A caller reading its own writes from the primary must not be handed a
+            # result another request computed on the replica, so flights are per target
+            target = read_target()
+            if backend is None:
+                async def call():
+                    return orjson.dumps(await fn(*args, **kwargs))
+                flight_key = f"{call_key}@{target}"
+                if flight_key in _flights:
+                    CACHE_COALESCED.inc(namespace=label)
+                return orjson.loads(await _flights.do(flight_key, call))
+
+            scope = namespace.format(**bound.arguments)
+            version = int(await _call(backend.get, _version_key(scope)) or 0)
+            key = f"{CACHE_PREFIX}:{scope}:v{version}:{call_key}"
+
+            def fill():
+                return _fill(key, fn, args, kwargs, ttl, stale_ttl)
+
+            entry = await _call(backend.get, key)
+            if entry is not None:
+                fresh_until, data = _unpack(entry)
+                if fresh_until > time.time():
+                    CACHE_REQUESTS.inc(namespace=label, result="hit")
+                else:
+                    CACHE_REQUESTS.inc(namespace=label, result="stale")
+                    _revalidate(key, fill)
+                return orjson.loads(data)
+            CACHE_REQUESTS.inc(namespace=label, result="miss")
+            flight_key = f"{key}@{target}"
+            if flight_key in _flights:
+                CACHE_COALESCED.inc(namespace=label)
+            return orjson.loads(await _flights.do(flight_key, fill))
+
+        return wrapper
+
+    return decorator
@@ -1,8 +1,17 @@
 import os
-from typing import AsyncGenerator
+import time
+from contextvars import ContextVar
+from typing import AsyncGenerator, Optional
 
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
-from sqlalchemy.orm import declarative_base
+from sqlalchemy.orm import declarative_base, Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+try:
+    from .metrics import Histogram, register_collector
+except Exception:
+    from metrics import Histogram, register_collector
 
 # Load environment file if present (backend/.environment) so local dev values are used
 try:
@@ -25,8 +34,133 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     DATABASE_URL = f"postgresql+asyncpg://{PG_USER}:{PG_PASSWORD}@{PG_HOST}:{PG_PORT}/{PG_DB}"
 
-engine = create_async_engine(DATABASE_URL, future=True)
-async_session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+# Optional streaming replica for read-only queries; unset means everything uses the primary
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL") or None
+
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value in (None, ""):
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# Connection pool settings; size workers so that
+# workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) stays below Postgres max_connections.
+DB_POOL_SIZE = _env_int("DB_POOL_SIZE", 5)
+DB_MAX_OVERFLOW = _env_int("DB_MAX_OVERFLOW", 10)
+DB_POOL_TIMEOUT = _env_int("DB_POOL_TIMEOUT", 30)
+DB_POOL_RECYCLE = _env_int("DB_POOL_RECYCLE", 1800)
+DB_POOL_PRE_PING = _env_bool("DB_POOL_PRE_PING", False)
+# asyncpg prepared statement cache per connection (0 disables it, e.g. behind pgbouncer)
+DB_STATEMENT_CACHE_SIZE = _env_int("DB_STATEMENT_CACHE_SIZE", 100)
+
+POOL_WAIT_SECONDS = Histogram(
+    "db_pool_wait_seconds",
+    "Time spent waiting to check a connection out of the pool",
+    labelnames=("pool",),
+)
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long each checkout waited for a connection."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_WAIT_SECONDS.observe(time.perf_counter() - start, pool=self.logging_name or "primary")
+
+
+def make_engine(url: str, name: str):
+    return create_async_engine(
+        url,
+        future=True,
+        poolclass=InstrumentedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        pool_logging_name=name,
+        connect_args={"prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE},
+    )
+
+
+engines = {}
+
+engine = make_engine(DATABASE_URL, "primary")
+engines["primary"] = engine
+
+if DATABASE_READ_URL:
+    read_engine = make_engine(DATABASE_READ_URL, "replica")
+    engines["replica"] = read_engine
+else:
+    read_engine = engine
+
+# How long a client keeps reading from the primary after it wrote something
+READ_YOUR_WRITES_SECONDS = _env_int("READ_YOUR_WRITES_SECONDS", 5)
+READ_PRIMARY_COOKIE = "read_primary"
+
+
+class PrimarySession(Session):
+    """Sync session class behind primary sessions, used to detect commits."""
+
+
+async_session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession, sync_session_class=PrimarySession)
+async_read_session = async_sessionmaker(read_engine, expire_on_commit=False, class_=AsyncSession)
+# Primary sessions whose commits do not count as a write of the request: bookkeeping
+# such as view counters, which the client never reads back
+async_untracked_session = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
+
+# Per-request routing state: {"pinned": bool, "wrote": bool}
+_routing_state: ContextVar[Optional[dict]] = ContextVar("db_routing_state", default=None)
+
+
+def begin_routing_scope(pinned: bool = False) -> dict:
+    """Start read/write routing for the current request (or task)."""
+    state = {"pinned": pinned, "wrote": False}
+    _routing_state.set(state)
+    return state
+
+
+def replica_enabled() -> bool:
+    return read_engine is not engine
+
+
+def read_target() -> str:
+    """Where read_session() currently goes: "replica" or "primary".
+
+    The replica unless none is configured or the current request has written
+    (or carries the read-your-writes cookie from a recent write).
+    """
+    if read_engine is engine:
+        return "primary"
+    state = _routing_state.get()
+    if state is not None and (state["pinned"] or state["wrote"]):
+        return "primary"
+    return "replica"
+
+
+def read_session() -> AsyncSession:
+    """Session for read-only queries, on the engine chosen by read_target()."""
+    if read_target() == "primary":
+        return async_session()
+    return async_read_session()
+
+
+@event.listens_for(PrimarySession, "after_commit")
+def _mark_write(session):
+    state = _routing_state.get()
+    if state is not None:
+        state["wrote"] = True
 
 Base = declarative_base()
 
@@ -34,3 +168,20 @@ Base = declarative_base()
 async def get_session() -> AsyncGenerator[AsyncSession, None]:
     async with async_session() as session:
         yield session
+
+
+@register_collector
+def _pool_metrics():
+    gauges = (
+        ("db_pool_size", "Configured number of persistent connections", lambda p: p.size()),
+        ("db_pool_checked_out", "Connections currently checked out", lambda p: p.checkedout()),
+        ("db_pool_checked_in", "Idle connections in the pool", lambda p: p.checkedin()),
+        ("db_pool_overflow", "Connections opened above pool_size", lambda p: p.overflow()),
+    )
+    lines = []
+    for metric, doc, read in gauges:
+        lines.append(f"# HELP {metric} {doc}")
+        lines.append(f"# TYPE {metric} gauge")
+        for name, eng in engines.items():
+            lines.append(f'{metric}{{pool="{name}"}} {read(eng.pool)}')
+    return lines
@@ -0,0 +1,225 @@
+"""Image processing off the event loop.
+
+Decoding, compositing and resampling an upload takes tens to hundreds of
+milliseconds of pure CPU, which inside a handler stalls every other request
+on the worker. Jobs run in a small process pool instead:
+
+- ``IMAGE_WORKERS`` processes, started on first use with ``spawn`` (a forked
+  child would inherit the event loop's threads and open connections);
+- at most ``IMAGE_QUEUE_LIMIT`` jobs running or waiting per worker process,
+  further uploads are rejected with ``ImageQueueFull`` instead of queueing
+  without bound;
+- callers stop waiting after ``IMAGE_TIMEOUT_SECONDS``; the job still counts
+  against the queue limit until its process is done with it;
+- images over ``IMAGE_MAX_PIXELS`` are refused from the header, before any
+  pixel data is decoded (decompression bombs).
+"""
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+try:
+    from .db import _env_int
+    from .metrics import Counter, Gauge, Histogram
+except Exception:
+    from db import _env_int
+    from metrics import Counter, Gauge, Histogram
+
+IMAGE_WORKERS = _env_int("IMAGE_WORKERS", 2)
+IMAGE_QUEUE_LIMIT = _env_int("IMAGE_QUEUE_LIMIT", 8)
+IMAGE_TIMEOUT_SECONDS = float(os.getenv("IMAGE_TIMEOUT_SECONDS", "10"))
+IMAGE_MAX_PIXELS = _env_int("IMAGE_MAX_PIXELS", 25_000_000)
+# Upload formats accepted for avatars (see uploads.SIGNATURES)
+AVATAR_INPUT_FORMATS = ("png",)
+AVATAR_SIZES = (32, 64, 128, 256)
+# WebP for browsers that take it, PNG as the fallback
+AVATAR_FORMATS = ("webp", "png")
+AVATAR_WEBP_QUALITY = _env_int("AVATAR_WEBP_QUALITY", 85)
+
+IMAGE_JOBS = Counter("image_jobs_total", "Image processing jobs", labelnames=("result",))
+IMAGE_JOBS_PENDING = Gauge("image_jobs_pending", "Image jobs running or waiting in the process pool")
+IMAGE_JOB_SECONDS = Histogram("image_job_duration_seconds", "Time from submitting an image job to its result")
+
+_executor: Optional[ProcessPoolExecutor] = None
+_pending = 0
+
+
+class ImageError(Exception):
+    """The upload is not an image that can be processed."""
+
+
+class ImageTooLarge(ImageError):
+    pass
+
+
+class ImageUnavailable(Exception):
+    """The pool cannot take or finish the job right now; the upload may be retried."""
+
+
+class ImageQueueFull(ImageUnavailable):
+    pass
+
+
+class ImagePoolBroken(ImageUnavailable):
+    """A worker died; the pool is replaced for the next job."""
+
+
+def _encode(image, directory: str, prefix: str, size: int, fmt: str) -> str:
+    """Encode one variant and store it under a name derived from its bytes."""
+    import hashlib
+    import tempfile
+    from io import BytesIO
+
+    buffer = BytesIO()
+    if fmt == "webp":
+        image.save(buffer, "WEBP", quality=AVATAR_WEBP_QUALITY, method=6)
+    else:
+        image.save(buffer, "PNG", optimize=True)
+    data = buffer.getvalue()
+    filename = f"{prefix}-{hashlib.sha256(data).hexdigest()[:16]}-{size}.{fmt}"
+    path = os.path.join(directory, filename)
+    # Same name means same bytes; otherwise write aside and rename so a reader never sees half a file.
+    # A unique temporary name, since two jobs for the same avatar may run in one process.
+    if not os.path.exists(path):
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    return filename
+
+
+def render_avatars(source: str, directory: str, prefix: str, sizes: tuple, input_formats: tuple, max_pixels: int) -> dict:
+    """Runs in a pool process: write the image file ``source`` as square avatars in
+    every size and format to ``directory``. Returns ``{size: {format: filename}}``."""
+    # Pillow is only needed here, so keep it out of the import path of the app
+    from PIL import Image
+
+    try:
+        # Decoded straight from the file; only the parsers for the accepted formats are tried
+        image = Image.open(source, formats=[fmt.upper() for fmt in input_formats])
+    except Exception as e:
+        raise ImageError(str(e)) from None
+    # open() only reads the header; refuse before decoding any pixel data
+    if image.width * image.height > max_pixels:
+        raise ImageTooLarge(f"{image.width}x{image.height}")
+    largest = max(sizes)
+    try:
+        # Let the decoder downscale where it can (JPEG) before the full decode
+        image.draft("RGB", (largest, largest))
+        # Palette images only resample with NEAREST, so convert them first
+        if image.mode in ("LA", "P"):
+            image = image.convert("RGBA")
+        image.thumbnail((largest, largest), Image.Resampling.LANCZOS)
+        # Flatten transparency onto white
+        if image.mode == "RGBA":
+            rgb_image = Image.new("RGB", image.size, (255, 255, 255))
+            rgb_image.paste(image, mask=image.getchannel("A"))
+            image = rgb_image
+        square_image = Image.new("RGB", (largest, largest), (255, 255, 255))
+        square_image.paste(image, ((largest - image.width) // 2, (largest - image.height) // 2))
+    except Exception as e:
+        raise ImageError(str(e)) from None
+
+    variants = {}
+    for size in sorted(sizes, reverse=True):
+        resized = square_image if size == largest else square_image.resize((size, size), Image.Resampling.LANCZOS)
+        variants[str(size)] = {fmt: _encode(resized, directory, prefix, size, fmt) for fmt in AVATAR_FORMATS}
+    return variants
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def _release_slot():
+    global _pending
+    _pending -= 1
+    IMAGE_JOBS_PENDING.dec()
+
+
+def _release_slot_on(loop):
+    """Done callback for a job future. It runs on the executor's thread, so the
+    count is handed to the loop instead of being changed from two threads."""
+    def release(future):
+        try:
+            loop.call_soon_threadsafe(_release_slot)
+        except RuntimeError:
+            # The loop is closed (process shutdown); nothing is counting anymore
+            pass
+    return release
+
+
+async def _run(fn, *args):
+    global _pending
+    if _pending >= IMAGE_WORKERS * IMAGE_QUEUE_LIMIT:
+        IMAGE_JOBS.inc(result="rejected")
+        raise ImageQueueFull()
+    future = None
+    started = time.perf_counter()
+    try:
+        # submit() itself raises BrokenProcessPool when a worker died while the pool was idle
+        future = _get_executor().submit(fn, *args)
+        _pending += 1
+        IMAGE_JOBS_PENDING.inc()
+        future.add_done_callback(_release_slot_on(asyncio.get_running_loop()))
+        # shield: a timed out job cannot be taken back from its process anyway
+        result = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), IMAGE_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        IMAGE_JOBS.inc(result="timeout")
+        raise
+    except ImageError:
+        IMAGE_JOBS.inc(result="invalid")
+        raise
+    except BrokenProcessPool:
+        # A worker died (killed, out of memory); start a fresh pool for the next job
+        IMAGE_JOBS.inc(result="unavailable")
+        shutdown_pool()
+        raise ImagePoolBroken() from None
+    except asyncio.CancelledError:
+        # Our job was cancelled by shutdown_pool() (another caller hit a broken pool),
+        # not this caller: report it as a failed job instead of a cancelled request
+        if future is not None and future.cancelled() and not asyncio.current_task().cancelling():
+            IMAGE_JOBS.inc(result="unavailable")
+            raise ImagePoolBroken() from None
+        raise
+    except Exception:
+        IMAGE_JOBS.inc(result="error")
+        raise
+    finally:
+        IMAGE_JOB_SECONDS.observe(time.perf_counter() - started)
+    IMAGE_JOBS.inc(result="ok")
+    return result
+
+
+async def save_avatars(source: str, directory: str, prefix: str) -> dict:
+    """Render the uploaded image file ``source`` as square avatars in AVATAR_SIZES and AVATAR_FORMATS.
+
+    Files are named ``{prefix}-{content hash}-{size}.{format}`` so they never
+    change once written. Returns ``{size: {format: filename}}``; raises
+    ImageError (ImageTooLarge) for unusable uploads, ImageQueueFull when the
+    pool is saturated, ImagePoolBroken when a worker died and
+    asyncio.TimeoutError when the job takes too long.
+    """
+    return await _run(render_avatars, source, directory, prefix, AVATAR_SIZES, AVATAR_INPUT_FORMATS, IMAGE_MAX_PIXELS)
+
+
+def avatar_filenames(variants: Optional[dict]) -> list:
+    return [filename for formats in (variants or {}).values() for filename in formats.values()]
+
+
+def shutdown_pool():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,117 @@
+"""Per-request performance metrics.
+
+``PerformanceMiddleware`` records latency, status codes, in-flight requests
+and response sizes per route template; engine events attribute the number of
+SQL statements and the time spent in them to the request that issued them.
+Everything is exported by ``GET /metrics``.
+"""
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+
+try:
+    from .db import engines
+    from .metrics import Counter, Gauge, Histogram
+except Exception:
+    from db import engines
+    from metrics import Counter, Gauge, Histogram
+
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+REQUESTS = Counter("http_requests_total", "HTTP requests by route and status", labelnames=("method", "route", "status"))
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Request latency", labelnames=("method", "route"))
+IN_FLIGHT = Gauge("http_requests_in_flight", "Requests currently being handled")
+REQUEST_QUERIES = Histogram("http_request_db_queries", "SQL statements per request", labelnames=("method", "route"), buckets=QUERY_COUNT_BUCKETS)
+REQUEST_DB_SECONDS = Histogram("http_request_db_seconds", "Time spent in SQL per request", labelnames=("method", "route"))
+RESPONSE_BYTES = Histogram("http_response_size_bytes", "Response body size", labelnames=("method", "route"), buckets=SIZE_BUCKETS)
+QUERY_SECONDS = Histogram("db_query_duration_seconds", "SQL statement latency", labelnames=("pool",))
+
+# Mutable stats of the request being handled; asyncio tasks it spawns share the dict
+_request_stats: ContextVar[Optional[dict]] = ContextVar("request_stats", default=None)
+
+
+def current_request_stats() -> Optional[dict]:
+    return _request_stats.get()
+
+
+def current_route() -> Optional[str]:
+    """Route template of the request being handled, if any."""
+    stats = _request_stats.get()
+    return route_template(stats["scope"]) if stats is not None else None
+
+
+def route_template(scope) -> str:
+    """Matched route path (``/posts/{post_id}``) so label values stay bounded."""
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    QUERY_SECONDS.observe(elapsed, pool=conn.engine.pool.logging_name or "primary")
+    stats = _request_stats.get()
+    if stats is not None:
+        stats["queries"] += 1
+        stats["db_seconds"] += elapsed
+
+
+def _handle_error(exception_context):
+    started = exception_context.connection.info.get("query_started") if exception_context.connection else None
+    if started:
+        started.pop()
+
+
+for _engine in engines.values():
+    event.listen(_engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(_engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(_engine.sync_engine, "handle_error", _handle_error)
+
+
+class PerformanceMiddleware:
+    """Pure ASGI middleware, so streaming responses are measured to their last byte."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        parent = _request_stats.get()
+        stats = {"scope": scope, "queries": 0, "db_seconds": 0.0, "status": 500, "bytes": 0}
+        token = _request_stats.set(stats)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                stats["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                stats["bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            IN_FLIGHT.dec()
+            _request_stats.reset(token)
+            if parent is not None:
+                # Sub-requests dispatched by /batch count towards the outer request too
+                parent["queries"] += stats["queries"]
+                parent["db_seconds"] += stats["db_seconds"]
+
+            method, route = scope["method"], route_template(scope)
+            REQUESTS.inc(method=method, route=route, status=stats["status"])
+            REQUEST_SECONDS.observe(elapsed, method=method, route=route)
+            REQUEST_QUERIES.observe(stats["queries"], method=method, route=route)
+            REQUEST_DB_SECONDS.observe(stats["db_seconds"], method=method, route=route)
+            RESPONSE_BYTES.observe(stats["bytes"], method=method, route=route)
@@ -1,21 +1,60 @@
-from fastapi import FastAPI
+import time
+
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import text
+import logging
 import os
+import re
 
 try:
-    from .db import engine
+    from .db import engine, replica_enabled, begin_routing_scope, READ_PRIMARY_COOKIE, READ_YOUR_WRITES_SECONDS
     from .models import Base
-    from .routes import auth, users, posts, messages
+    from .routes import auth, users, posts, messages, metrics, batch, admin
     from .utils import load_session_token
+    from .instrumentation import PerformanceMiddleware
+    from .query_audit import QUERY_AUDIT, QueryAuditMiddleware
+    from .profiling import ProfilingMiddleware, start_continuous_profiler, stop_continuous_profiler
+    from .images import shutdown_pool
+    from .static import uploads_app
+    from . import storage
 except Exception:
-    from db import engine
+    from db import engine, replica_enabled, begin_routing_scope, READ_PRIMARY_COOKIE, READ_YOUR_WRITES_SECONDS
     from models import Base
-    from routes import auth, users, posts, messages
+    from routes import auth, users, posts, messages, metrics, batch, admin
     from utils import load_session_token
+    from instrumentation import PerformanceMiddleware
+    from query_audit import QUERY_AUDIT, QueryAuditMiddleware
+    from profiling import ProfilingMiddleware, start_continuous_profiler, stop_continuous_profiler
+    from images import shutdown_pool
+    from static import uploads_app
+    import storage
+
+# "development" creates missing tables on boot; "production" only checks
+# that the database is at the Alembic head revision.
+STARTUP_MODE = os.getenv("STARTUP_MODE", "development")
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+logger = logging.getLogger("uvicorn.error")
+startup_timings = {"imports": time.perf_counter() - _import_started}
 
-app = FastAPI()
+# Error reporting is opt-in; the SDK is only imported when a DSN is configured
+SENTRY_DSN = os.getenv("SENTRY_DSN")
+if SENTRY_DSN:
+    import sentry_sdk
+
+    sentry_sdk.init(
+        dsn=SENTRY_DSN,
+        environment=STARTUP_MODE,
+        traces_sample_rate=float(os.getenv("SENTRY_TRACES_SAMPLE_RATE", "0")),
+    )
+
+# orjson renders the serialized response bodies. Dates reach it as strings:
+# schemas.DisplayDateTime formats them ("dd.mm.yyyy, HH:MM:SS") with strftime first
+app = FastAPI(default_response_class=ORJSONResponse)
 
 # Allow local frontend to talk to backend (adjust origins for deployment)
 app.add_middleware(
@@ -26,15 +65,48 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Mount static files directory for profile photos
-if not os.path.exists("uploads"):
-    os.makedirs("uploads", exist_ok=True)
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+# Opt-in (tests, staging): per-request statement fingerprints and query budgets
+if QUERY_AUDIT != "off":
+    app.add_middleware(QueryAuditMiddleware)
+
+# Admin-only: X-Profile: 1 runs the request under the stack sampler
+app.add_middleware(ProfilingMiddleware)
+
+if replica_enabled():
+    @app.middleware("http")
+    async def read_your_writes(request: Request, call_next):
+        # Keep a client on the primary for a short window after it writes,
+        # so it does not read stale data from a lagging replica.
+        state = begin_routing_scope(pinned=READ_PRIMARY_COOKIE in request.cookies)
+        response = await call_next(request)
+        if state["wrote"]:
+            response.set_cookie(
+                key=READ_PRIMARY_COOKIE,
+                value="1",
+                max_age=READ_YOUR_WRITES_SECONDS,
+                httponly=True,
+                samesite="lax",
+                path="/",
+            )
+        return response
+
+# Starlette wraps middleware in reverse order of registration: the one added last
+# sees the request first. A request passes PerformanceMiddleware, read_your_writes
+# (with a replica), ProfilingMiddleware, QueryAuditMiddleware (when enabled), CORS.
+# Registered last so it is the outermost and times everything below it.
+app.add_middleware(PerformanceMiddleware)
+
+# Uploaded files (profile photos) from the storage backend; a local
+# directory is created on startup. Content-hashed avatars are immutable.
+app.mount("/uploads", uploads_app(storage.backend), name="uploads")
 
 app.include_router(auth.router)
 app.include_router(users.router)
 app.include_router(posts.router)
 app.include_router(messages.router)
+app.include_router(metrics.router)
+app.include_router(batch.router)
+app.include_router(admin.router)
 
 
 @app.get("/")
@@ -42,8 +114,69 @@ async def root():
     return {"message": "NextDev backend"}
 
 
+_REVISION_RE = re.compile(r"^revision(?:\s*:\s*str)?\s*=\s*['\"](\w+)['\"]", re.M)
+_DOWN_REVISION_RE = re.compile(r"^down_revision\b[^=]*=(.*)$", re.M)
+
+
+def alembic_heads() -> set[str]:
+    """Head revisions of the migration scripts.
+
+    Reads the revision identifiers straight from the version files instead of
+    importing Alembic, which would add noticeably to cold start time.
+    """
+    versions_dir = os.path.join(BACKEND_DIR, "alembic", "versions")
+    revisions, parents = set(), set()
+    for name in os.listdir(versions_dir):
+        if not name.endswith(".py"):
+            continue
+        with open(os.path.join(versions_dir, name), encoding="utf-8") as f:
+            source = f.read()
+        revision = _REVISION_RE.search(source)
+        if revision:
+            revisions.add(revision.group(1))
+        down_revision = _DOWN_REVISION_RE.search(source)
+        if down_revision:
+            parents.update(re.findall(r"['\"](\w+)['\"]", down_revision.group(1)))
+    return revisions - parents
+
+
+async def verify_schema_revision():
+    async with engine.connect() as conn:
+        result = await conn.execute(text("SELECT version_num FROM alembic_version"))
+        current = set(result.scalars().all())
+    expected = alembic_heads()
+    if current != expected:
+        raise RuntimeError(
+            f"Database revision {sorted(current)} does not match Alembic head {sorted(expected)}; "
+            "run `alembic upgrade head` before starting in production mode"
+        )
+
+
 @app.on_event("startup")
 async def on_startup():
-    # Ensure models are available; Alembic should manage migrations in production.
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    started = time.perf_counter()
+    storage.backend.prepare()
+    startup_timings["uploads"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    if STARTUP_MODE == "production":
+        # Alembic owns the schema; a single query confirms it is up to date.
+        await verify_schema_revision()
+    else:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+    startup_timings["schema"] = time.perf_counter() - started
+
+    start_continuous_profiler()
+
+    logger.info(
+        "Startup (%s mode): %s",
+        STARTUP_MODE,
+        ", ".join(f"{phase} {seconds * 1000:.1f}ms" for phase, seconds in startup_timings.items()),
+    )
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    shutdown_pool()
+    stop_continuous_profiler()
@@ -1,6 +1,6 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, Table, UniqueConstraint
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, Table, UniqueConstraint, Index, JSON, func
+from sqlalchemy.orm import backref, relationship
 try:
     # package import (preferred when running as module)
     from .db import Base
@@ -15,6 +15,8 @@ post_tags = Table(
     Base.metadata,
     Column("post_id", Integer, ForeignKey("posts.idposts", ondelete="CASCADE"), primary_key=True),
     Column("tag_id", Integer, ForeignKey("tags.idtag", ondelete="CASCADE"), primary_key=True),
+    # The primary key only serves lookups by post; tag pages and tag counts go through tag_id
+    Index("ix_post_tags_tag_id_post_id", "tag_id", "post_id"),
 )
 
 
@@ -29,8 +31,12 @@ class User(Base):
     is_banned = Column(Boolean, default=False)
     registration_date = Column(DateTime, default=datetime.utcnow)
     profile_photo = Column(String(255), nullable=True)
+    # Content-hashed avatar files: {"32": {"webp": ..., "png": ...}, ...}
+    profile_photos = Column(JSON, nullable=True)
+    # Bumped on every change to the public profile; drives ETag/Last-Modified
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, server_default=func.timezone("utc", func.now()))
     # Relationship to ratings
-    ratings = relationship("Rating", back_populates="user", cascade="all, delete-orphan")
+    ratings = relationship("Rating", back_populates="user", cascade="all, delete-orphan", passive_deletes=True)
 
 
 class Tag(Base):
@@ -40,7 +46,7 @@ class Tag(Base):
     name = Column(String(255), nullable=False, index=True)
     description = Column(String, nullable=True)
     # Relationship to posts
-    posts = relationship("Post", secondary=post_tags, back_populates="tags")
+    posts = relationship("Post", secondary=post_tags, back_populates="tags", passive_deletes=True)
 
 
 class Post(Base):
@@ -50,12 +56,16 @@ class Post(Base):
     title = Column(Text, nullable=False)
     author_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
     text = Column(Text, nullable=False)
-    date = Column(DateTime, default=datetime.utcnow)
+    date = Column(DateTime, default=datetime.utcnow, index=True)
     view_count = Column(Integer, default=0)
+    # Bumped on edits, ratings and comments, not on views; drives ETag/Last-Modified
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, server_default=func.timezone("utc", func.now()))
     # Relationship to tags
-    tags = relationship("Tag", secondary=post_tags, back_populates="posts")
+    tags = relationship("Tag", secondary=post_tags, back_populates="posts", passive_deletes=True)
     # Relationship to ratings
-    ratings = relationship("Rating", back_populates="post", cascade="all, delete-orphan")
+    ratings = relationship("Rating", back_populates="post", cascade="all, delete-orphan", passive_deletes=True)
+
+    __table_args__ = (Index("ix_posts_author_id_date", "author_id", "date"),)
 
 
 class Comment(Base):
@@ -68,8 +78,14 @@ class Comment(Base):
     parent_id = Column(Integer, ForeignKey("comments.idcomments", ondelete="CASCADE"), nullable=True, index=True)
     date = Column(DateTime, default=datetime.utcnow)
     
-    # Self-referential relationship for nested comments
-    parent = relationship("Comment", remote_side=[idcomments], backref="replies", cascade="all, delete-orphan", single_parent=True)
+    # Self-referential relationship for nested comments; deleting a comment removes its replies, never its parent
+    parent = relationship(
+        "Comment",
+        remote_side=[idcomments],
+        backref=backref("replies", cascade="all, delete-orphan", passive_deletes=True),
+    )
+
+    __table_args__ = (Index("ix_comments_post_date", "post", "date"),)
 
 
 class Rating(Base):
@@ -86,7 +102,10 @@ class Rating(Base):
     post = relationship("Post", back_populates="ratings")
     
     # Ensure one rating per user per post
-    __table_args__ = (UniqueConstraint('user_id', 'post_id', name='unique_user_post_rating'),)
+    __table_args__ = (
+        UniqueConstraint('user_id', 'post_id', name='unique_user_post_rating'),
+        Index("ix_ratings_post_id_is_positive", "post_id", "is_positive"),
+    )
 
 
 class PrivateMessage(Base):
@@ -99,10 +118,13 @@ class PrivateMessage(Base):
     date = Column(DateTime, default=datetime.utcnow)
 
     # Relationships
-    sender = relationship("User", foreign_keys=[user_from], backref="sent_messages")
-    recipient = relationship("User", foreign_keys=[user_to], backref="received_messages")
+    sender = relationship("User", foreign_keys=[user_from], backref=backref("sent_messages", passive_deletes=True))
+    recipient = relationship("User", foreign_keys=[user_to], backref=backref("received_messages", passive_deletes=True))
+
+    __table_args__ = (Index("ix_private_messages_pair_date", "user_from", "user_to", "date"),)
 
 
-# establish relationship so ORM cascade can remove comments when a post is deleted
+# Rows below a deleted post or user are removed by the ON DELETE CASCADE foreign keys;
+# passive_deletes keeps the ORM from loading them first
 Post.comments = relationship("Comment", backref="post_obj", cascade="all, delete-orphan", passive_deletes=True)
 
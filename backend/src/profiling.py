@@ -0,0 +1,180 @@
+"""Sampling profiler for production diagnosis.
+
+An admin can profile a single request by sending ``X-Profile: 1`` (or the
+``_profile=1`` query flag). A thread samples the event loop thread's stack
+while the request runs; the result is stored under the id returned in the
+``X-Profile-Id`` response header and served as collapsed stacks (the input
+format of flamegraph.pl and speedscope) by ``GET /admin/profiles/{id}``.
+
+With ``PROFILE_CONTINUOUS_HZ`` set, a low-rate sampler runs for the life of
+the process and aggregates hot stacks across all requests.
+
+Samples cover the whole event loop, so concurrent requests show up in a
+single request's profile too.
+"""
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from typing import Optional
+from urllib.parse import parse_qs
+
+try:
+    from .db import _env_int
+    from .users import get_user_by_username
+    from .utils import load_session_token
+except Exception:
+    from db import _env_int
+    from users import get_user_by_username
+    from utils import load_session_token
+
+PROFILE_INTERVAL_MS = _env_int("PROFILE_INTERVAL_MS", 2)
+PROFILE_BUFFER_SIZE = _env_int("PROFILE_BUFFER_SIZE", 20)
+# 0 disables continuous sampling
+PROFILE_CONTINUOUS_HZ = _env_int("PROFILE_CONTINUOUS_HZ", 0)
+# Distinct stacks kept by the continuous profiler; rarer ones are dropped
+PROFILE_MAX_STACKS = _env_int("PROFILE_MAX_STACKS", 5000)
+MAX_DEPTH = 128
+# stop() runs on the event loop; a sampler wakes at once when stopped, so this is only a bound
+STOP_TIMEOUT_SECONDS = 0.05
+
+# Longest prefix first, so frames read src/users.py or sqlalchemy/orm/session.py
+SOURCE_ROOTS = sorted(
+    {os.path.dirname(os.path.dirname(os.path.abspath(__file__)))} | {os.path.abspath(p) for p in sys.path if p},
+    key=len,
+    reverse=True,
+)
+
+profiles: deque = deque(maxlen=PROFILE_BUFFER_SIZE)
+_ids = itertools.count(1)
+continuous_stacks: Counter = Counter()
+_continuous: Optional["StackSampler"] = None
+
+
+def _frame_label(code) -> str:
+    path = code.co_filename
+    for root in SOURCE_ROOTS:
+        if path.startswith(root + os.sep):
+            path = path[len(root) + 1:]
+            break
+    return f"{code.co_name} ({path}:{code.co_firstlineno})"
+
+
+def _collapse(frame) -> str:
+    labels = []
+    while frame is not None and len(labels) < MAX_DEPTH:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+def render_collapsed(stacks: Counter) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class StackSampler(threading.Thread):
+    """Samples one thread's Python stack at a fixed interval into a Counter."""
+
+    def __init__(self, thread_id: int, interval: float, stacks: Counter, max_stacks: Optional[int] = None):
+        super().__init__(name="stack-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = stacks
+        self.max_stacks = max_stacks
+        self.samples = 0
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = _collapse(frame)
+            if self.max_stacks is None or stack in self.stacks or len(self.stacks) < self.max_stacks:
+                self.stacks[stack] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stopped.set()
+        # Bounded: the caller is the event loop. A sampler still finishing its last sample
+        # may add it after this returns.
+        self.join(STOP_TIMEOUT_SECONDS)
+
+
+def start_continuous_profiler():
+    """Start sampling the calling (event loop) thread at PROFILE_CONTINUOUS_HZ."""
+    global _continuous
+    if PROFILE_CONTINUOUS_HZ > 0 and _continuous is None:
+        _continuous = StackSampler(threading.get_ident(), 1 / PROFILE_CONTINUOUS_HZ, continuous_stacks, PROFILE_MAX_STACKS)
+        _continuous.start()
+
+
+def stop_continuous_profiler():
+    global _continuous
+    if _continuous is not None:
+        _continuous.stop()
+        _continuous = None
+
+
+def get_profile(profile_id: int) -> Optional[dict]:
+    return next((p for p in profiles if p["id"] == profile_id), None)
+
+
+def _wants_profile(scope) -> bool:
+    headers = dict(scope["headers"])
+    if headers.get(b"x-profile", b"").strip() in (b"1", b"true"):
+        return True
+    return parse_qs(scope.get("query_string", b"").decode()).get("_profile", [""])[0] in ("1", "true")
+
+
+async def _is_admin(scope) -> bool:
+    for name, value in scope["headers"]:
+        if name != b"cookie":
+            continue
+        for part in value.decode("latin-1").split(";"):
+            key, _, token = part.strip().partition("=")
+            if key == "session":
+                data = load_session_token(token)
+                user = await get_user_by_username(data.get("username")) if data else None
+                return user is not None and user.role == "admin"
+    return False
+
+
+class ProfilingMiddleware:
+    """Profiles requests flagged by an admin; everything else passes straight through."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _wants_profile(scope) or not await _is_admin(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = next(_ids)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", str(profile_id).encode())]
+            await send(message)
+
+        stacks = Counter()
+        sampler = StackSampler(threading.get_ident(), PROFILE_INTERVAL_MS / 1000, stacks)
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            sampler.stop()
+            profiles.append({
+                "id": profile_id,
+                "time": datetime.utcnow().isoformat(),
+                "method": scope["method"],
+                "path": scope["path"],
+                "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+                "samples": sampler.samples,
+                "stacks": stacks,
+            })
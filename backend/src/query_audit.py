@@ -0,0 +1,145 @@
+"""Opt-in per-request SQL audit for tests and staging.
+
+With ``QUERY_AUDIT=log`` or ``QUERY_AUDIT=raise`` every statement a request
+issues is fingerprinted (parameters and literals stripped). A request fails
+the audit when one statement shape repeats more than its allowance, which is
+what a query-per-row loop looks like, or when it issues more statements than
+the budget its route declares with ``query_budget``. ``log`` reports this as a
+warning once the request finishes; ``raise`` fails the offending statement
+with ``QueryBudgetExceeded``, so tests catch the regression where it happens.
+"""
+import hashlib
+import logging
+import os
+import re
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+
+try:
+    from .db import engines, _env_int
+    from .metrics import Counter
+    from .instrumentation import route_template
+except Exception:
+    from db import engines, _env_int
+    from metrics import Counter
+    from instrumentation import route_template
+
+QUERY_AUDIT = os.getenv("QUERY_AUDIT", "off").strip().lower()
+if QUERY_AUDIT not in ("off", "log", "raise"):
+    raise ValueError(f"QUERY_AUDIT must be off, log or raise, not {QUERY_AUDIT!r}")
+# How often one statement shape may run in a request unless the route allows more
+QUERY_AUDIT_MAX_REPEATS = _env_int("QUERY_AUDIT_MAX_REPEATS", 3)
+
+logger = logging.getLogger("uvicorn.error")
+
+AUDIT_FAILURES = Counter("query_audit_failures_total", "Requests over their query budget", labelnames=("route", "reason"))
+
+_audit: ContextVar[Optional[dict]] = ContextVar("query_audit", default=None)
+
+_PLACEHOLDER_RE = re.compile(r"\$\d+(?:::\w+)?|%\(\w+\)s|(?<![:\w]):\w+|\?")
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACE_RE = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(RuntimeError):
+    pass
+
+
+def normalize(statement: str) -> str:
+    """Statement shape: parameters and literals become ``?``, IN lists collapse."""
+    shape = _PLACEHOLDER_RE.sub("?", statement)
+    shape = _LITERAL_RE.sub("?", shape)
+    shape = _LIST_RE.sub("(?+)", shape)
+    return _SPACE_RE.sub(" ", shape).strip()
+
+
+def fingerprint(statement: str) -> str:
+    return hashlib.blake2b(normalize(statement).encode(), digest_size=6).hexdigest()
+
+
+def query_budget(max_queries: Optional[int] = None, max_repeats: Optional[int] = None):
+    """Route dependency declaring how many statements a request may issue.
+
+    ``dependencies=[Depends(query_budget(3))]``; ``max_repeats`` raises the
+    allowance for one statement shape on routes that legitimately repeat it.
+    """
+    async def declare_budget():
+        state = _audit.get()
+        if state is not None:
+            state["max_queries"] = max_queries
+            if max_repeats is not None:
+                state["max_repeats"] = max_repeats
+    return declare_budget
+
+
+def _violations(state: dict, shape: Optional[str] = None) -> list:
+    found = []
+    if state["max_queries"] is not None and state["count"] > state["max_queries"]:
+        found.append(("budget", f"{state['count']} statements, budget is {state['max_queries']}"))
+    for key, (count, statement) in state["shapes"].items():
+        if (shape is None or key == shape) and count > state["max_repeats"]:
+            found.append(("repeated", f"{count}x {normalize(statement)}"))
+    return found
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    state = _audit.get()
+    if state is None or state["closed"]:
+        return
+    shape = fingerprint(statement)
+    count, _ = state["shapes"].get(shape, (0, statement))
+    state["shapes"][shape] = (count + 1, statement)
+    state["count"] += 1
+    if QUERY_AUDIT == "raise":
+        problems = _violations(state, shape)
+        if problems:
+            state["closed"] = True
+            route = route_template(state["scope"])
+            for reason, _ in problems:
+                AUDIT_FAILURES.inc(route=route, reason=reason)
+            raise QueryBudgetExceeded(f"{state['scope']['method']} {route}: " + "; ".join(d for _, d in problems))
+
+
+class QueryAuditMiddleware:
+    """Pure ASGI middleware opening an audit scope for every HTTP request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        state = {
+            "scope": scope,
+            "count": 0,
+            "shapes": {},
+            "max_queries": None,
+            "max_repeats": QUERY_AUDIT_MAX_REPEATS,
+            "closed": False,
+        }
+        token = _audit.set(state)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _audit.reset(token)
+            # Background work spawned by the request (cache refreshes) is not audited
+            closed, state["closed"] = state["closed"], True
+            problems = [] if closed else _violations(state)
+            if problems:
+                route = route_template(scope)
+                for reason, _ in problems:
+                    AUDIT_FAILURES.inc(route=route, reason=reason)
+                logger.warning(
+                    "Query audit: %s %s issued %d statements: %s",
+                    scope["method"], route, state["count"], "; ".join(d for _, d in problems),
+                )
+
+
+if QUERY_AUDIT != "off":
+    for _engine in engines.values():
+        event.listen(_engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
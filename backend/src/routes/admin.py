@@ -0,0 +1,71 @@
+from fastapi import APIRouter, Request, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+
+try:
+    from ..users import get_user_by_username
+    from ..utils import load_session_token
+    from ..slow_queries import recent_slow_queries, SLOW_QUERY_MS, SLOW_QUERY_EXPLAIN_SAMPLE
+    from ..profiling import profiles, get_profile, continuous_stacks, render_collapsed, PROFILE_CONTINUOUS_HZ
+except Exception:
+    from users import get_user_by_username
+    from utils import load_session_token
+    from slow_queries import recent_slow_queries, SLOW_QUERY_MS, SLOW_QUERY_EXPLAIN_SAMPLE
+    from profiling import profiles, get_profile, continuous_stacks, render_collapsed, PROFILE_CONTINUOUS_HZ
+
+router = APIRouter(prefix="/admin")
+
+
+async def _require_admin(request: Request):
+    token = request.cookies.get("session")
+    if not token:
+        raise HTTPException(status_code=401, detail="Нет аутентификации")
+    data = load_session_token(token)
+    if not data:
+        raise HTTPException(status_code=401, detail="Недействительная или истекшая сессия")
+
+    current_user = await get_user_by_username(data.get("username"))
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Пользователь не найден")
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Доступно только администраторам")
+    return current_user
+
+
+@router.get("/slow-queries")
+async def get_slow_queries(request: Request, limit: int = Query(50, ge=1, le=1000)):
+    """Most recent slow statements, newest first, with EXPLAIN ANALYZE plans where sampled."""
+    await _require_admin(request)
+    return {
+        "threshold_ms": SLOW_QUERY_MS,
+        "explain_sample": SLOW_QUERY_EXPLAIN_SAMPLE,
+        "queries": recent_slow_queries(limit),
+    }
+
+
+@router.get("/profiles")
+async def list_profiles(request: Request):
+    """Stored single-request profiles, newest first (request them with ``X-Profile: 1``)."""
+    await _require_admin(request)
+    return [{k: v for k, v in p.items() if k != "stacks"} for p in reversed(profiles)]
+
+
+@router.get("/profiles/continuous", response_class=PlainTextResponse)
+async def get_continuous_profile(request: Request, reset: bool = Query(False)):
+    """Hot stacks aggregated by the continuous sampler, in collapsed-stack format."""
+    await _require_admin(request)
+    if not PROFILE_CONTINUOUS_HZ:
+        raise HTTPException(status_code=404, detail="Непрерывное профилирование выключено")
+    body = render_collapsed(continuous_stacks)
+    if reset:
+        continuous_stacks.clear()
+    return PlainTextResponse(body)
+
+
+@router.get("/profiles/{profile_id}", response_class=PlainTextResponse)
+async def get_profile_stacks(profile_id: int, request: Request):
+    """One request's profile in collapsed-stack format (flamegraph.pl, speedscope)."""
+    await _require_admin(request)
+    profile = get_profile(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Профиль не найден")
+    return PlainTextResponse(render_collapsed(profile["stacks"]))
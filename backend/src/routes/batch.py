@@ -0,0 +1,118 @@
+from fastapi import APIRouter, Request, HTTPException
+from pydantic import BaseModel
+from typing import Any, Optional
+import asyncio
+import json
+import os
+from urllib.parse import unquote
+
+try:
+    from ..users import share_user_lookups
+except Exception:
+    from users import share_user_lookups
+
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "20"))
+BATCH_TIMEOUT_SECONDS = float(os.getenv("BATCH_TIMEOUT_SECONDS", "10"))
+
+# Headers of the outer request passed on to every sub-request
+FORWARDED_HEADERS = {b"cookie", b"accept", b"accept-language", b"user-agent", b"x-forwarded-for"}
+
+router = APIRouter()
+
+
+class BatchItem(BaseModel):
+    path: str
+
+
+class BatchRequest(BaseModel):
+    requests: list[BatchItem]
+
+
+class BatchResult(BaseModel):
+    path: str
+    status: int
+    body: Optional[Any] = None
+
+
+async def _dispatch(request: Request, path: str) -> dict:
+    """Run a GET sub-request through the ASGI app in-process."""
+    raw_path, _, query = path.partition("?")
+    scope = {
+        "type": "http",
+        "asgi": request.scope.get("asgi", {"version": "3.0"}),
+        "http_version": request.scope.get("http_version", "1.1"),
+        "method": "GET",
+        "scheme": request.scope.get("scheme", "http"),
+        "server": request.scope.get("server"),
+        "client": request.scope.get("client"),
+        "root_path": request.scope.get("root_path", ""),
+        # Decoded like the server decodes a request line; raw_path keeps the bytes as sent
+        "path": unquote(raw_path),
+        "raw_path": raw_path.encode(),
+        "query_string": query.encode(),
+        "headers": [(k, v) for k, v in request.scope["headers"] if k in FORWARDED_HEADERS],
+        "app": request.app,
+        "state": request.scope.get("state", {}),
+    }
+    response = {"status": 500, "headers": {}, "body": bytearray()}
+    request_sent = False
+    response_complete = asyncio.Event()
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # Streaming responses listen for a disconnect; report it once the body is done
+        await response_complete.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["headers"] = {k.decode().lower(): v.decode() for k, v in message.get("headers", [])}
+        elif message["type"] == "http.response.body":
+            response["body"] += message.get("body", b"")
+            if not message.get("more_body", False):
+                response_complete.set()
+
+    await request.app(scope, receive, send)
+
+    body = bytes(response["body"])
+    if response["headers"].get("content-type", "").startswith("application/json") and body:
+        content = json.loads(body)
+    else:
+        content = body.decode(errors="replace")
+    return {"path": path, "status": response["status"], "body": content}
+
+
+@router.post("/batch", response_model=list[BatchResult])
+async def batch(payload: BatchRequest, request: Request):
+    """Run several GET requests in one round trip; results come back in request order.
+
+    Sub-requests run concurrently and share the caller's cookies and a single
+    lookup of the authenticated user.
+    """
+    if not payload.requests:
+        raise HTTPException(status_code=400, detail="Пустой пакет запросов")
+    if len(payload.requests) > BATCH_MAX_REQUESTS:
+        raise HTTPException(status_code=400, detail=f"Не более {BATCH_MAX_REQUESTS} запросов в пакете")
+    for item in payload.requests:
+        if not item.path.startswith("/") or unquote(item.path.split("?")[0]).rstrip("/") == "/batch":
+            raise HTTPException(status_code=400, detail=f"Недопустимый путь: {item.path}")
+
+    share_user_lookups()
+    tasks = [asyncio.ensure_future(_dispatch(request, item.path)) for item in payload.requests]
+    done, pending = await asyncio.wait(tasks, timeout=BATCH_TIMEOUT_SECONDS)
+    for task in pending:
+        task.cancel()
+
+    results = []
+    for item, task in zip(payload.requests, tasks):
+        if task in pending:
+            results.append({"path": item.path, "status": 504, "body": {"detail": "Превышено время ожидания"}})
+        elif task.exception() is not None:
+            results.append({"path": item.path, "status": 500, "body": {"detail": "Внутренняя ошибка"}})
+        else:
+            results.append(task.result())
+    return results
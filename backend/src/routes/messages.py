@@ -1,5 +1,5 @@
-from fastapi import APIRouter, Request, Form, HTTPException
-from datetime import datetime
+from fastapi import APIRouter, Depends, Request, Form, HTTPException, Query
+from typing import Optional
 
 try:
     from ..users import (
@@ -8,8 +8,12 @@ try:
         send_private_message,
         get_conversation,
         get_user_conversations,
+        stream_conversation,
     )
     from ..utils import load_session_token
+    from ..schemas import MessageOut, ConversationOut
+    from ..streaming import stream_response, STREAM_FORMATS
+    from ..query_audit import query_budget
 except Exception:
     from users import (
         get_user_by_username,
@@ -17,13 +21,17 @@ except Exception:
         send_private_message,
         get_conversation,
         get_user_conversations,
+        stream_conversation,
     )
     from utils import load_session_token
+    from schemas import MessageOut, ConversationOut
+    from streaming import stream_response, STREAM_FORMATS
+    from query_audit import query_budget
 
 router = APIRouter()
 
 
-@router.post("/messages/{recipient_id}")
+@router.post("/messages/{recipient_id}", dependencies=[Depends(query_budget(6, max_repeats=3))])
 async def send_message(recipient_id: int, request: Request, text: str = Form(...)):
     """Send a private message to another user."""
     token = request.cookies.get("session")
@@ -66,9 +74,9 @@ async def send_message(recipient_id: int, request: Request, text: str = Form(...
         raise HTTPException(status_code=400, detail=str(e))
 
 
-@router.get("/messages/{other_user_id}")
-async def get_conversation_endpoint(other_user_id: int, request: Request):
-    """Get conversation with another user."""
+@router.get("/messages/{other_user_id}", response_model=list[MessageOut], dependencies=[Depends(query_budget(3))])
+async def get_conversation_endpoint(other_user_id: int, request: Request, stream: Optional[str] = Query(None, pattern=STREAM_FORMATS)):
+    """Get conversation with another user. ``stream=ndjson|json`` streams the messages."""
     token = request.cookies.get("session")
     if not token:
         raise HTTPException(status_code=401, detail="Нет аутентификации")
@@ -83,18 +91,17 @@ async def get_conversation_endpoint(other_user_id: int, request: Request):
     if not other_user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
 
+    if stream:
+        return stream_response(stream_conversation(user.id, other_user_id), MessageOut, stream)
+
     try:
         messages = await get_conversation(user.id, other_user_id)
-        # Format dates
-        for msg in messages:
-            if isinstance(msg.get("date"), datetime):
-                msg["date"] = msg["date"].strftime("%d.%m.%Y, %H:%M:%S")
         return messages
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
-@router.get("/conversations")
+@router.get("/conversations", response_model=list[ConversationOut], dependencies=[Depends(query_budget(2))])
 async def get_conversations_endpoint(request: Request):
     """Get all conversation partners."""
     token = request.cookies.get("session")
@@ -109,10 +116,6 @@ async def get_conversations_endpoint(request: Request):
         raise HTTPException(status_code=401, detail="Пользователь не найден")
     try:
         conversations = await get_user_conversations(user.id)
-        # Format dates
-        for conv in conversations:
-            if isinstance(conv.get("last_message_date"), datetime):
-                conv["last_message_date"] = conv["last_message_date"].strftime("%d.%m.%Y, %H:%M:%S")
         return conversations
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -1,32 +1,56 @@
-from fastapi import APIRouter, Request, Form, HTTPException, Query
+from fastapi import APIRouter, Depends, Request, Response, Form, HTTPException, Query
 from typing import Optional
-from datetime import datetime
+import asyncio
 
 try:
-    from ..users import get_all_tags, get_all_posts, create_post, get_post_by_id, delete_post, create_comment, get_comments_by_post, get_comment_by_id, delete_comment, get_user_by_username, get_user_by_id, search_posts, create_tag, get_posts_by_tag, get_all_tags_with_post_counts, create_or_update_rating, delete_rating, user_rated_post, get_post_rating, increment_post_views, get_top_posters, get_top_posts
+    from ..users import get_all_tags, get_all_posts, create_post, get_post_by_id, delete_post, create_comment, get_comments_by_post, get_comment_by_id, delete_comment, get_user_by_username, get_user_by_id, search_posts, create_tag, get_posts_by_tag, get_all_tags_with_post_counts, create_or_update_rating, delete_rating, user_rated_post, get_post_rating, increment_post_views, get_top_posters, get_top_posts, stream_all_posts, stream_search_posts, record_post_view, get_user_profile, get_post_version, get_comments_version, get_tags_version, POST_CARD_FIELDS, POST_DETAIL_FIELDS
     from ..utils import load_session_token
+    from ..schemas import PostCard, PostDetail, CommentOut, TagWithCountOut, PostPageOut, parse_fields
+    from ..streaming import stream_response, STREAM_FORMATS
+    from ..conditional import make_etag, not_modified_response
+    from ..query_audit import query_budget
 except Exception:
-    from users import get_all_tags, get_all_posts, create_post, get_post_by_id, delete_post, create_comment, get_comments_by_post, get_comment_by_id, delete_comment, get_user_by_username, get_user_by_id, search_posts, create_tag, get_posts_by_tag, get_all_tags_with_post_counts, create_or_update_rating, delete_rating, user_rated_post, get_post_rating, increment_post_views, get_top_posters, get_top_posts
+    from users import get_all_tags, get_all_posts, create_post, get_post_by_id, delete_post, create_comment, get_comments_by_post, get_comment_by_id, delete_comment, get_user_by_username, get_user_by_id, search_posts, create_tag, get_posts_by_tag, get_all_tags_with_post_counts, create_or_update_rating, delete_rating, user_rated_post, get_post_rating, increment_post_views, get_top_posters, get_top_posts, stream_all_posts, stream_search_posts, record_post_view, get_user_profile, get_post_version, get_comments_version, get_tags_version, POST_CARD_FIELDS, POST_DETAIL_FIELDS
     from utils import load_session_token
+    from schemas import PostCard, PostDetail, CommentOut, TagWithCountOut, PostPageOut, parse_fields
+    from streaming import stream_response, STREAM_FORMATS
+    from conditional import make_etag, not_modified_response
+    from query_audit import query_budget
 
 router = APIRouter()
 
 
-@router.get("/tags")
-async def get_tags():
+@router.get("/tags", response_model=list[TagWithCountOut], dependencies=[Depends(query_budget(3))])
+async def get_tags(request: Request, response: Response):
+    etag = make_etag(request, *await get_tags_version())
+    cached = not_modified_response(request, response, etag)
+    if cached:
+        return cached
     tags = await get_all_tags_with_post_counts()
     return tags
 
 
-@router.get("/tags/{tag_id}/posts")
-async def get_posts_by_tag_endpoint(tag_id: int):
-    posts = await get_posts_by_tag(tag_id)
+def _post_fields(fields: Optional[str], allowed: tuple = POST_CARD_FIELDS) -> Optional[tuple]:
+    try:
+        return parse_fields(fields, allowed)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/tags/{tag_id}/posts", response_model=list[PostCard], response_model_exclude_unset=True, dependencies=[Depends(query_budget(1))])
+async def get_posts_by_tag_endpoint(tag_id: int, fields: Optional[str] = Query(None)):
+    posts = await get_posts_by_tag(tag_id, fields=_post_fields(fields))
     return posts
 
 
-@router.get("/posts")
-async def get_posts():
-    posts = await get_all_posts()
+@router.get("/posts", response_model=list[PostCard], response_model_exclude_unset=True, dependencies=[Depends(query_budget(1))])
+async def get_posts(stream: Optional[str] = Query(None, pattern=STREAM_FORMATS), fields: Optional[str] = Query(None)):
+    """List posts. ``stream=ndjson|json`` streams rows from a server-side cursor,
+    ``fields=idposts,title,...`` limits the columns (and aggregates) fetched."""
+    selected = _post_fields(fields)
+    if stream:
+        return stream_response(stream_all_posts(selected), PostCard, stream)
+    posts = await get_all_posts(fields=selected)
     return posts
 
 
@@ -63,18 +87,27 @@ async def create_new_post(request: Request, title: str = Form(...), text: str =
         raise HTTPException(status_code=400, detail=str(e))
 
 
-@router.get("/posts/search")
-async def search_posts_endpoint(q: str = Query(..., min_length=1, max_length=150)):
+@router.get("/posts/search", response_model=list[PostCard], response_model_exclude_unset=True, dependencies=[Depends(query_budget(1))])
+async def search_posts_endpoint(q: str = Query(..., min_length=1, max_length=150), stream: Optional[str] = Query(None, pattern=STREAM_FORMATS), fields: Optional[str] = Query(None)):
+    selected = _post_fields(fields)
+    if stream:
+        return stream_response(stream_search_posts(q, selected), PostCard, stream)
     try:
-        posts = await search_posts(q)
+        posts = await search_posts(q, fields=selected)
         return posts
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
-@router.get("/posts/{post_id}")
-async def get_post(post_id: int):
-    post = await get_post_by_id(post_id)
+@router.get("/posts/{post_id}", response_model=PostDetail, response_model_exclude_unset=True, dependencies=[Depends(query_budget(3))])
+async def get_post(post_id: int, request: Request, response: Response, fields: Optional[str] = Query(None)):
+    selected = _post_fields(fields, POST_DETAIL_FIELDS)
+    updated_at = await get_post_version(post_id)
+    if updated_at is not None:
+        cached = not_modified_response(request, response, make_etag(request, post_id, updated_at), updated_at)
+        if cached:
+            return cached
+    post = await get_post_by_id(post_id, fields=selected)
     if not post:
         raise HTTPException(status_code=404, detail="Пост не найден")
     return post
@@ -92,7 +125,7 @@ async def delete_post_endpoint(post_id: int, request: Request):
     user = await get_user_by_username(data.get("username"))
     if not user:
         raise HTTPException(status_code=401, detail="Пользователь не найден")
-    post = await get_post_by_id(post_id)
+    post = await get_post_by_id(post_id, fields=("idposts", "author_id"))
     if not post:
         raise HTTPException(status_code=404, detail="Пост не найден")
 
@@ -130,15 +163,58 @@ async def delete_post_endpoint(post_id: int, request: Request):
     return {"status": "ok", "message": "Пост удален успешно"}
 
 
-@router.get("/posts/{post_id}/comments")
-async def get_post_comments(post_id: int):
-    comments = await get_comments_by_post(post_id)
-    for c in comments:
-        if isinstance(c.get("date"), datetime):
-            c["date"] = c["date"].strftime("%d.%m.%Y, %H:%M:%S")
+@router.get("/posts/{post_id}/comments", response_model=list[CommentOut], dependencies=[Depends(query_budget(2))])
+async def get_post_comments(post_id: int, request: Request, response: Response, limit: Optional[int] = Query(None, ge=1, le=1000), offset: int = Query(0, ge=0)):
+    etag = make_etag(request, post_id, *await get_comments_version(post_id))
+    cached = not_modified_response(request, response, etag)
+    if cached:
+        return cached
+    comments = await get_comments_by_post(post_id, limit=limit, offset=offset)
     return comments
 
 
+async def _viewer_rating(request: Request, post_id: int) -> dict:
+    token = request.cookies.get("session")
+    data = load_session_token(token) if token else None
+    if not data:
+        return {"rated": False}
+    user = await get_user_by_username(data.get("username"))
+    if not user:
+        return {"rated": False}
+    rating = await user_rated_post(user.id, post_id)
+    if rating:
+        return {"rated": True, "is_positive": rating["is_positive"]}
+    return {"rated": False}
+
+
+@router.get("/posts/{post_id}/page", response_model=PostPageOut, response_model_exclude_unset=True, dependencies=[Depends(query_budget(8))])
+async def get_post_page(post_id: int, request: Request, comments_limit: int = Query(100, ge=1, le=1000)):
+    """Post, tags, rating, the viewer's vote, the first page of comments and the
+    author summary in one response. Records a view as a side effect."""
+    # Independent parts run concurrently, each on its own pooled connection. The
+    # view update doubles as the existence check and yields the author id; it does
+    # not count as a write, so the reads may still go to the replica.
+    view, post, rating, user_rating, comments = await asyncio.gather(
+        record_post_view(post_id),
+        get_post_by_id(post_id),
+        get_post_rating(post_id),
+        _viewer_rating(request, post_id),
+        get_comments_by_post(post_id, limit=comments_limit),
+    )
+    if not view or not post:
+        raise HTTPException(status_code=404, detail="Пост не найден")
+    # The post may come from the cache or a lagging replica; show the count including this view
+    post = {**post, "view_count": view["view_count"]}
+    author = await get_user_profile(view["author_id"], fields=("id", "username", "role", "profile_photo", "profile_photos"))
+    return {
+        "post": post,
+        "rating": rating,
+        "user_rating": user_rating,
+        "comments": comments,
+        "author": author,
+    }
+
+
 @router.post("/posts/{post_id}/comments")
 async def create_post_comment(post_id: int, request: Request, text: str = Form(...), parent_id: Optional[int] = Form(None)):
     token = request.cookies.get("session")
@@ -246,7 +322,7 @@ async def rate_post(post_id: int, request: Request, is_positive: bool = Form(...
     if user.is_banned:
         raise HTTPException(status_code=403, detail="Заблокированные пользователи не могут оценивать посты")
 
-    post = await get_post_by_id(post_id)
+    post = await get_post_by_id(post_id, fields=("idposts",))
     if not post:
         raise HTTPException(status_code=404, detail="Пост не найден")
     try:
@@ -274,7 +350,7 @@ async def unrate_post(post_id: int, request: Request):
     user = await get_user_by_username(data.get("username"))
     if not user:
         raise HTTPException(status_code=401, detail="Пользователь не найден")
-    post = await get_post_by_id(post_id)
+    post = await get_post_by_id(post_id, fields=("idposts",))
     if not post:
         raise HTTPException(status_code=404, detail="Пост не найден")
 
@@ -289,10 +365,10 @@ async def unrate_post(post_id: int, request: Request):
     }
 
 
-@router.get("/posts/{post_id}/rating")
+@router.get("/posts/{post_id}/rating", dependencies=[Depends(query_budget(2))])
 async def get_post_rating_endpoint(post_id: int):
     """Get the rating count for a post."""
-    post = await get_post_by_id(post_id)
+    post = await get_post_by_id(post_id, fields=("idposts",))
     if not post:
         raise HTTPException(status_code=404, detail="Пост не найден")
 
@@ -300,45 +376,23 @@ async def get_post_rating_endpoint(post_id: int):
     return rating
 
 
-@router.get("/posts/{post_id}/user-rating")
+@router.get("/posts/{post_id}/user-rating", dependencies=[Depends(query_budget(2))])
 async def get_user_post_rating(post_id: int, request: Request):
     """Get current user's rating for a post."""
-    token = request.cookies.get("session")
-    if not token:
-        return {"rated": False}
-    
-    data = load_session_token(token)
-    if not data:
-        return {"rated": False}
-
-    user = await get_user_by_username(data.get("username"))
-    if not user:
-        return {"rated": False}
-
-    rating = await user_rated_post(user.id, post_id)
-    if rating:
-        return {
-            "rated": True,
-            "is_positive": rating["is_positive"]
-        }
-    return {"rated": False}
+    return await _viewer_rating(request, post_id)
 
 
 @router.post("/posts/{post_id}/view")
 async def increment_view(post_id: int):
     """Increment view count for a post."""
-    post = await get_post_by_id(post_id)
-    if not post:
+    view = await record_post_view(post_id)
+    if not view:
         raise HTTPException(status_code=404, detail="Post not found")
 
-    success = await increment_post_views(post_id)
-    if not success:
-        raise HTTPException(status_code=500, detail="Failed to increment view count")
-
-    return {"status": "ok", "view_count": post["view_count"] + 1}
+    return {"status": "ok", "view_count": view["view_count"]}
 
 
-@router.get("/posts/stats/top-posters")
+@router.get("/posts/stats/top-posters", dependencies=[Depends(query_budget(1))])
 async def get_top_posters_endpoint(period: str = Query("week", regex="^(today|week)$")):
     """Get top posters by total post views. Period can be 'today' or 'week'."""
     days = 1 if period == "today" else 7
@@ -346,7 +400,7 @@ async def get_top_posters_endpoint(period: str = Query("week", regex="^(today|we
     return posters
 
 
-@router.get("/posts/stats/top-posts")
+@router.get("/posts/stats/top-posts", dependencies=[Depends(query_budget(1))])
 async def get_top_posts_endpoint(period: str = Query("week", regex="^(today|week)$")):
     """Get top posts by view count. Period can be 'today' or 'week'."""
     days = 1 if period == "today" else 7
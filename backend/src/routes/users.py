@@ -1,52 +1,178 @@
-from fastapi import APIRouter, Request, HTTPException, Query, UploadFile, File
+from fastapi import APIRouter, Depends, Request, Response, HTTPException, Query
+from pydantic import BaseModel, Field
+from typing import Literal, Optional
+import asyncio
+import logging
 import os
-from PIL import Image
-from io import BytesIO
+import shutil
 
 try:
-    from ..users import get_user_by_id, get_user_posts, promote_user_to_moderator, demote_user_to_user, get_all_tags, get_user_by_username, ban_user, unban_user, search_users, get_all_users, get_user_total_rating, save_profile_photo, delete_profile_photo
+    from ..users import get_user_by_id, get_user_posts, promote_user_to_moderator, demote_user_to_user, get_all_tags, get_user_by_username, ban_user, unban_user, search_users, get_all_users, get_user_total_rating, save_profile_photo, delete_profile_photo, get_user_profile, get_user_version, bulk_set_banned, bulk_set_role, purge_user_content, USER_FIELDS, USER_PROFILE_FIELDS, POST_CARD_FIELDS
     from ..utils import load_session_token
+    from ..schemas import PostCard, UserOut, UserProfileOut, parse_fields
+    from ..conditional import make_etag, not_modified_response
+    from ..query_audit import query_budget
+    from ..images import save_avatars, avatar_filenames, AVATAR_INPUT_FORMATS, AVATAR_SIZES, ImageError, ImageTooLarge, ImageQueueFull, ImageUnavailable
+    from ..storage import StorageError, staging_dir
+    from .. import storage
+    from ..uploads import receive_upload, remove_upload, UPLOAD_MAX_BYTES, UploadTooLarge, UploadMissing, UnsupportedFileType
 except Exception:
-    from users import get_user_by_id, get_user_posts, promote_user_to_moderator, demote_user_to_user, get_all_tags, get_user_by_username, ban_user, unban_user, search_users, get_all_users, get_user_total_rating, save_profile_photo, delete_profile_photo
+    from users import get_user_by_id, get_user_posts, promote_user_to_moderator, demote_user_to_user, get_all_tags, get_user_by_username, ban_user, unban_user, search_users, get_all_users, get_user_total_rating, save_profile_photo, delete_profile_photo, get_user_profile, get_user_version, bulk_set_banned, bulk_set_role, purge_user_content, USER_FIELDS, USER_PROFILE_FIELDS, POST_CARD_FIELDS
     from utils import load_session_token
+    from schemas import PostCard, UserOut, UserProfileOut, parse_fields
+    from conditional import make_etag, not_modified_response
+    from query_audit import query_budget
+    from images import save_avatars, avatar_filenames, AVATAR_INPUT_FORMATS, AVATAR_SIZES, ImageError, ImageTooLarge, ImageQueueFull, ImageUnavailable
+    from storage import StorageError, staging_dir
+    import storage
+    from uploads import receive_upload, remove_upload, UPLOAD_MAX_BYTES, UploadTooLarge, UploadMissing, UnsupportedFileType
 
-# Create uploads directory if it doesn't exist
-UPLOAD_DIR = "uploads/profile_photos"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+# Storage key prefix of profile photos, also their path under /uploads
+PHOTO_PREFIX = "profile_photos"
+PHOTO_CONTENT_TYPES = {"webp": "image/webp", "png": "image/png"}
+
+# Largest id list one bulk moderation request may carry
+BULK_MAX_USERS = int(os.getenv("BULK_MAX_USERS", "1000"))
 
 router = APIRouter(prefix="/users")
 
+logger = logging.getLogger("uvicorn.error")
+
+
+def _photo_files(user) -> list:
+    return ([user.profile_photo] if user.profile_photo else []) + avatar_filenames(user.profile_photos)
+
+
+async def _store_photo_files(directory: str, filenames: list):
+    await asyncio.gather(*(
+        storage.backend.put_file(
+            f"{PHOTO_PREFIX}/{filename}",
+            os.path.join(directory, filename),
+            PHOTO_CONTENT_TYPES.get(filename.rsplit(".", 1)[-1], "application/octet-stream"),
+        )
+        for filename in filenames
+    ))
+
+
+async def _remove_photo_files(filenames):
+    # Best effort: an orphaned file is harmless, a failed request after the commit is not
+    results = await asyncio.gather(
+        *(storage.backend.delete(f"{PHOTO_PREFIX}/{filename}") for filename in filenames),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            logger.warning("Could not remove profile photo file: %r", result)
+
+
+def _fields(fields: Optional[str], allowed: tuple) -> Optional[tuple]:
+    try:
+        return parse_fields(fields, allowed)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 
-@router.get("")
-async def get_all_users_endpoint():
-    users = await get_all_users(limit=100)
+@router.get("", response_model=list[UserOut], response_model_exclude_unset=True, dependencies=[Depends(query_budget(1))])
+async def get_all_users_endpoint(fields: Optional[str] = Query(None)):
+    users = await get_all_users(limit=100, fields=_fields(fields, USER_FIELDS))
     return users
 
 
-@router.get("/search")
-async def search_users_endpoint(q: str = Query(..., min_length=1, max_length=100)):
+@router.get("/search", response_model=list[UserOut], response_model_exclude_unset=True, dependencies=[Depends(query_budget(1))])
+async def search_users_endpoint(q: str = Query(..., min_length=1, max_length=100), fields: Optional[str] = Query(None)):
     try:
-        users = await search_users(q)
+        users = await search_users(q, fields=_fields(fields, USER_FIELDS))
         return users
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
-@router.get("/{user_id}")
-async def get_user(user_id: int):
-    user = await get_user_by_id(user_id)
+@router.get("/{user_id}", response_model=UserProfileOut, response_model_exclude_unset=True, dependencies=[Depends(query_budget(2))])
+async def get_user(user_id: int, request: Request, response: Response, fields: Optional[str] = Query(None)):
+    selected = _fields(fields, USER_PROFILE_FIELDS)
+    version = await get_user_version(user_id)
+    if version is not None:
+        cached = not_modified_response(request, response, make_etag(request, user_id, *version))
+        if cached:
+            return cached
+    user = await get_user_profile(user_id, fields=selected)
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
-    total_rating = await get_user_total_rating(user_id)
-    return {"id": user.id, "username": user.username, "role": user.role, "is_banned": user.is_banned, "registration_date": user.registration_date.strftime("%d.%m.%Y, %H:%M:%S"), "total_rating": total_rating, "profile_photo": user.profile_photo}
+    return user
 
 
-@router.get("/{user_id}/posts")
-async def get_user_posts_endpoint(user_id: int):
-    posts = await get_user_posts(user_id)
+@router.get("/{user_id}/posts", response_model=list[PostCard], response_model_exclude_unset=True, dependencies=[Depends(query_budget(1))])
+async def get_user_posts_endpoint(user_id: int, fields: Optional[str] = Query(None)):
+    posts = await get_user_posts(user_id, fields=_fields(fields, POST_CARD_FIELDS))
     return posts
 
 
+class BulkUsersRequest(BaseModel):
+    user_ids: list[int] = Field(..., min_length=1, max_length=BULK_MAX_USERS)
+
+
+class BulkRoleRequest(BulkUsersRequest):
+    role: Literal["user", "moderator"]
+
+
+async def _require_role(request: Request, roles: tuple, detail: str):
+    token = request.cookies.get("session")
+    if not token:
+        raise HTTPException(status_code=401, detail="Нет аутентификации")
+    data = load_session_token(token)
+    if not data:
+        raise HTTPException(status_code=401, detail="Недействительная или истекшая сессия")
+
+    current_user = await get_user_by_username(data.get("username"))
+    if not current_user:
+        raise HTTPException(status_code=401, detail="Пользователь не найден")
+    if current_user.role not in roles:
+        raise HTTPException(status_code=403, detail=detail)
+    return current_user
+
+
+def _bulk_result(requested: list[int], changed: list[int]) -> dict:
+    changed_set = set(changed)
+    # Unknown ids, protected users (admins, yourself) and users already in that state
+    skipped = sorted(set(requested) - changed_set)
+    return {"status": "ok", "updated": sorted(changed_set), "skipped": skipped}
+
+
+# Bulk moderation: one statement per request whatever the number of users; the
+# role rules are part of the statement, so nothing is looked up per user.
+@router.post("/bulk/ban", dependencies=[Depends(query_budget(2))])
+async def bulk_ban_users(body: BulkUsersRequest, request: Request):
+    current_user = await _require_role(request, ("admin", "moderator"), "Только администраторы и модераторы могут блокировать пользователей")
+    changed = await bulk_set_banned(current_user.id, body.user_ids, True)
+    return _bulk_result(body.user_ids, changed)
+
+
+@router.post("/bulk/unban", dependencies=[Depends(query_budget(2))])
+async def bulk_unban_users(body: BulkUsersRequest, request: Request):
+    current_user = await _require_role(request, ("admin", "moderator"), "Только администраторы и модераторы могут разблокировать пользователей")
+    changed = await bulk_set_banned(current_user.id, body.user_ids, False)
+    return _bulk_result(body.user_ids, changed)
+
+
+@router.post("/bulk/role", dependencies=[Depends(query_budget(2))])
+async def bulk_change_role(body: BulkRoleRequest, request: Request):
+    current_user = await _require_role(request, ("admin",), "Только администраторы могут менять роли пользователей")
+    changed = await bulk_set_role(current_user.id, body.user_ids, body.role)
+    return _bulk_result(body.user_ids, changed)
+
+
+@router.post("/bulk/purge", dependencies=[Depends(query_budget(5))])
+async def bulk_purge_content(body: BulkUsersRequest, request: Request):
+    """Delete all posts and comments of the given users."""
+    current_user = await _require_role(request, ("admin", "moderator"), "Только администраторы и модераторы могут удалять контент пользователей")
+    result = await purge_user_content(current_user.id, body.user_ids)
+    return {
+        **_bulk_result(body.user_ids, result["users"]),
+        "deleted_posts": result["posts"],
+        "deleted_comments": result["comments"],
+    }
+
+
 @router.put("/{user_id}/promote")
 async def promote_user(user_id: int, request: Request):
     token = request.cookies.get("session")
@@ -169,7 +295,7 @@ async def unban_user_endpoint(user_id: int, request: Request):
         raise HTTPException(status_code=400, detail="Не удалось разблокировать пользователя")
     return {"status": "ok", "message": "Пользователь был разблокирован"}
 
-@router.get("/search")
+@router.get("/search", response_model=list[UserOut])
 async def search_users_endpoint(q: str = Query(..., min_length=1, max_length=100)):
     try:
         users = await search_users(q)
@@ -178,9 +304,28 @@ async def search_users_endpoint(q: str = Query(..., min_length=1, max_length=100
         raise HTTPException(status_code=400, detail=str(e))
 
 
-@router.post("/{user_id}/profile-photo")
-async def upload_profile_photo(user_id: int, request: Request, file: UploadFile = File(...)):
-    """Upload a profile photo (PNG only). Only the user or moderators/admins can upload."""
+# The body is parsed by receive_upload, so the file field is only declared for the docs
+PHOTO_UPLOAD_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                    "required": ["file"],
+                }
+            }
+        },
+    }
+}
+
+
+@router.post("/{user_id}/profile-photo", openapi_extra=PHOTO_UPLOAD_BODY)
+async def upload_profile_photo(user_id: int, request: Request):
+    """Upload a profile photo (PNG only). Only the user or moderators/admins can upload.
+
+    The session and permissions are checked before any of the body is read."""
     token = request.cookies.get("session")
     if not token:
         raise HTTPException(status_code=401, detail="Нет аутентификации")
@@ -203,62 +348,58 @@ async def upload_profile_photo(user_id: int, request: Request, file: UploadFile
     if target_user.is_banned:
         raise HTTPException(status_code=403, detail="Заблокированный пользователь не может загружать фото")
 
-    # Validate file type
-    if file.content_type != "image/png":
+    # Stream the file to disk; its type is taken from the content itself
+    try:
+        upload_path, _ = await receive_upload(request, "file", AVATAR_INPUT_FORMATS)
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail=f"Файл больше {UPLOAD_MAX_BYTES // (1024 * 1024)} МБ")
+    except UnsupportedFileType:
         raise HTTPException(status_code=400, detail="Только PNG файлы поддерживаются")
+    except UploadMissing:
+        raise HTTPException(status_code=400, detail="Файл не передан")
 
-    # Validate file extension
-    if not file.filename.lower().endswith(".png"):
-        raise HTTPException(status_code=400, detail="Файл должен иметь расширение .png")
-
-    # Save the file with user_id as filename (will overwrite previous photo)
-    file_extension = ".png"
-    unique_filename = f"{user_id}{file_extension}"
-    file_path = os.path.join(UPLOAD_DIR, unique_filename)
-
+    staging = staging_dir()
     try:
-        contents = await file.read()
-        
-        # Resize image to square (256x256)
+        # Square avatars in every size and format, rendered in the image worker pool
         try:
-            image = Image.open(BytesIO(contents))
-            # Convert RGBA to RGB if necessary
-            if image.mode in ('RGBA', 'LA', 'P'):
-                rgb_image = Image.new('RGB', image.size, (255, 255, 255))
-                rgb_image.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
-                image = rgb_image
-            
-            # Resize to square (256x256)
-            image.thumbnail((256, 256), Image.Resampling.LANCZOS)
-            # Create a square canvas
-            square_image = Image.new('RGB', (256, 256), (255, 255, 255))
-            offset = ((256 - image.width) // 2, (256 - image.height) // 2)
-            square_image.paste(image, offset)
-            
-            # Save resized image
-            square_image.save(file_path, 'PNG', optimize=True)
-        except Exception as img_err:
+            variants = await save_avatars(upload_path, staging, str(user_id))
+        except ImageTooLarge:
+            raise HTTPException(status_code=413, detail="Изображение слишком большое")
+        except ImageError as img_err:
             raise HTTPException(status_code=400, detail=f"Ошибка при обработке изображения: {str(img_err)}")
-        
-        # Delete old photo if exists (same filename, will be overwritten but just in case)
-        # No need since we're using the same filename
-        
-        # Save filename to database
-        success = await save_profile_photo(user_id, unique_filename)
+        except ImageQueueFull:
+            raise HTTPException(status_code=503, detail="Сервер перегружен, попробуйте позже")
+        except ImageUnavailable:
+            raise HTTPException(status_code=503, detail="Обработка изображений временно недоступна, попробуйте позже")
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail="Обработка изображения заняла слишком много времени")
+
+        # Files first, so the new names never point at missing objects
+        try:
+            await _store_photo_files(staging, avatar_filenames(variants))
+        except StorageError as e:
+            await _remove_photo_files(avatar_filenames(variants))
+            raise HTTPException(status_code=500, detail=f"Не удалось сохранить фото: {str(e)}")
+
+        # The largest PNG stays in profile_photo for clients that predate the variants
+        filename = variants[str(max(AVATAR_SIZES))]["png"]
+        success = await save_profile_photo(user_id, filename, variants)
         if not success:
+            await _remove_photo_files(avatar_filenames(variants))
             raise HTTPException(status_code=500, detail="Не удалось сохранить фото в базу данных")
-        
-        return {"status": "ok", "filename": unique_filename, "message": "Фото профиля загружено"}
+
+        # File names change with the content, so the previous files are garbage now
+        new_files = set(avatar_filenames(variants))
+        await _remove_photo_files([f for f in _photo_files(target_user) if f not in new_files])
+
+        return {"status": "ok", "filename": filename, "variants": variants, "message": "Фото профиля загружено"}
     except HTTPException:
-        # Clean up file if save failed
-        if os.path.exists(file_path):
-            os.remove(file_path)
         raise
     except Exception as e:
-        # Clean up file if save failed
-        if os.path.exists(file_path):
-            os.remove(file_path)
         raise HTTPException(status_code=500, detail=f"Ошибка при загрузке фото: {str(e)}")
+    finally:
+        remove_upload(upload_path)
+        shutil.rmtree(staging, ignore_errors=True)
 
 
 @router.delete("/{user_id}/profile-photo")
@@ -286,14 +427,10 @@ async def delete_profile_photo_endpoint(user_id: int, request: Request):
     if not target_user.profile_photo:
         raise HTTPException(status_code=400, detail="У этого пользователя нет фото профиля")
 
-    # Delete file
-    file_path = os.path.join(UPLOAD_DIR, target_user.profile_photo)
-    if os.path.exists(file_path):
-        os.remove(file_path)
-
-    # Delete from database
+    # Delete from database, then the files nobody references any more
     success = await delete_profile_photo(user_id)
     if not success:
         raise HTTPException(status_code=500, detail="Не удалось удалить фото из базы данных")
+    await _remove_photo_files(_photo_files(target_user))
 
     return {"status": "ok", "message": "Фото профиля удалено"}
\ No newline at end of file
@@ -0,0 +1,120 @@
+"""Response models for the read endpoints.
+
+Declaring them as ``response_model`` lets pydantic-core serialize route
+results in a single pass, including the display-formatted dates the
+frontend shows verbatim.
+"""
+from datetime import datetime
+from typing import Annotated, Optional
+
+from pydantic import BaseModel, PlainSerializer
+
+DISPLAY_DATE_FORMAT = "%d.%m.%Y, %H:%M:%S"
+
+# Dates rendered as "dd.mm.yyyy, HH:MM:SS" instead of ISO 8601
+DisplayDateTime = Annotated[datetime, PlainSerializer(lambda d: d.strftime(DISPLAY_DATE_FORMAT), return_type=str)]
+
+
+class TagOut(BaseModel):
+    idtag: int
+    name: str
+
+
+class TagWithCountOut(TagOut):
+    description: Optional[str] = None
+    post_count: int
+
+
+# Post and user models are also used for sparse fieldsets (?fields=), so every
+# field is optional and the routes serialize with response_model_exclude_unset.
+class PostCard(BaseModel):
+    idposts: Optional[int] = None
+    title: Optional[str] = None
+    text: Optional[str] = None
+    date: Optional[datetime] = None
+    author_id: Optional[int] = None
+    author_name: Optional[str] = None
+    rating: Optional[int] = None
+    comment_count: Optional[int] = None
+    view_count: Optional[int] = None
+
+
+class PostDetail(PostCard):
+    tags: Optional[list[TagOut]] = None
+
+
+class CommentOut(BaseModel):
+    idcomments: int
+    text: str
+    author_id: int
+    author_name: str
+    author_role: Optional[str]
+    parent_id: Optional[int]
+    date: Optional[DisplayDateTime]
+
+
+class MessageOut(BaseModel):
+    id: int
+    user_from: int
+    user_to: int
+    sender_name: str
+    text: str
+    date: Optional[DisplayDateTime]
+
+
+class ConversationOut(BaseModel):
+    id: int
+    username: str
+    last_message_date: Optional[DisplayDateTime]
+
+
+class UserOut(BaseModel):
+    id: Optional[int] = None
+    username: Optional[str] = None
+    role: Optional[str] = None
+    is_banned: Optional[bool] = None
+    registration_date: Optional[datetime] = None
+
+
+class UserProfileOut(BaseModel):
+    id: Optional[int] = None
+    username: Optional[str] = None
+    role: Optional[str] = None
+    is_banned: Optional[bool] = None
+    registration_date: Optional[DisplayDateTime] = None
+    total_rating: Optional[int] = None
+    profile_photo: Optional[str] = None
+    # {size: {format: filename}}
+    profile_photos: Optional[dict[str, dict[str, str]]] = None
+
+
+class RatingOut(BaseModel):
+    post_id: int
+    positive: int
+    negative: int
+    total: int
+
+
+class UserRatingOut(BaseModel):
+    rated: bool
+    is_positive: Optional[bool] = None
+
+
+class PostPageOut(BaseModel):
+    """Everything the post page renders, fetched in one request."""
+    post: PostDetail
+    rating: RatingOut
+    user_rating: UserRatingOut
+    comments: list[CommentOut]
+    author: Optional[UserProfileOut]
+
+
+def parse_fields(value: Optional[str], allowed: tuple) -> Optional[tuple]:
+    """Parse a comma-separated ``fields`` parameter; None means all fields."""
+    if not value:
+        return None
+    fields = tuple(dict.fromkeys(f.strip() for f in value.split(",") if f.strip()))
+    unknown = [f for f in fields if f not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields or None
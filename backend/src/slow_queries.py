@@ -0,0 +1,138 @@
+"""Slow query log.
+
+Statements slower than ``SLOW_QUERY_MS`` are logged with their parameters,
+the route being served and the ``users.py`` function that issued them, and
+kept in a ring buffer served at ``GET /admin/slow-queries``. A sampled
+fraction of slow SELECTs is re-run under ``EXPLAIN (ANALYZE, BUFFERS)`` on a
+separate connection and the plan is attached to the entry.
+"""
+import asyncio
+import contextvars
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import time
+from collections import deque
+from datetime import datetime
+from typing import Optional
+
+import greenlet
+from sqlalchemy import event
+
+try:
+    from .db import engines, _env_int
+    from .metrics import Counter
+    from .instrumentation import current_route
+except Exception:
+    from db import engines, _env_int
+    from metrics import Counter
+    from instrumentation import current_route
+
+# 0 disables the log
+SLOW_QUERY_MS = _env_int("SLOW_QUERY_MS", 200)
+SLOW_QUERY_EXPLAIN_SAMPLE = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE", "0.1"))
+SLOW_QUERY_BUFFER_SIZE = _env_int("SLOW_QUERY_BUFFER_SIZE", 100)
+# Longest parameter repr kept per entry
+PARAMS_MAX_CHARS = 500
+
+USERS_MODULE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "users.py")
+
+logger = logging.getLogger("uvicorn.error")
+
+SLOW_QUERIES = Counter("db_slow_queries_total", "Statements slower than SLOW_QUERY_MS", labelnames=("route",))
+
+slow_queries: deque = deque(maxlen=SLOW_QUERY_BUFFER_SIZE)
+_ids = itertools.count(1)
+_explains: set = set()
+
+
+def _calling_function() -> Optional[str]:
+    """Innermost users.py frame that led to the statement.
+
+    SQLAlchemy's asyncio layer runs the driver call in a child greenlet, so the
+    search continues into the parent greenlet's suspended stack.
+    """
+    frame, current = sys._getframe(1), greenlet.getcurrent()
+    while True:
+        while frame is not None:
+            if frame.f_code.co_filename == USERS_MODULE:
+                return f"{frame.f_code.co_name}:{frame.f_lineno}"
+            frame = frame.f_back
+        current = current.parent
+        if current is None:
+            return None
+        frame = current.gr_frame
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("slow_query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed_ms = (time.perf_counter() - conn.info["slow_query_started"].pop()) * 1000
+    if elapsed_ms < SLOW_QUERY_MS or conn.info.get("explaining"):
+        return
+
+    route = current_route()
+    entry = {
+        "id": next(_ids),
+        "time": datetime.utcnow().isoformat(),
+        "duration_ms": round(elapsed_ms, 1),
+        "pool": conn.engine.pool.logging_name or "primary",
+        "route": route,
+        "function": _calling_function(),
+        "statement": statement,
+        "parameters": repr(parameters)[:PARAMS_MAX_CHARS],
+        "plan": None,
+    }
+    slow_queries.append(entry)
+    SLOW_QUERIES.inc(route=route or "none")
+    logger.warning(
+        "Slow query %.1fms (route %s, %s): %s params=%s",
+        elapsed_ms, route, entry["function"], " ".join(statement.split()), entry["parameters"],
+    )
+
+    # EXPLAIN ANALYZE executes the statement again, so only ever for reads
+    if not executemany and statement.lstrip()[:6].upper() == "SELECT" and random.random() < SLOW_QUERY_EXPLAIN_SAMPLE:
+        # A fresh context keeps the extra statement out of the request's metrics and audit
+        task = asyncio.get_running_loop().create_task(
+            _explain(entry, statement, parameters), context=contextvars.Context()
+        )
+        _explains.add(task)
+        task.add_done_callback(_explains.discard)
+
+
+async def _explain(entry: dict, statement: str, parameters):
+    try:
+        async with engines[entry["pool"]].connect() as conn:
+            conn.sync_connection.info["explaining"] = True
+            try:
+                result = await conn.exec_driver_sql("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + statement, parameters)
+                plan = result.scalar()
+                await conn.rollback()
+            finally:
+                conn.sync_connection.info.pop("explaining", None)
+        entry["plan"] = json.loads(plan) if isinstance(plan, str) else plan
+    except Exception as exc:
+        logger.warning("EXPLAIN of slow query %s failed: %r", entry["id"], exc)
+
+
+def _handle_error(exception_context):
+    started = exception_context.connection.info.get("slow_query_started") if exception_context.connection else None
+    if started:
+        started.pop()
+
+
+def recent_slow_queries(limit: int) -> list:
+    """Newest first."""
+    return list(itertools.islice(reversed(slow_queries), limit))
+
+
+if SLOW_QUERY_MS > 0:
+    for _engine in engines.values():
+        event.listen(_engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(_engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(_engine.sync_engine, "handle_error", _handle_error)
@@ -0,0 +1,128 @@
+"""Static file serving for uploads.
+
+Avatar files written by ``images.save_avatars`` carry a hash of their
+content in the name, so a URL never changes meaning and browsers and proxies
+may keep them forever (``UPLOADS_IMMUTABLE_CACHE_CONTROL``); the hash is
+also their ETag, the same on every server. Everything else, such as legacy
+``{user_id}.png`` photos that were overwritten in place, gets
+``UPLOADS_CACHE_CONTROL``.
+
+Conditional requests (If-None-Match / If-Modified-Since) are answered with
+304 and Range requests with 206 by Starlette's FileResponse, which also hands
+the file to the server with ``http.response.pathsend`` when the server
+supports it (e.g. Granian, Hypercorn), instead of reading it in Python.
+
+When uploads live in a remote object store (``STORAGE_URL``, see storage.py),
+``StorageFiles`` takes over ``/uploads``: it redirects to the object's public
+or presigned URL, or serves the bytes itself for the in-memory backend.
+
+With ``UPLOADS_ACCEL_REDIRECT`` set to an internal location of the front
+proxy, the app only resolves the path and sets the headers; the proxy sends
+the bytes itself. For nginx::
+
+    location /_uploads/ {
+        internal;
+        alias /srv/nextdev/backend/uploads/;
+    }
+"""
+import logging
+import os
+import re
+from mimetypes import guess_type
+from urllib.parse import quote
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, PlainTextResponse, RedirectResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+try:
+    from .storage import STORAGE_PRESIGN_SECONDS, STORAGE_PUBLIC_URL, LocalBackend, StorageBackend, StorageError
+except Exception:
+    from storage import STORAGE_PRESIGN_SECONDS, STORAGE_PUBLIC_URL, LocalBackend, StorageBackend, StorageError
+
+UPLOADS_CACHE_CONTROL = os.getenv("UPLOADS_CACHE_CONTROL", "no-cache")
+UPLOADS_IMMUTABLE_CACHE_CONTROL = os.getenv("UPLOADS_IMMUTABLE_CACHE_CONTROL", "public, max-age=31536000, immutable")
+# Internal proxy location mapped to the uploads directory, e.g. "/_uploads/"; empty serves from Python
+UPLOADS_ACCEL_REDIRECT = os.getenv("UPLOADS_ACCEL_REDIRECT", "")
+
+logger = logging.getLogger("uvicorn.error")
+
+# {prefix}-{16 hex digits}-{size}.{format}
+HASHED_NAME_RE = re.compile(r"-([0-9a-f]{16})-\d+\.\w+$")
+
+
+def _cache_headers(name: str) -> dict:
+    hashed = HASHED_NAME_RE.search(name)
+    headers = {"Cache-Control": UPLOADS_IMMUTABLE_CACHE_CONTROL if hashed else UPLOADS_CACHE_CONTROL}
+    if hashed:
+        headers["ETag"] = f'"{hashed.group(1)}"'
+    return headers
+
+
+class UploadStaticFiles(StaticFiles):
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        headers = _cache_headers(str(full_path))
+        hashed = "ETag" in headers
+
+        if UPLOADS_ACCEL_REDIRECT:
+            relative = os.path.relpath(full_path, self.directory).replace(os.sep, "/")
+            headers["X-Accel-Redirect"] = UPLOADS_ACCEL_REDIRECT.rstrip("/") + "/" + quote(relative)
+            media_type = guess_type(str(full_path))[0] or "application/octet-stream"
+            response = Response(status_code=status_code, media_type=media_type, headers=headers)
+            # Revalidation of a hashed name is answered here; the proxy handles the rest
+            if not hashed:
+                return response
+        else:
+            response = FileResponse(full_path, status_code=status_code, headers=headers, stat_result=stat_result)
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+class StorageFiles:
+    """Serves ``/uploads`` from a storage backend other than the local filesystem."""
+
+    def __init__(self, storage: StorageBackend):
+        self.storage = storage
+
+    async def __call__(self, scope, receive, send):
+        assert scope["type"] == "http"
+        if scope["method"] not in ("GET", "HEAD"):
+            response = PlainTextResponse("Method Not Allowed", status_code=405)
+        else:
+            root_path = scope.get("root_path", "")
+            path = scope["path"][len(root_path):] if scope["path"].startswith(root_path) else scope["path"]
+            response = await self.get_response(path.lstrip("/"), Headers(scope=scope))
+        await response(scope, receive, send)
+
+    async def get_response(self, key: str, request_headers: Headers) -> Response:
+        if not key or ".." in key.split("/"):
+            return PlainTextResponse("Not Found", status_code=404)
+        headers = _cache_headers(key)
+
+        url = self.storage.url(key)
+        if url is not None:
+            # A presigned URL expires, so the redirect to it may only be cached for a while
+            if not STORAGE_PUBLIC_URL:
+                headers["Cache-Control"] = f"private, max-age={STORAGE_PRESIGN_SECONDS // 2}"
+            headers.pop("ETag", None)
+            return RedirectResponse(url, status_code=307, headers=headers)
+
+        if "ETag" in headers and headers["ETag"] in request_headers.get("if-none-match", ""):
+            return NotModifiedResponse(Headers(headers=headers))
+        try:
+            data = await self.storage.get(key)
+        except StorageError as e:
+            logger.error("Reading upload %s from storage failed: %s", key, e)
+            return PlainTextResponse("Storage Unavailable", status_code=503, headers={"Retry-After": "5"})
+        if data is None:
+            return PlainTextResponse("Not Found", status_code=404)
+        media_type = guess_type(key)[0] or "application/octet-stream"
+        return Response(data, media_type=media_type, headers=headers)
+
+
+def uploads_app(storage: StorageBackend):
+    """The ASGI app mounted at ``/uploads`` for the configured storage backend."""
+    if isinstance(storage, LocalBackend):
+        return UploadStaticFiles(directory=storage.root, check_dir=False)
+    return StorageFiles(storage)
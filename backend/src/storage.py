@@ -0,0 +1,367 @@
+"""Object storage for uploaded files.
+
+``STORAGE_URL`` selects the backend:
+
+- ``file://uploads`` (default) keeps objects under a local directory, which
+  ``/uploads`` serves directly; only usable with a single node or a shared
+  filesystem;
+- ``memory://`` keeps them in the worker process (development, tests);
+- ``s3://bucket[/prefix]`` stores them in any S3-compatible service (AWS,
+  MinIO, Ceph...), so every app node reads and writes the same objects.
+  ``S3_ENDPOINT_URL``, ``S3_REGION``, ``AWS_ACCESS_KEY_ID`` and
+  ``AWS_SECRET_ACCESS_KEY`` configure the client. Requests are signed with
+  AWS Signature Version 4 over httpx; files above ``S3_MULTIPART_THRESHOLD``
+  are sent as a multipart upload in ``S3_PART_SIZE`` parts, read from disk
+  one part at a time.
+
+Keys are relative paths such as ``profile_photos/5-<hash>-256.webp``, the
+same as the path under ``/uploads``. ``url()`` gives the address clients
+should fetch an object from: ``STORAGE_PUBLIC_URL`` + key when the bucket
+(or a CDN in front of it) is public, otherwise a presigned GET valid for
+``STORAGE_PRESIGN_SECONDS``; None when the app has to serve it itself.
+"""
+import asyncio
+import hashlib
+import hmac
+import os
+import re
+import shutil
+import tempfile
+from datetime import datetime, timezone
+from typing import Optional
+from urllib.parse import quote, urlsplit
+
+import httpx
+
+try:
+    from .db import _env_int
+    from .metrics import Counter
+except Exception:
+    from db import _env_int
+    from metrics import Counter
+
+STORAGE_URL = os.getenv("STORAGE_URL", "file://uploads")
+STORAGE_PUBLIC_URL = os.getenv("STORAGE_PUBLIC_URL", "")
+STORAGE_PRESIGN_SECONDS = _env_int("STORAGE_PRESIGN_SECONDS", 3600)
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL", "")
+S3_REGION = os.getenv("S3_REGION", "us-east-1")
+S3_MULTIPART_THRESHOLD = _env_int("S3_MULTIPART_THRESHOLD", 16 * 1024 * 1024)
+# S3 requires at least 5 MiB for every part but the last
+S3_PART_SIZE = max(_env_int("S3_PART_SIZE", 8 * 1024 * 1024), 5 * 1024 * 1024)
+S3_TIMEOUT_SECONDS = float(os.getenv("S3_TIMEOUT_SECONDS", "30"))
+
+STORAGE_OPERATIONS = Counter("storage_operations_total", "Object storage operations", labelnames=("backend", "operation", "result"))
+
+
+class StorageError(Exception):
+    pass
+
+
+class StorageBackend:
+    name = ""
+
+    def prepare(self):
+        """Called once on application startup."""
+
+    async def put_bytes(self, key: str, data: bytes, content_type: str):
+        raise NotImplementedError
+
+    async def put_file(self, key: str, path: str, content_type: str):
+        """Store the file at ``path``; the file itself may be moved or left in place."""
+        raise NotImplementedError
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """The object's bytes, None if it does not exist; StorageError if the store fails."""
+        raise NotImplementedError
+
+    async def delete(self, key: str):
+        """Remove an object; missing objects are not an error."""
+        raise NotImplementedError
+
+    def url(self, key: str) -> Optional[str]:
+        return STORAGE_PUBLIC_URL.rstrip("/") + "/" + quote(key) if STORAGE_PUBLIC_URL else None
+
+
+class LocalBackend(StorageBackend):
+    """Files under a directory; blocking filesystem calls run in threads."""
+    name = "file"
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def prepare(self):
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        path = os.path.normpath(os.path.join(self.root, key))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise StorageError(f"Key outside of the storage root: {key}")
+        return path
+
+    def _write_aside(self, path: str, write):
+        """Write through ``write(file)`` to a temporary name next to ``path``, then rename.
+
+        A reader never sees half a file, even one that replaces an existing
+        (immutable, long cached) object of the same name.
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def _write(self, key: str, data: bytes):
+        self._write_aside(self.path(key), lambda f: f.write(data))
+
+    def _move(self, key: str, source: str):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.stat(source).st_dev == os.stat(os.path.dirname(path)).st_dev:
+            # Same filesystem: the rename is atomic
+            os.replace(source, path)
+            return
+        # Staging lives in /tmp, often another filesystem, where a move copies in place
+        with open(source, "rb") as src:
+            self._write_aside(path, lambda f: shutil.copyfileobj(src, f, 1024 * 1024))
+        os.remove(source)
+
+    def _read(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self.path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _remove(self, key: str):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    async def put_bytes(self, key: str, data: bytes, content_type: str):
+        await asyncio.to_thread(self._write, key, data)
+
+    async def put_file(self, key: str, path: str, content_type: str):
+        await asyncio.to_thread(self._move, key, path)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await asyncio.to_thread(self._read, key)
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self._remove, key)
+
+
+class MemoryBackend(StorageBackend):
+    """Objects in a dict; visible to this worker process only."""
+    name = "memory"
+
+    def __init__(self):
+        self.objects: dict = {}  # key -> (content type, data)
+
+    async def put_bytes(self, key: str, data: bytes, content_type: str):
+        self.objects[key] = (content_type, data)
+
+    async def put_file(self, key: str, path: str, content_type: str):
+        with open(path, "rb") as f:
+            self.objects[key] = (content_type, f.read())
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self.objects.get(key)
+        return entry[1] if entry else None
+
+    async def delete(self, key: str):
+        self.objects.pop(key, None)
+
+
+def _sign(key: bytes, message: str) -> bytes:
+    return hmac.new(key, message.encode(), hashlib.sha256).digest()
+
+
+def _uri_encode(value: str, safe: str = "-_.~") -> str:
+    return quote(value, safe=safe)
+
+
+class S3Backend(StorageBackend):
+    """S3 REST API with path-style addressing and Signature Version 4."""
+    name = "s3"
+
+    def __init__(self, url: str, endpoint: str = S3_ENDPOINT_URL, region: str = S3_REGION,
+                 access_key: Optional[str] = None, secret_key: Optional[str] = None):
+        parts = urlsplit(url)
+        self.bucket = parts.netloc
+        self.prefix = parts.path.strip("/")
+        self.region = region
+        self.endpoint = (endpoint or f"https://s3.{region}.amazonaws.com").rstrip("/")
+        self.host = urlsplit(self.endpoint).netloc
+        self.access_key = access_key if access_key is not None else os.getenv("AWS_ACCESS_KEY_ID", "")
+        self.secret_key = secret_key if secret_key is not None else os.getenv("AWS_SECRET_ACCESS_KEY", "")
+        self._loop = None
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _client_for_loop(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Pooled connections are bound to the event loop that opened them
+            self._loop, self._client = loop, httpx.AsyncClient(timeout=S3_TIMEOUT_SECONDS)
+        return self._client
+
+    def _path(self, key: str) -> str:
+        object_key = f"{self.prefix}/{key}" if self.prefix else key
+        return "/" + _uri_encode(self.bucket) + "/" + _uri_encode(object_key, safe="-_.~/")
+
+    def _signing_key(self, date: str) -> bytes:
+        key = _sign(("AWS4" + self.secret_key).encode(), date)
+        for part in (self.region, "s3", "aws4_request"):
+            key = _sign(key, part)
+        return key
+
+    def _signature(self, method: str, path: str, query: dict, headers: dict, payload_hash: str, now: datetime) -> tuple:
+        """Returns (credential scope, signed header names, signature)."""
+        date = now.strftime("%Y%m%d")
+        scope = f"{date}/{self.region}/s3/aws4_request"
+        canonical_query = "&".join(f"{_uri_encode(k)}={_uri_encode(str(v))}" for k, v in sorted(query.items()))
+        names = sorted(name.lower() for name in headers)
+        canonical_headers = "".join(f"{name}:{str(headers[name]).strip()}\n" for name in names)
+        signed_headers = ";".join(names)
+        canonical_request = "\n".join([method, path, canonical_query, canonical_headers, signed_headers, payload_hash])
+        string_to_sign = "\n".join([
+            "AWS4-HMAC-SHA256",
+            now.strftime("%Y%m%dT%H%M%SZ"),
+            scope,
+            hashlib.sha256(canonical_request.encode()).hexdigest(),
+        ])
+        signature = hmac.new(self._signing_key(date), string_to_sign.encode(), hashlib.sha256).hexdigest()
+        return scope, signed_headers, signature
+
+    async def _request(self, method: str, key: str, query: Optional[dict] = None, body: bytes = b"",
+                       headers: Optional[dict] = None, ok: tuple = (200, 204)) -> httpx.Response:
+        query = query or {}
+        path = self._path(key)
+        now = datetime.now(timezone.utc)
+        payload_hash = hashlib.sha256(body).hexdigest()
+        headers = {
+            "host": self.host,
+            "x-amz-content-sha256": payload_hash,
+            "x-amz-date": now.strftime("%Y%m%dT%H%M%SZ"),
+            **{name.lower(): value for name, value in (headers or {}).items()},
+        }
+        scope, signed_headers, signature = self._signature(method, path, query, headers, payload_hash, now)
+        headers["authorization"] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+            f"SignedHeaders={signed_headers}, Signature={signature}"
+        )
+        url = self.endpoint + path
+        if query:
+            url += "?" + "&".join(f"{_uri_encode(k)}={_uri_encode(str(v))}" for k, v in sorted(query.items()))
+        try:
+            response = await self._client_for_loop().request(method, url, content=body, headers=headers)
+        except httpx.HTTPError as exc:
+            STORAGE_OPERATIONS.inc(backend=self.name, operation=method, result="error")
+            raise StorageError(f"{method} {key}: {exc!r}") from exc
+        if response.status_code not in ok:
+            STORAGE_OPERATIONS.inc(backend=self.name, operation=method, result="error")
+            raise StorageError(f"{method} {key}: HTTP {response.status_code} {response.text[:200]}")
+        STORAGE_OPERATIONS.inc(backend=self.name, operation=method, result="ok")
+        return response
+
+    async def put_bytes(self, key: str, data: bytes, content_type: str):
+        await self._request("PUT", key, body=data, headers={"content-type": content_type})
+
+    async def put_file(self, key: str, path: str, content_type: str):
+        size = os.path.getsize(path)
+        if size <= S3_MULTIPART_THRESHOLD:
+            data = await asyncio.to_thread(_read_range, path, 0, size)
+            await self.put_bytes(key, data, content_type)
+            return
+
+        response = await self._request("POST", key, query={"uploads": ""}, headers={"content-type": content_type})
+        upload_id = _xml_value(response.text, "UploadId")
+        try:
+            etags = []
+            for number, offset in enumerate(range(0, size, S3_PART_SIZE), start=1):
+                # One part in memory at a time
+                part = await asyncio.to_thread(_read_range, path, offset, S3_PART_SIZE)
+                response = await self._request("PUT", key, query={"partNumber": number, "uploadId": upload_id}, body=part)
+                etags.append(response.headers["etag"])
+            manifest = "".join(
+                f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>"
+                for number, etag in enumerate(etags, start=1)
+            )
+            response = await self._request(
+                "POST", key, query={"uploadId": upload_id},
+                body=f"<CompleteMultipartUpload>{manifest}</CompleteMultipartUpload>".encode(),
+            )
+            # S3 can report a failed completion with status 200
+            if "<Error>" in response.text:
+                raise StorageError(f"Completing multipart upload of {key}: {response.text[:200]}")
+        except BaseException:
+            try:
+                await self._request("DELETE", key, query={"uploadId": upload_id})
+            except StorageError:
+                pass
+            raise
+
+    async def get(self, key: str) -> Optional[bytes]:
+        # Errors propagate: an outage must not look like a missing object
+        response = await self._request("GET", key, ok=(200, 404))
+        return response.content if response.status_code == 200 else None
+
+    async def delete(self, key: str):
+        await self._request("DELETE", key, ok=(200, 204, 404))
+
+    def url(self, key: str) -> Optional[str]:
+        return super().url(key) or self.presigned_url(key)
+
+    def presigned_url(self, key: str, expires: int = STORAGE_PRESIGN_SECONDS, method: str = "GET") -> str:
+        """Query-string signed URL that lets anyone ``method`` the object until it expires."""
+        path = self._path(key)
+        now = datetime.now(timezone.utc)
+        query = {
+            "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+            "X-Amz-Credential": f"{self.access_key}/{now.strftime('%Y%m%d')}/{self.region}/s3/aws4_request",
+            "X-Amz-Date": now.strftime("%Y%m%dT%H%M%SZ"),
+            "X-Amz-Expires": expires,
+            "X-Amz-SignedHeaders": "host",
+        }
+        _, _, signature = self._signature(method, path, query, {"host": self.host}, "UNSIGNED-PAYLOAD", now)
+        query["X-Amz-Signature"] = signature
+        return self.endpoint + path + "?" + "&".join(
+            f"{_uri_encode(k)}={_uri_encode(str(v))}" for k, v in sorted(query.items())
+        )
+
+
+def _read_range(path: str, offset: int, length: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return f.read(length)
+
+
+def _xml_value(document: str, tag: str) -> str:
+    match = re.search(rf"<{tag}>([^<]*)</{tag}>", document)
+    if not match:
+        raise StorageError(f"No {tag} in response: {document[:200]}")
+    return match.group(1)
+
+
+def make_backend(url: str) -> StorageBackend:
+    parts = urlsplit(url)
+    if parts.scheme == "file":
+        # file://uploads is relative to the working directory, file:///srv/uploads absolute
+        return LocalBackend(parts.netloc + parts.path)
+    if parts.scheme == "memory":
+        return MemoryBackend()
+    if parts.scheme == "s3":
+        return S3Backend(url)
+    raise ValueError(f"Unsupported STORAGE_URL scheme: {parts.scheme}")
+
+
+backend: StorageBackend = make_backend(STORAGE_URL)
+
+
+def staging_dir() -> str:
+    """A fresh local directory for files on their way into storage; the caller removes it."""
+    return tempfile.mkdtemp(prefix="storage-")
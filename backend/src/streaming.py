@@ -0,0 +1,37 @@
+"""Streaming encoders for large list responses.
+
+Rows are validated against the endpoint's response model one at a time and
+flushed in small chunks, so memory use does not grow with the result size.
+"""
+from typing import AsyncIterator, Type
+
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+# Flush to the client once this many encoded bytes are buffered
+CHUNK_SIZE = 64 * 1024
+
+STREAM_FORMATS = "^(ndjson|json)$"
+
+
+async def _encode(rows: AsyncIterator[dict], model: Type[BaseModel], prefix: bytes, separator: bytes, terminator: bytes, suffix: bytes):
+    buffer = bytearray(prefix)
+    first = True
+    async for row in rows:
+        if not first:
+            buffer += separator
+        first = False
+        buffer += model.model_validate(row).model_dump_json(exclude_unset=True).encode()
+        buffer += terminator
+        if len(buffer) >= CHUNK_SIZE:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += suffix
+    yield bytes(buffer)
+
+
+def stream_response(rows: AsyncIterator[dict], model: Type[BaseModel], fmt: str) -> StreamingResponse:
+    """Encode rows as NDJSON (one object per line) or as an incrementally written JSON array."""
+    if fmt == "ndjson":
+        return StreamingResponse(_encode(rows, model, b"", b"", b"\n", b""), media_type="application/x-ndjson")
+    return StreamingResponse(_encode(rows, model, b"[", b",", b"", b"]"), media_type="application/json")
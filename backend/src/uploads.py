@@ -0,0 +1,124 @@
+"""Size-capped streaming ingestion of file uploads.
+
+``receive_upload`` parses the multipart body itself instead of letting the
+route signature (``UploadFile = File(...)``) buffer it before the handler
+runs, so an oversized upload is refused from its Content-Length, or as soon
+as the streamed body passes ``UPLOAD_MAX_BYTES`` when the length is not
+declared. File data is spooled in memory only up to ``UPLOAD_SPOOL_BYTES``
+and then goes to disk; the result is a named temporary file that a worker
+process can open by path. The file type comes from the leading bytes of the
+content, not from the client's Content-Type or file name.
+"""
+import os
+import shutil
+import tempfile
+from typing import Optional
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import UploadFile
+from starlette.formparsers import MultiPartException, MultiPartParser
+
+try:
+    from .db import _env_int
+except Exception:
+    from db import _env_int
+
+UPLOAD_MAX_BYTES = _env_int("UPLOAD_MAX_BYTES", 10 * 1024 * 1024)
+UPLOAD_SPOOL_BYTES = _env_int("UPLOAD_SPOOL_BYTES", 256 * 1024)
+# Boundaries, part headers and small form fields on top of the file itself
+MULTIPART_OVERHEAD_BYTES = 16 * 1024
+COPY_CHUNK_BYTES = 64 * 1024
+
+# Leading bytes of the formats Pillow is asked to decode
+SIGNATURES = {
+    "png": (b"\x89PNG\r\n\x1a\n",),
+    "jpeg": (b"\xff\xd8\xff",),
+    "gif": (b"GIF87a", b"GIF89a"),
+}
+SNIFF_BYTES = 16
+
+
+class UploadError(Exception):
+    pass
+
+
+class UploadTooLarge(UploadError, MultiPartException):
+    # A MultiPartException, so the parser closes its spooled files when the cap aborts it
+    def __init__(self):
+        MultiPartException.__init__(self, "upload too large")
+
+
+class UploadMissing(UploadError):
+    pass
+
+
+class UnsupportedFileType(UploadError):
+    pass
+
+
+class _UploadParser(MultiPartParser):
+    spool_max_size = UPLOAD_SPOOL_BYTES
+
+
+def sniff(head: bytes) -> Optional[str]:
+    for fmt, signatures in SIGNATURES.items():
+        if head.startswith(signatures):
+            return fmt
+    return None
+
+
+async def _capped(stream, max_bytes: int):
+    received = 0
+    async for chunk in stream:
+        received += len(chunk)
+        if received > max_bytes:
+            raise UploadTooLarge()
+        yield chunk
+
+
+def _copy_to_tempfile(file) -> str:
+    with tempfile.NamedTemporaryFile(prefix="upload-", delete=False) as tmp:
+        shutil.copyfileobj(file, tmp, COPY_CHUNK_BYTES)
+    return tmp.name
+
+
+async def receive_upload(request, field: str, formats: tuple, max_bytes: int = UPLOAD_MAX_BYTES) -> tuple:
+    """Stream the multipart file ``field`` of ``request`` to a temporary file.
+
+    Returns ``(path, format)``; the caller removes the file. Raises
+    UploadTooLarge, UploadMissing (no such file field or not a multipart
+    body) or UnsupportedFileType (content is not one of ``formats``).
+    """
+    limit = max_bytes + MULTIPART_OVERHEAD_BYTES
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > limit:
+        raise UploadTooLarge()
+    if not request.headers.get("content-type", "").startswith("multipart/form-data"):
+        raise UploadMissing()
+
+    parser = _UploadParser(request.headers, _capped(request.stream(), limit), max_files=1, max_fields=10)
+    try:
+        form = await parser.parse()
+    except UploadTooLarge:
+        raise
+    except MultiPartException:
+        raise UploadMissing() from None
+    try:
+        upload = form.get(field)
+        if not isinstance(upload, UploadFile):
+            raise UploadMissing()
+        if upload.size is not None and upload.size > max_bytes:
+            raise UploadTooLarge()
+        fmt = sniff(await upload.read(SNIFF_BYTES))
+        if fmt not in formats:
+            raise UnsupportedFileType()
+        await upload.seek(0)
+        path = await run_in_threadpool(_copy_to_tempfile, upload.file)
+    finally:
+        await form.close()
+    return path, fmt
+
+
+def remove_upload(path: Optional[str]):
+    if path and os.path.exists(path):
+        os.remove(path)
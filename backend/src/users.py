@@ -1,44 +1,117 @@
-from typing import Optional
-from sqlalchemy import select, insert, func, or_
+import asyncio
+from contextvars import ContextVar
+from datetime import datetime
+from typing import AsyncIterator, Optional
+from sqlalchemy import select, insert, update, delete, func, or_, case, any_, bindparam, exists, Integer
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import aliased
 from passlib.context import CryptContext
 
 try:
     # package import (preferred when running as module)
     from .models import User, Tag, Post, Comment, Rating, PrivateMessage, post_tags
-    from .db import async_session
+    from .db import async_session, async_untracked_session, read_session
+    from .cache import cached, invalidate
 except Exception:
     # fallback when running as script (no package context)
     from models import User, Tag, Post, Comment, Rating, PrivateMessage, post_tags
-    from db import async_session
+    from db import async_session, async_untracked_session, read_session
+    from cache import cached, invalidate
 
 pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
 
+# Rows fetched per round trip by the streaming (server-side cursor) queries
+STREAM_BATCH_SIZE = 500
 
-async def get_user_by_username(username: str) -> Optional[User]:
+
+# username -> pending lookup, shared by the tasks of one /batch request
+_user_lookups: ContextVar[Optional[dict]] = ContextVar("user_lookups", default=None)
+
+
+def share_user_lookups():
+    """Let concurrent tasks started from the current context share user lookups."""
+    _user_lookups.set({})
+
+
+async def _load_user_by_username(username: str) -> Optional[User]:
+    # Identity lookups back session auth and role/ban checks, so they never read a lagging replica
     async with async_session() as session:
         result = await session.execute(select(User).where(User.username == username))
         user = result.scalars().first()
         return user
 
 
-async def get_all_users(limit: int = 100):
+async def get_user_by_username(username: str) -> Optional[User]:
+    lookups = _user_lookups.get()
+    if lookups is None:
+        return await _load_user_by_username(username)
+    if username not in lookups:
+        lookups[username] = asyncio.ensure_future(_load_user_by_username(username))
+    return await lookups[username]
+
+
+USER_COLUMNS = {
+    "id": lambda: User.id,
+    "username": lambda: User.username,
+    "role": lambda: User.role,
+    "is_banned": lambda: User.is_banned,
+    "registration_date": lambda: User.registration_date,
+    "profile_photo": lambda: User.profile_photo,
+    "profile_photos": lambda: User.profile_photos,
+    "total_rating": lambda: _user_total_rating_column().label("total_rating"),
+}
+USER_FIELDS = ("id", "username", "role", "is_banned", "registration_date")
+USER_PROFILE_FIELDS = USER_FIELDS + ("total_rating", "profile_photo", "profile_photos")
+
+
+def _user_total_rating_column():
+    """Correlated subquery: rating sum over all posts of the outer user."""
+    return (
+        select(func.coalesce(func.sum(case((Rating.is_positive == True, 1), else_=-1)), 0))
+        .select_from(Rating)
+        .join(Post, Post.idposts == Rating.post_id)
+        .where(Post.author_id == User.id)
+        .scalar_subquery()
+    )
+
+
+def _users_select(fields: tuple):
+    return select(*[USER_COLUMNS[f]() for f in fields])
+
+
+async def get_all_users(limit: int = 100, fields: Optional[tuple] = None):
     """Get all users sorted by username, limited to specified count."""
-    async with async_session() as session:
+    async with read_session() as session:
         result = await session.execute(
-            select(User).order_by(User.username).limit(limit)
+            _users_select(fields or USER_FIELDS).order_by(User.username).limit(limit)
         )
-        users = result.scalars().all()
-        
-        return [
-            {
-                "id": user.id,
-                "username": user.username,
-                "role": user.role,
-                "is_banned": user.is_banned,
-                "registration_date": user.registration_date
-            }
-            for user in users
-        ]
+        return [dict(row) for row in result.mappings()]
+
+
+@cached("user:{user_id}", ttl=60, stale_ttl=60)
+async def get_user_profile(user_id: int, fields: Optional[tuple] = None) -> Optional[dict]:
+    """Get a user's public profile; ``fields`` limits the columns and aggregates fetched."""
+    async with read_session() as session:
+        result = await session.execute(
+            _users_select(fields or USER_PROFILE_FIELDS).where(User.id == user_id)
+        )
+        row = result.mappings().first()
+        return dict(row) if row else None
+
+
+async def get_user_version(user_id: int) -> Optional[tuple]:
+    """Cheap validator for a user profile: profile change time plus the state of their posts
+    (which carries total_rating). None if the user does not exist."""
+    async with read_session() as session:
+        result = await session.execute(
+            select(
+                User.updated_at,
+                select(func.count(Post.idposts)).where(Post.author_id == User.id).scalar_subquery(),
+                select(func.max(Post.updated_at)).where(Post.author_id == User.id).scalar_subquery(),
+            ).where(User.id == user_id)
+        )
+        row = result.first()
+        return tuple(row) if row else None
 
 
 async def create_user(username: str, password: str, role: str) -> User:
@@ -61,64 +134,103 @@ def verify_password(plain: str, hashed: str) -> bool:
 
 
 async def get_all_tags() -> list[Tag]:
-    async with async_session() as session:
+    async with read_session() as session:
         result = await session.execute(select(Tag))
         tags = result.scalars().all()
         return tags
 
 
+@cached("tags", ttl=300, stale_ttl=300)
 async def get_all_tags_with_post_counts():
     """Get all tags with their post counts."""
-    async with async_session() as session:
-        from sqlalchemy import func
-        
-        result = await session.execute(select(Tag))
-        tags = result.scalars().all()
-        
-        tags_data = []
-        for tag in tags:
-            # Count posts for this tag
-            count_result = await session.execute(
-                select(func.count(post_tags.c.post_id)).where(post_tags.c.tag_id == tag.idtag)
-            )
-            post_count = count_result.scalar() or 0
-            
-            tags_data.append({
-                "idtag": tag.idtag,
-                "name": tag.name,
-                "description": tag.description,
-                "post_count": post_count
-            })
-        
-        return tags_data
-
-
-async def get_all_posts():
-    async with async_session() as session:
-        result = await session.execute(select(Post).order_by(Post.date.desc()))
-        posts = result.scalars().all()
-        
-        # Fetch author information for each post
-        posts_with_authors = []
-        for post in posts:
-            author = await get_user_by_id(post.author_id)
-            rating = await get_post_rating(post.idposts)
-            comments_count = await get_post_comments_count(post.idposts)
-            posts_with_authors.append({
-                "idposts": post.idposts,
-                "title": post.title,
-                "text": post.text,
-                "date": post.date,
-                "author_id": post.author_id,
-                "author_name": author.username if author else "Unknown",
-                "rating": rating["total"],
-                "comment_count": comments_count,
-                "view_count": post.view_count or 0
-            })
-        return posts_with_authors
+    async with read_session() as session:
+        result = await session.execute(
+            select(Tag.idtag, Tag.name, Tag.description, func.count(post_tags.c.post_id).label("post_count"))
+            .outerjoin(post_tags, post_tags.c.tag_id == Tag.idtag)
+            .group_by(Tag.idtag)
+            .order_by(Tag.idtag)
+        )
+        return [dict(row) for row in result.mappings()]
+
+
+async def get_tags_version() -> tuple:
+    """Cheap validator for the tag catalog with post counts."""
+    async with read_session() as session:
+        tags = (await session.execute(select(func.count(Tag.idtag), func.max(Tag.idtag)))).one()
+        links = (await session.execute(select(func.count(), func.max(post_tags.c.post_id)).select_from(post_tags))).one()
+        return tuple(tags) + tuple(links)
+
+
+@cached("feed", ttl=10, stale_ttl=30)
+async def get_all_posts(fields: Optional[tuple] = None):
+    return await _fetch_post_cards(_post_cards_select(fields).order_by(Post.date.desc()))
+
+
+def _post_rating_column():
+    """Correlated subquery: positive minus negative ratings of the outer post."""
+    return (
+        select(func.coalesce(func.sum(case((Rating.is_positive == True, 1), else_=-1)), 0))
+        .where(Rating.post_id == Post.idposts)
+        .scalar_subquery()
+    )
+
+
+def _post_comment_count_column():
+    return (
+        select(func.count(Comment.idcomments))
+        .where(Comment.post == Post.idposts)
+        .scalar_subquery()
+    )
+
+
+POST_CARD_COLUMNS = {
+    "idposts": lambda: Post.idposts,
+    "title": lambda: Post.title,
+    "text": lambda: Post.text,
+    "date": lambda: Post.date,
+    "author_id": lambda: Post.author_id,
+    "author_name": lambda: func.coalesce(User.username, "Unknown").label("author_name"),
+    "rating": lambda: _post_rating_column().label("rating"),
+    "comment_count": lambda: _post_comment_count_column().label("comment_count"),
+    "view_count": lambda: func.coalesce(Post.view_count, 0).label("view_count"),
+}
+POST_CARD_FIELDS = tuple(POST_CARD_COLUMNS)
+POST_DETAIL_FIELDS = POST_CARD_FIELDS + ("tags",)
+
+
+def _post_cards_select(fields: Optional[tuple] = None):
+    """Post card rows with author name, rating and comment count computed in SQL.
+
+    Only the requested ``fields`` are selected; the author join and the
+    aggregate subqueries are left out when nobody asked for them.
+    """
+    fields = fields or POST_CARD_FIELDS
+    stmt = select(*[POST_CARD_COLUMNS[f]() for f in fields]).select_from(Post)
+    if "author_name" in fields:
+        stmt = stmt.outerjoin(User, User.id == Post.author_id)
+    return stmt
+
+
+async def _fetch_post_cards(stmt) -> list[dict]:
+    async with read_session() as session:
+        result = await session.execute(stmt)
+        return [dict(row) for row in result.mappings()]
+
+
+async def stream_all_posts(fields: Optional[tuple] = None) -> AsyncIterator[dict]:
+    """Stream all post cards (newest first) through a server-side cursor."""
+    async with read_session() as session:
+        result = await session.stream(
+            _post_cards_select(fields)
+            .order_by(Post.date.desc())
+            .execution_options(yield_per=STREAM_BATCH_SIZE)
+        )
+        async for row in result.mappings():
+            yield dict(row)
 
 
 async def get_user_by_id(user_id: int) -> Optional[User]:
+    # Primary, like get_user_by_username: callers check role and is_banned on the result
     async with async_session() as session:
         result = await session.execute(select(User).where(User.id == user_id))
         user = result.scalars().first()
@@ -143,6 +255,7 @@ async def create_post(title: str, text: str, author_id: int, tag_ids: list[int]
                 await session.execute(insert(post_tags).values(values))
         
         await session.commit()
+    await invalidate("feed", "tags", "leaderboards")
     
     # Retrieve the created post
     async with async_session() as session:
@@ -150,76 +263,57 @@ async def create_post(title: str, text: str, author_id: int, tag_ids: list[int]
         return result.scalars().first()
 
 
-async def get_post_by_id(post_id: int):
-    async with async_session() as session:
-        result = await session.execute(select(Post).where(Post.idposts == post_id))
-        post = result.scalars().first()
-        
-        if not post:
-            return None
-        
-        author = await get_user_by_id(post.author_id)
-        rating = await get_post_rating(post_id)
-        comments_count = await get_post_comments_count(post_id)
-        
-        # Fetch associated tags (limit to 5)
-        tags_result = await session.execute(
-            select(Tag).join(post_tags).where(post_tags.c.post_id == post_id).limit(5)
+async def get_post_version(post_id: int) -> Optional[datetime]:
+    """updated_at of a post (its HTTP validator), or None if the post does not exist."""
+    async with read_session() as session:
+        result = await session.execute(
+            select(func.coalesce(Post.updated_at, Post.date)).where(Post.idposts == post_id)
         )
-        tags = tags_result.scalars().all()
-        
-        return {
-            "idposts": post.idposts,
-            "title": post.title,
-            "text": post.text,
-            "date": post.date,
-            "author_id": post.author_id,
-            "author_name": author.username if author else "Unknown",
-            "tags": [{"idtag": tag.idtag, "name": tag.name} for tag in tags],
-            "rating": rating["total"],
-            "comment_count": comments_count,
-            "view_count": post.view_count or 0
-        }
+        return result.scalar()
 
 
+@cached("post:{post_id}", stale_ttl=60)
+async def get_post_by_id(post_id: int, fields: Optional[tuple] = None):
+    """Get a post with its details; ``fields`` limits the columns and aggregates fetched."""
+    fields = fields or POST_DETAIL_FIELDS
+    columns = tuple(f for f in fields if f != "tags") or ("idposts",)
 
-async def delete_post(post_id: int) -> bool:
-    async with async_session() as session:
-        result = await session.execute(select(Post).where(Post.idposts == post_id))
-        post = result.scalars().first()
+    async with read_session() as session:
+        result = await session.execute(_post_cards_select(columns).where(Post.idposts == post_id))
+        row = result.mappings().first()
         
-        if not post:
-            return False
+        if not row:
+            return None
         
-        await session.delete(post)
-        await session.commit()
-        return True
+        post = dict(row)
+        if "tags" in fields:
+            # Fetch associated tags (limit to 5)
+            tags_result = await session.execute(
+                select(Tag.idtag, Tag.name).join(post_tags).where(post_tags.c.post_id == post_id).limit(5)
+            )
+            post["tags"] = [{"idtag": tag.idtag, "name": tag.name} for tag in tags_result]
+        return post
 
 
-async def get_user_posts(user_id: int):
+async def delete_post(post_id: int) -> bool:
+    # One statement; comments, ratings and tag links go with it through ON DELETE CASCADE.
+    # For posts too large to remove in one transaction, see remove_user.py --post.
     async with async_session() as session:
         result = await session.execute(
-            select(Post).where(Post.author_id == user_id).order_by(Post.date.desc())
+            delete(Post).where(Post.idposts == post_id).returning(Post.author_id)
         )
-        posts = result.scalars().all()
-        
-        posts_with_ratings = []
-        for post in posts:
-            author = await get_user_by_id(post.author_id)
-            rating = await get_post_rating(post.idposts)
-            comments_count = await get_post_comments_count(post.idposts)
-            posts_with_ratings.append({
-                "idposts": post.idposts,
-                "title": post.title,
-                "text": post.text,
-                "date": post.date,
-                "author_id": post.author_id,
-                "author_name": author.username if author else "Unknown",
-                "rating": rating["total"],
-                "comment_count": comments_count,
-                "view_count": post.view_count or 0
-            })
-        return posts_with_ratings
+        author_id = result.scalar()
+        if author_id is None:
+            return False
+        await session.commit()
+    await invalidate(f"post:{post_id}", f"user:{author_id}", "feed", "tags", "leaderboards")
+    return True
+
+
+async def get_user_posts(user_id: int, fields: Optional[tuple] = None):
+    return await _fetch_post_cards(
+        _post_cards_select(fields).where(Post.author_id == user_id).order_by(Post.date.desc())
+    )
 
 
 async def promote_user_to_moderator(user_id: int) -> bool:
@@ -232,7 +326,8 @@ async def promote_user_to_moderator(user_id: int) -> bool:
         
         user.role = "moderator"
         await session.commit()
-        return True
+    await invalidate(f"user:{user_id}")
+    return True
 
 
 async def demote_user_to_user(user_id: int) -> bool:
@@ -245,7 +340,19 @@ async def demote_user_to_user(user_id: int) -> bool:
 
         user.role = "user"
         await session.commit()
-        return True
+    await invalidate(f"user:{user_id}")
+    return True
+
+
+async def _touch_post(session, post_id: int) -> Optional[int]:
+    """Bump a post's updated_at so HTTP validators of its representations change.
+
+    Returns the post's author_id (None if the post does not exist).
+    """
+    result = await session.execute(
+        update(Post).where(Post.idposts == post_id).values(updated_at=datetime.utcnow()).returning(Post.author_id)
+    )
+    return result.scalar()
 
 
 async def create_comment(post_id: int, text: str, author_id: int, parent_id: int = None) -> Comment:
@@ -255,49 +362,70 @@ async def create_comment(post_id: int, text: str, author_id: int, parent_id: int
     new_comment = Comment(text=text, author_id=author_id, post=post_id, parent_id=parent_id)
     async with async_session() as session:
         session.add(new_comment)
+        await _touch_post(session, post_id)
         await session.commit()
         await session.refresh(new_comment)
+    await invalidate(f"post:{post_id}")
     return new_comment
 
 
-async def get_comments_by_post(post_id: int):
-    async with async_session() as session:
-        result = await session.execute(select(Comment).where(Comment.post == post_id).order_by(Comment.date.asc()))
-        comments = result.scalars().all()
-
-        comments_with_authors = []
-        for c in comments:
-            author = await get_user_by_id(c.author_id)
-            comments_with_authors.append({
-                "idcomments": c.idcomments,
-                "text": c.text,
-                "author_id": c.author_id,
-                "author_name": author.username if author else "Unknown",
-                "author_role": author.role if author else "user",
-                "parent_id": c.parent_id,
-                "date": c.date,
-            })
-        return comments_with_authors
+async def get_comments_version(post_id: int) -> tuple:
+    """Cheap validator for a post's comment thread: count, newest id and latest author change."""
+    async with read_session() as session:
+        result = await session.execute(
+            select(func.count(Comment.idcomments), func.max(Comment.idcomments), func.max(User.updated_at))
+            .select_from(Comment)
+            .outerjoin(User, User.id == Comment.author_id)
+            .where(Comment.post == post_id)
+        )
+        return tuple(result.one())
+
+
+async def get_comments_by_post(post_id: int, limit: Optional[int] = None, offset: int = 0):
+    """Get comments of a post (oldest first) with their authors; ``limit``/``offset`` page through them."""
+    async with read_session() as session:
+        stmt = (
+            select(
+                Comment.idcomments,
+                Comment.text,
+                Comment.author_id,
+                func.coalesce(User.username, "Unknown").label("author_name"),
+                func.coalesce(User.role, "user").label("author_role"),
+                Comment.parent_id,
+                Comment.date,
+            )
+            .outerjoin(User, User.id == Comment.author_id)
+            .where(Comment.post == post_id)
+            # idcomments breaks ties so offset paging neither repeats nor skips comments
+            .order_by(Comment.date.asc(), Comment.idcomments.asc())
+            .offset(offset)
+        )
+        if limit is not None:
+            stmt = stmt.limit(limit)
+        result = await session.execute(stmt)
+        return [dict(row) for row in result.mappings()]
 
 
 async def get_comment_by_id(comment_id: int):
-    async with async_session() as session:
+    async with read_session() as session:
         result = await session.execute(select(Comment).where(Comment.idcomments == comment_id))
         comment = result.scalars().first()
         return comment
 
 
 async def delete_comment(comment_id: int) -> bool:
+    # Replies are removed by the database (parent_id ON DELETE CASCADE)
     async with async_session() as session:
-        result = await session.execute(select(Comment).where(Comment.idcomments == comment_id))
-        comment = result.scalars().first()
-
-        if not comment:
+        result = await session.execute(
+            delete(Comment).where(Comment.idcomments == comment_id).returning(Comment.post)
+        )
+        post_id = result.scalar()
+        if post_id is None:
             return False
-
-        await session.delete(comment)
+        await _touch_post(session, post_id)
         await session.commit()
-        return True
+    await invalidate(f"post:{post_id}")
+    return True
 
 
 async def ban_user(user_id: int) -> bool:
@@ -310,7 +438,8 @@ async def ban_user(user_id: int) -> bool:
 
         user.is_banned = True
         await session.commit()
-        return True
+    await invalidate(f"user:{user_id}")
+    return True
 
 
 async def unban_user(user_id: int) -> bool:
@@ -323,43 +452,153 @@ async def unban_user(user_id: int) -> bool:
 
         user.is_banned = False
         await session.commit()
-        return True
+    await invalidate(f"user:{user_id}")
+    return True
 
 
-async def search_posts(query: str):
-    """Search posts by title or text content."""
-    if len(query) > 150:
-        raise ValueError("Search query cannot exceed 150 characters")
-    
+def _ids_param(name: str, ids: list[int]):
+    """One array parameter (``= ANY($1)``), so the statement text does not vary with the list length."""
+    return any_(bindparam(name, list(ids), type_=ARRAY(Integer)))
+
+
+def _actor_is(actor_id: int, roles: tuple):
+    """SQL condition: the acting user currently has one of ``roles`` and is not banned.
+
+    Checked in the statement itself, so a role revoked after the request
+    authenticated still stops it.
+    """
+    actor = aliased(User)
+    return exists().where(actor.id == actor_id, actor.role.in_(roles), actor.is_banned.isnot(True))
+
+
+def _moderatable_by(actor_id: int):
+    """SQL condition on User: targets a moderator or admin may ban or unban.
+    Nobody acts on themselves or on an admin."""
+    return (
+        User.id != actor_id,
+        func.coalesce(User.role, "user") != "admin",
+        _actor_is(actor_id, ("admin", "moderator")),
+    )
+
+
+async def bulk_set_banned(actor_id: int, user_ids: list[int], banned: bool) -> list[int]:
+    """Ban or unban many users in one statement; returns the ids that changed.
+
+    Users the actor may not moderate, unknown ids and users already in the
+    requested state are left out.
+    """
+    async with async_session() as session:
+        result = await session.execute(
+            update(User)
+            .where(User.id == _ids_param("user_ids", user_ids), User.is_banned.is_distinct_from(banned), *_moderatable_by(actor_id))
+            .values(is_banned=banned)
+            .returning(User.id)
+            .execution_options(synchronize_session=False)
+        )
+        changed = list(result.scalars())
+        await session.commit()
+    await invalidate(*(f"user:{user_id}" for user_id in changed))
+    return changed
+
+
+async def bulk_set_role(actor_id: int, user_ids: list[int], role: str) -> list[int]:
+    """Promote users to moderator (role="moderator") or demote moderators (role="user")
+    in one statement; only admins may. Returns the ids that changed."""
+    if role not in ("user", "moderator"):
+        raise ValueError("Role must be 'user' or 'moderator'")
+    # Promotion only applies to plain users and demotion only to moderators, never to admins
+    current_role = "user" if role == "moderator" else "moderator"
     async with async_session() as session:
-        # Search in both title and text, case-insensitive
         result = await session.execute(
-            select(Post)
+            update(User)
             .where(
-                (Post.title.ilike(f"%{query}%")) | (Post.text.ilike(f"%{query}%"))
+                User.id == _ids_param("user_ids", user_ids),
+                func.coalesce(User.role, "user") == current_role,
+                User.id != actor_id,
+                _actor_is(actor_id, ("admin",)),
             )
-            .order_by(Post.date.desc())
+            .values(role=role)
+            .returning(User.id)
+            .execution_options(synchronize_session=False)
+        )
+        changed = list(result.scalars())
+        await session.commit()
+    await invalidate(*(f"user:{user_id}" for user_id in changed))
+    return changed
+
+
+async def purge_user_content(actor_id: int, user_ids: list[int]) -> dict:
+    """Delete all posts and comments of many users, in a fixed number of statements.
+
+    Ratings, tags and comments of the deleted posts and replies to the deleted
+    comments go with them through the ON DELETE CASCADE foreign keys. Returns
+    the users purged and the number of posts and comments deleted.
+    """
+    async with async_session() as session:
+        targets = (await session.execute(
+            select(User.id).where(
+                User.id == _ids_param("user_ids", user_ids),
+                *_moderatable_by(actor_id),
+                # Like deleting a single post or comment: moderators only remove content of plain users
+                or_(_actor_is(actor_id, ("admin",)), func.coalesce(User.role, "user") == "user"),
+            )
+        )).scalars().all()
+        if not targets:
+            return {"users": [], "posts": 0, "comments": 0}
+
+        deleted_posts = (await session.execute(
+            delete(Post).where(Post.author_id == _ids_param("user_ids", targets)).returning(Post.idposts)
+        )).scalars().all()
+        deleted_comments = (await session.execute(
+            delete(Comment).where(Comment.author_id == _ids_param("user_ids", targets)).returning(Comment.post)
+        )).scalars().all()
+        # Surviving posts that lost comments get new validators
+        touched = (await session.execute(
+            update(Post)
+            .where(Post.idposts == _ids_param("post_ids", set(deleted_comments)))
+            .values(updated_at=datetime.utcnow())
+            .returning(Post.idposts)
+            .execution_options(synchronize_session=False)
+        )).scalars().all()
+        await session.commit()
+
+    namespaces = [f"user:{user_id}" for user_id in targets]
+    namespaces += [f"post:{post_id}" for post_id in set(deleted_posts) | set(touched)]
+    if deleted_posts:
+        namespaces += ["feed", "tags", "leaderboards"]
+    await invalidate(*namespaces)
+    return {"users": list(targets), "posts": len(deleted_posts), "comments": len(deleted_comments)}
+
+
+async def search_posts(query: str, fields: Optional[tuple] = None):
+    """Search posts by title or text content."""
+    if len(query) > 150:
+        raise ValueError("Search query cannot exceed 150 characters")
+    
+    # Search in both title and text, case-insensitive
+    return await _fetch_post_cards(
+        _post_cards_select(fields)
+        .where(
+            (Post.title.ilike(f"%{query}%")) | (Post.text.ilike(f"%{query}%"))
         )
-        posts = result.scalars().all()
-
-        posts_with_authors = []
-        for post in posts:
-            author = await get_user_by_id(post.author_id)
-            rating = await get_post_rating(post.idposts)
-            comments_count = await get_post_comments_count(post.idposts)
-            posts_with_authors.append({
-                "idposts": post.idposts,
-                "title": post.title,
-                "text": post.text,
-                "date": post.date,
-                "author_id": post.author_id,
-                "author_name": author.username if author else "Unknown",
-                "rating": rating["total"],
-                "comment_count": comments_count,
-                "view_count": post.view_count or 0
-            })
-        return posts_with_authors
+        .order_by(Post.date.desc())
+    )
+
 
+async def stream_search_posts(query: str, fields: Optional[tuple] = None) -> AsyncIterator[dict]:
+    """Stream search results through a server-side cursor."""
+    if len(query) > 150:
+        raise ValueError("Search query cannot exceed 150 characters")
+
+    async with read_session() as session:
+        result = await session.stream(
+            _post_cards_select(fields)
+            .where((Post.title.ilike(f"%{query}%")) | (Post.text.ilike(f"%{query}%")))
+            .order_by(Post.date.desc())
+            .execution_options(yield_per=STREAM_BATCH_SIZE)
+        )
+        async for row in result.mappings():
+            yield dict(row)
 
 
 async def create_tag(name: str) -> Optional[Tag]:
@@ -382,82 +621,48 @@ async def create_tag(name: str) -> Optional[Tag]:
         session.add(new_tag)
         await session.commit()
         await session.refresh(new_tag)
-        return new_tag
+    await invalidate("tags")
+    return new_tag
 
-async def get_posts_by_tag(tag_id: int):
+async def get_posts_by_tag(tag_id: int, fields: Optional[tuple] = None):
     """Get all posts associated with a specific tag."""
-    async with async_session() as session:
-        # Query posts through the junction table
-        result = await session.execute(
-            select(Post)
-            .join(post_tags)
-            .where(post_tags.c.tag_id == tag_id)
-            .order_by(Post.date.desc())
-        )
-        posts = result.scalars().all()
-        
-        posts_with_authors = []
-        for post in posts:
-            author = await get_user_by_id(post.author_id)
-            rating = await get_post_rating(post.idposts)
-            comments_count = await get_post_comments_count(post.idposts)
-            posts_with_authors.append({
-                "idposts": post.idposts,
-                "title": post.title,
-                "text": post.text,
-                "date": post.date,
-                "author_id": post.author_id,
-                "author_name": author.username if author else "Unknown",
-                "rating": rating["total"],
-                "comment_count": comments_count,
-                "view_count": post.view_count or 0
-            })
-        return posts_with_authors
-
-async def search_users(query: str):
+    # Query posts through the junction table
+    return await _fetch_post_cards(
+        _post_cards_select(fields)
+        .join(post_tags, post_tags.c.post_id == Post.idposts)
+        .where(post_tags.c.tag_id == tag_id)
+        .order_by(Post.date.desc())
+    )
+
+
+async def search_users(query: str, fields: Optional[tuple] = None):
     """Search users by username with partial matches."""
     if len(query) > 100:
         raise ValueError("Search query cannot exceed 100 characters")
     
-    async with async_session() as session:
+    async with read_session() as session:
         # Search by username, case-insensitive
         result = await session.execute(
-            select(User)
+            _users_select(fields or USER_FIELDS)
             .where(User.username.ilike(f"%{query}%"))
             .order_by(User.username)
         )
-        users = result.scalars().all()
-        
-        return [
-            {
-                "id": user.id,
-                "username": user.username,
-                "role": user.role,
-                "is_banned": user.is_banned,
-                "registration_date": user.registration_date
-            }
-            for user in users
-        ]
+        return [dict(row) for row in result.mappings()]
 
 
 async def get_post_rating(post_id: int) -> dict:
     """Get the rating count for a post (positive - negative)."""
-    async with async_session() as session:
-        # Count positive ratings
-        positive_result = await session.execute(
-            select(func.count(Rating.id)).where(
-                (Rating.post_id == post_id) & (Rating.is_positive == True)
-            )
-        )
-        positive_count = positive_result.scalar() or 0
-        
-        # Count negative ratings
-        negative_result = await session.execute(
-            select(func.count(Rating.id)).where(
-                (Rating.post_id == post_id) & (Rating.is_positive == False)
-            )
+    async with read_session() as session:
+        # Count positive and negative ratings in one pass
+        result = await session.execute(
+            select(
+                func.count(Rating.id).filter(Rating.is_positive == True).label("positive"),
+                func.count(Rating.id).filter(Rating.is_positive == False).label("negative"),
+            ).where(Rating.post_id == post_id)
         )
-        negative_count = negative_result.scalar() or 0
+        row = result.one()
+        positive_count = row.positive or 0
+        negative_count = row.negative or 0
         
         return {
             "post_id": post_id,
@@ -469,7 +674,7 @@ async def get_post_rating(post_id: int) -> dict:
 
 async def user_rated_post(user_id: int, post_id: int) -> Optional[dict]:
     """Check if a user has rated a post and return the rating details."""
-    async with async_session() as session:
+    async with read_session() as session:
         result = await session.execute(
             select(Rating).where(
                 (Rating.user_id == user_id) & (Rating.post_id == post_id)
@@ -486,7 +691,7 @@ async def user_rated_post(user_id: int, post_id: int) -> Optional[dict]:
 
 async def get_user_total_rating(user_id: int) -> int:
     """Get the total rating sum for all posts by a user (positive - negative)."""
-    async with async_session() as session:
+    async with read_session() as session:
         # Get all posts by the user
         posts_result = await session.execute(
             select(Post.idposts).where(Post.author_id == user_id)
@@ -525,41 +730,40 @@ async def create_or_update_rating(user_id: int, post_id: int, is_positive: bool)
         )
         existing_rating = result.scalars().first()
         
+        author_id = await _touch_post(session, post_id)
         if existing_rating:
             # Update existing rating
             existing_rating.is_positive = is_positive
-            await session.commit()
-            await session.refresh(existing_rating)
-            return existing_rating
+            rating = existing_rating
         else:
             # Create new rating
-            new_rating = Rating(user_id=user_id, post_id=post_id, is_positive=is_positive)
-            session.add(new_rating)
-            await session.commit()
-            await session.refresh(new_rating)
-            return new_rating
+            rating = Rating(user_id=user_id, post_id=post_id, is_positive=is_positive)
+            session.add(rating)
+        await session.commit()
+        await session.refresh(rating)
+    await invalidate(f"post:{post_id}", f"user:{author_id}", "leaderboards")
+    return rating
 
 
 async def delete_rating(user_id: int, post_id: int) -> bool:
     """Delete a rating by a user for a post."""
     async with async_session() as session:
         result = await session.execute(
-            select(Rating).where(
+            delete(Rating).where(
                 (Rating.user_id == user_id) & (Rating.post_id == post_id)
-            )
+            ).returning(Rating.id)
         )
-        rating = result.scalars().first()
-        
-        if rating:
-            await session.delete(rating)
-            await session.commit()
-            return True
-        return False
+        if result.scalar() is None:
+            return False
+        author_id = await _touch_post(session, post_id)
+        await session.commit()
+    await invalidate(f"post:{post_id}", f"user:{author_id}", "leaderboards")
+    return True
 
 
 async def get_post_comments_count(post_id: int) -> int:
     """Get the count of comments for a post."""
-    async with async_session() as session:
+    async with read_session() as session:
         result = await session.execute(
             select(func.count(Comment.idcomments)).where(Comment.post == post_id)
         )
@@ -567,18 +771,30 @@ async def get_post_comments_count(post_id: int) -> int:
         return count
 
 
+async def record_post_view(post_id: int) -> Optional[dict]:
+    """Increment the view count for a post in one statement.
+
+    Returns the new ``view_count`` and the post's ``author_id``, or None if
+    the post does not exist. The commit does not pin the request's reads to
+    the primary (see db.async_untracked_session).
+    """
+    async with async_untracked_session() as session:
+        result = await session.execute(
+            update(Post)
+            .where(Post.idposts == post_id)
+            # Keep updated_at (the post's HTTP validator, see onupdate): a view must not
+            # make every client's copy stale. view_count in GET /posts/{id} may lag for it.
+            .values(view_count=func.coalesce(Post.view_count, 0) + 1, updated_at=Post.updated_at)
+            .returning(Post.view_count, Post.author_id)
+        )
+        row = result.first()
+        await session.commit()
+        return {"view_count": row.view_count, "author_id": row.author_id} if row else None
+
+
 async def increment_post_views(post_id: int) -> bool:
     """Increment the view count for a post."""
-    async with async_session() as session:
-        result = await session.execute(select(Post).where(Post.idposts == post_id))
-        post = result.scalars().first()
-        
-        if post:
-            post.view_count = (post.view_count or 0) + 1
-            await session.commit()
-            return True
-        return False
-
+    return await record_post_view(post_id) is not None
 
 
 async def send_private_message(user_from_id: int, user_to_id: int, text: str) -> Optional[PrivateMessage]:
@@ -604,66 +820,80 @@ async def send_private_message(user_from_id: int, user_to_id: int, text: str) ->
     return new_message
 
 
+def _conversation_select(user_id: int, other_user_id: int):
+    """Messages between two users, oldest first, with the sender's name joined in."""
+    return (
+        select(
+            PrivateMessage.id,
+            PrivateMessage.user_from,
+            PrivateMessage.user_to,
+            func.coalesce(User.username, "Unknown").label("sender_name"),
+            PrivateMessage.text,
+            PrivateMessage.date,
+        )
+        .outerjoin(User, User.id == PrivateMessage.user_from)
+        .where(
+            ((PrivateMessage.user_from == user_id) & (PrivateMessage.user_to == other_user_id)) |
+            ((PrivateMessage.user_from == other_user_id) & (PrivateMessage.user_to == user_id))
+        )
+        .order_by(PrivateMessage.date.asc())
+    )
+
+
 async def get_conversation(user_id: int, other_user_id: int) -> list[dict]:
     """Get all messages in a conversation between two users."""
-    async with async_session() as session:
-        result = await session.execute(
-            select(PrivateMessage).where(
-                ((PrivateMessage.user_from == user_id) & (PrivateMessage.user_to == other_user_id)) |
-                ((PrivateMessage.user_from == other_user_id) & (PrivateMessage.user_to == user_id))
-            ).order_by(PrivateMessage.date.asc())
+    async with read_session() as session:
+        result = await session.execute(_conversation_select(user_id, other_user_id))
+        return [dict(row) for row in result.mappings()]
+
+
+async def stream_conversation(user_id: int, other_user_id: int) -> AsyncIterator[dict]:
+    """Stream the messages of a conversation through a server-side cursor."""
+    async with read_session() as session:
+        result = await session.stream(
+            _conversation_select(user_id, other_user_id).execution_options(yield_per=STREAM_BATCH_SIZE)
         )
-        messages = result.scalars().all()
-        
-        messages_data = []
-        for msg in messages:
-            sender = await get_user_by_id(msg.user_from)
-            messages_data.append({
-                "id": msg.id,
-                "user_from": msg.user_from,
-                "user_to": msg.user_to,
-                "sender_name": sender.username if sender else "Unknown",
-                "text": msg.text,
-                "date": msg.date
-            })
-        return messages_data
+        async for row in result.mappings():
+            yield dict(row)
 
 
 async def get_user_conversations(user_id: int) -> list[dict]:
-    """Get all users this user has had conversations with."""
-    async with async_session() as session:
+    """Get all users this user has had conversations with, most recent first."""
+    other_user_id = case(
+        (PrivateMessage.user_from == user_id, PrivateMessage.user_to),
+        else_=PrivateMessage.user_from,
+    )
+    partners = (
+        select(other_user_id.label("id"), func.max(PrivateMessage.date).label("last_message_date"))
+        .where((PrivateMessage.user_from == user_id) | (PrivateMessage.user_to == user_id))
+        .group_by(other_user_id)
+        .subquery()
+    )
+    async with read_session() as session:
         result = await session.execute(
-            select(PrivateMessage).where(
-                (PrivateMessage.user_from == user_id) | (PrivateMessage.user_to == user_id)
-            ).order_by(PrivateMessage.date.desc())
+            select(
+                partners.c.id,
+                func.coalesce(User.username, "Unknown").label("username"),
+                partners.c.last_message_date,
+            )
+            .outerjoin(User, User.id == partners.c.id)
+            .order_by(partners.c.last_message_date.desc())
         )
-        messages = result.scalars().all()
-        
-        # Get unique users from conversation
-        conversation_users = {}
-        for msg in messages:
-            other_user_id = msg.user_to if msg.user_from == user_id else msg.user_from
-            if other_user_id not in conversation_users:
-                other_user = await get_user_by_id(other_user_id)
-                conversation_users[other_user_id] = {
-                    "id": other_user_id,
-                    "username": other_user.username if other_user else "Unknown",
-                    "last_message_date": msg.date
-                }
-        
-        return list(conversation_users.values())
+        return [dict(row) for row in result.mappings()]
 
 
-async def save_profile_photo(user_id: int, filename: str) -> bool:
-    """Save profile photo filename for a user."""
+async def save_profile_photo(user_id: int, filename: str, variants: Optional[dict] = None) -> bool:
+    """Save profile photo filename (and the avatar variants, see images.save_avatars) for a user."""
     async with async_session() as session:
         result = await session.execute(select(User).where(User.id == user_id))
         user = result.scalars().first()
         if not user:
             return False
         user.profile_photo = filename
+        user.profile_photos = variants
         await session.commit()
-        return True
+    await invalidate(f"user:{user_id}")
+    return True
 
 
 async def delete_profile_photo(user_id: int) -> bool:
@@ -674,15 +904,18 @@ async def delete_profile_photo(user_id: int) -> bool:
         if not user:
             return False
         user.profile_photo = None
+        user.profile_photos = None
         await session.commit()
-        return True
+    await invalidate(f"user:{user_id}")
+    return True
 
 
+@cached("leaderboards", ttl=60, stale_ttl=120)
 async def get_top_posters(days: int = 7, limit: int = 5):
     """Get top posters by total post views for the last N days."""
     from datetime import datetime, timedelta
     
-    async with async_session() as session:
+    async with read_session() as session:
         start_date = datetime.utcnow() - timedelta(days=days)
         
         # Get posts from last N days with their authors and view counts
@@ -706,11 +939,12 @@ async def get_top_posters(days: int = 7, limit: int = 5):
         ]
 
 
+@cached("leaderboards", ttl=60, stale_ttl=120)
 async def get_top_posts(days: int = 7, limit: int = 5):
     """Get top posts by view count for the last N days."""
     from datetime import datetime, timedelta
     
-    async with async_session() as session:
+    async with read_session() as session:
         start_date = datetime.utcnow() - timedelta(days=days)
         
         result = await session.execute(
@@ -6,6 +6,8 @@ export interface User {
   registration_date?: string;
   total_rating?: number;
   profile_photo?: string;
+  // Avatar files by size ("32", "64", "128", "256") and format ("webp", "png")
+  profile_photos?: Record<string, Record<string, string>>;
 }
 
 export interface Tag {
@@ -37,6 +39,14 @@ export interface Comment {
   date: string;
 }
 
+export interface PostPageData {
+  post: Post;
+  rating: { post_id: number; positive: number; negative: number; total: number };
+  user_rating: { rated: boolean; is_positive?: boolean };
+  comments: Comment[];
+  author: User | null;
+}
+
 export interface PrivateMessage {
   id: number;
   user_from: number;
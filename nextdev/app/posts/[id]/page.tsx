@@ -6,9 +6,11 @@ import DeletePostButton from "@/app/components/DeletePostButton";
 import CreateCommentForm from "@/app/components/CreateCommentForm";
 import CommentThread from "@/app/components/CommentThread";
 import RatingButtons from "@/app/components/RatingButtons";
-import { getCurrentUser } from "@/app/lib/auth";
-import { Post } from "@/app/lib/types";
-import { Comment } from "@/app/lib/types";
+import { getCookieHeader, getCurrentUser } from "@/app/lib/auth";
+import { Comment, PostPageData } from "@/app/lib/types";
+
+// Comments fetched per request; long threads are loaded page by page
+const COMMENTS_PAGE_SIZE = 500;
 
 interface PageProps {
   params: Promise<{
@@ -27,40 +29,39 @@ export default async function PostPage({ params }: PageProps) {
     redirect("/login");
   }
 
-  // Fetch the specific post
-  const postRes = await fetch(`http://localhost:8000/posts/${resolvedParams.id}`, {
+  // Fetch the post, its comments and rating in one request (also records the view)
+  const pageRes = await fetch(`http://localhost:8000/posts/${resolvedParams.id}/page?comments_limit=${COMMENTS_PAGE_SIZE}`, {
+    headers: { cookie: await getCookieHeader() },
     cache: "no-store",
   });
 
-  if (!postRes.ok) {
+  if (!pageRes.ok) {
     redirect("/");
   }
 
-  const post: Post = await postRes.json();
-
-  // Increment view count
-  try {
-    await fetch(`http://localhost:3000/api/posts/${resolvedParams.id}/view`, {
-      method: 'POST',
-    });
-  } catch (err) {
-    console.error('Failed to increment view:', err);
+  const { post, comments }: PostPageData = await pageRes.json();
+
+  // The page response carries the first page of comments; fetch the rest of the thread
+  let commentsIncomplete = false;
+  let lastPageSize = comments.length;
+  while (lastPageSize === COMMENTS_PAGE_SIZE) {
+    const commentsRes = await fetch(
+      `http://localhost:8000/posts/${resolvedParams.id}/comments?limit=${COMMENTS_PAGE_SIZE}&offset=${comments.length}`,
+      { cache: "no-store" },
+    );
+    if (!commentsRes.ok) {
+      commentsIncomplete = true;
+      break;
+    }
+    const page: Comment[] = await commentsRes.json();
+    comments.push(...page);
+    lastPageSize = page.length;
   }
 
   // Check if current user is the author or has moderator/admin role
   const isAuthor = currentUser.id === post.author_id;
   const isModeratorOrAdmin = currentUser.role === "moderator" || currentUser.role === "admin";
 
-  // Fetch comments for this post
-  const commentsRes = await fetch(`http://localhost:8000/posts/${resolvedParams.id}/comments`, {
-    cache: "no-store",
-  });
-
-  let comments: Comment[] = [];
-  if (commentsRes.ok) {
-    comments = await commentsRes.json();
-  }
-
   // Calculate reading time (200 words per minute)
   const wordCount = post.text.split(/\s+/).length;
   const readingTime = Math.ceil(wordCount / 200);
@@ -166,6 +167,12 @@ export default async function PostPage({ params }: PageProps) {
                 </div>
               )}
 
+              {commentsIncomplete && (
+                <p className="mt-4 text-sm text-gray-600 dark:text-gray-400">
+                  Показаны не все комментарии. Обновите страницу, чтобы загрузить остальные.
+                </p>
+              )}
+
               {/* Create comment form */}
               <CreateCommentForm postId={post.idposts} />
             </div>
@@ -9,6 +9,11 @@ import DeleteProfilePhotoButton from "@/app/components/DeleteProfilePhotoButton"
 import { getCurrentUser } from "@/app/lib/auth";
 import { User, Post } from "@/app/lib/types";
 
+// Avatar file names are content hashed, so the URLs can be cached forever
+function photoUrl(filename: string) {
+  return `http://localhost:8000/uploads/profile_photos/${filename}`;
+}
+
 interface PageProps {
   params: Promise<{
     id: string;
@@ -72,9 +77,24 @@ export default async function ProfilePage({ params }: PageProps) {
                 {/* Profile Photo */}
                 <div className="flex flex-col items-center">
                   <div className="w-32 h-32 rounded-lg bg-gray-200 dark:bg-gray-700 flex items-center justify-center overflow-hidden border border-gray-300 dark:border-gray-600">
-                    {profileUser.profile_photo ? (
+                    {profileUser.profile_photos ? (
+                      <picture>
+                        <source
+                          type="image/webp"
+                          srcSet={`${photoUrl(profileUser.profile_photos["128"].webp)} 1x, ${photoUrl(profileUser.profile_photos["256"].webp)} 2x`}
+                        />
+                        <img
+                          src={photoUrl(profileUser.profile_photos["128"].png)}
+                          srcSet={`${photoUrl(profileUser.profile_photos["256"].png)} 2x`}
+                          alt={profileUser.username}
+                          width={128}
+                          height={128}
+                          className="w-full h-full object-cover"
+                        />
+                      </picture>
+                    ) : profileUser.profile_photo ? (
                       <img
-                        src={`http://localhost:8000/uploads/profile_photos/${profileUser.profile_photo}?t=${Date.now()}`}
+                        src={photoUrl(profileUser.profile_photo)}
                         alt={profileUser.username}
                         className="w-full h-full object-cover"
                       />